@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- query plans and timings for tournament.py at scale
+#
+# Builds a synthetic tournament in the tournament database and shows how the
+# database runs the queries on the hot paths. Run it against a scratch
+# database; every run adds a new tournament.
+#
+#   python benchmark.py --players 1000 --rounds 5
+#
+# With --suite, it times the main functions on tournaments of every size and
+# length given, and can save the timings as a baseline to compare later runs
+# against:
+#
+#   python benchmark.py --suite --save baseline.json
+#   python benchmark.py --suite --baseline baseline.json
+#
+
+from __future__ import division
+
+import argparse
+import json
+import math
+import random
+from timeit import default_timer as timer
+
+from tournament import *
+
+
+# the indexes added for the standings, rematch and pairing queries; with
+# --before they are dropped (inside a transaction that is rolled back) so the
+# plans show what the database did without them
+INDEXES = [
+    'one_match_per_pair',
+    'matches_by_winner',
+    'matches_by_loser',
+    'players_by_registrant',
+    'standings_by_rank',
+]
+
+# the tournament sizes and lengths (rounds already played) --suite runs
+SUITE_PLAYERS = [16, 100, 1000]
+SUITE_ROUNDS = [1, 5, 15]
+# the sizes --suite adds with --large; these take minutes to build and pair,
+# and far longer with --plans (the unmatched pairs of 10000 players are some
+# 50 million rows)
+LARGE_SUITE_PLAYERS = [10000]
+
+# the queries to explain; each takes the tournament ID and a player ID
+QUERIES = [
+    (
+        'standings',
+        'SELECT player_id, player_name, count_wins, count_matches, omw '
+        'FROM player_standings WHERE tournament_id = %(tournament)s',
+    ),
+    (
+        'rematch check',
+        'SELECT COUNT(*) FROM matches WHERE tournament_id = %(tournament)s '
+        'AND loser IS NOT NULL '
+        'AND LEAST(winner, loser) = LEAST(%(player)s, %(player)s + 1) '
+        'AND GREATEST(winner, loser) = GREATEST(%(player)s, %(player)s + 1)',
+    ),
+    (
+        'player wins',
+        'SELECT COUNT(*) FROM matches WHERE tournament_id = %(tournament)s '
+        'AND winner = %(player)s AND is_tie = FALSE',
+    ),
+    (
+        'unmatched pairs',
+        'SELECT COUNT(*) FROM unmatched_pairs '
+        'WHERE tournament_id = %(tournament)s',
+    ),
+]
+
+
+def buildTournament(player_count, rounds, seed=0):
+    """Creates a tournament with random results for the given rounds.
+
+    Pairings are random (a round robin, in a random order), not Swiss, so
+    building even a large tournament doesn't depend on the speed of
+    swissPairings(). No two players meet twice and no one gets two byes, as
+    long as rounds is less than the number of players.
+
+    Args:
+      player_count: the number of players to register
+      rounds: the number of rounds of results to report
+      seed: seed for the random number generator, for repeatable runs
+
+    Returns:
+      The ID of the new tournament
+    """
+    rng = random.Random(seed)
+    tournament_id = createTournament('Benchmark %s x %s' % (player_count,
+                                                            rounds))
+    player_ids = registerPlayers(
+        ('Player %s' % i for i in range(player_count)), tournament_id)
+
+    seats = list(player_ids)
+    rng.shuffle(seats)
+    if (len(seats) % 2 != 0):
+        seats.append(0)  # whoever sits opposite this seat gets the bye
+
+    for i in range(rounds):
+        results = []
+        half = len(seats) // 2
+        for (one, two) in zip(seats[:half], reversed(seats[half:])):
+            if (one == 0 or two == 0):
+                results.append((one or two, 0))
+            else:
+                results.append((one, two, rng.random() < 0.05))
+        reportRound(tournament_id, results)
+
+        # the circle method: the first seat stays put and everyone else
+        # moves round one place
+        seats.insert(1, seats.pop())
+
+    return tournament_id
+
+
+def explain(cursor, sql, data):
+    """Returns the EXPLAIN ANALYZE output for a query as one string."""
+    cursor.execute('EXPLAIN ANALYZE ' + sql, data)
+    return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def collectPlans(tournament_id, before=False):
+    """Returns the query plan of every query in QUERIES.
+
+    Args:
+      tournament_id: the tournament to run the queries against
+      before: if True, drop the indexes in INDEXES first (the change is
+                rolled back afterwards)
+
+    Returns:
+      A list of (name, plan) tuples
+    """
+    data = {'tournament': tournament_id}
+    plans = []
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT MIN(id) FROM players WHERE tournament_id = %s',
+                    (tournament_id,))
+        data['player'] = cur.fetchone()[0]
+
+        if (before):
+            for index in INDEXES:
+                cur.execute('DROP INDEX IF EXISTS ' + index)
+
+        for (name, sql) in QUERIES:
+            plans.append((name, explain(cur, sql, data)))
+    finally:
+        conn.rollback()  # never keep the dropped indexes dropped
+        conn.close()
+
+    return plans
+
+
+def showPlans(tournament_id, before=False):
+    """Prints the query plan of every query in QUERIES (see collectPlans())."""
+    for (name, plan) in collectPlans(tournament_id, before):
+        print('-- %s (%s indexes)' % (name, 'without' if before else 'with'))
+        print(plan)
+        print('')
+
+
+def percentile(samples, p):
+    """Returns the p-th percentile (nearest rank) of a list of numbers."""
+    ordered = sorted(samples)
+    rank = int(math.ceil(p / 100 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarise(samples):
+    """Returns the p50 and p99 of a list of timings, in milliseconds."""
+    return {
+        'p50': percentile(samples, 50) * 1000,
+        'p99': percentile(samples, 99) * 1000,
+        'samples': len(samples),
+    }
+
+
+def timeCalls(function, args, repeat, before=None):
+    """Calls a function repeat times; returns how long each call took.
+
+    Args:
+      before: a function to call (untimed) ahead of each call, if any
+    """
+    samples = []
+    for i in range(repeat):
+        if (before is not None):
+            before()
+        start = timer()
+        function(*args)
+        samples.append(timer() - start)
+    return samples
+
+
+def benchmarkScenario(player_count, rounds, repeat=20, seed=0, plans=False):
+    """Times the main tournament functions on one synthetic tournament.
+
+    Args:
+      player_count: the number of players
+      rounds: the number of rounds already played when the timing starts
+      repeat: how many times to time each function
+      seed: seed for the random results
+      plans: if True, also record the EXPLAIN ANALYZE plans of QUERIES
+
+    Returns:
+      A dict with the p50 and p99 of each function under 'timings', and the
+        plans (if any) under 'plans'
+    """
+    timings = {}
+
+    # registering a whole field at once; each sample gets a new tournament,
+    # which is deleted again afterwards
+    samples = []
+    for i in range(min(repeat, 5)):
+        scratch = createTournament('Benchmark registration')
+        samples.extend(timeCalls(
+            registerPlayers,
+            (['Player %s' % n for n in range(player_count)], scratch), 1))
+        deleteTournament(scratch)
+    timings['registerPlayers'] = summarise(samples)
+
+    tournament_id = buildTournament(player_count, rounds, seed)
+
+    # the standings cache would hide the database, so empty it every time
+    timings['playerStandings'] = summarise(timeCalls(
+        playerStandings, (tournament_id,), repeat,
+        before=lambda: invalidateStandings(tournament_id)))
+
+    pairings = None
+    for mode in ('backtrack', 'matching', 'database'):
+        samples = timeCalls(swissPairings, (tournament_id, mode),
+                            max(1, repeat // 4))
+        timings['swissPairings(%s)' % mode] = summarise(samples)
+        if (pairings is None):
+            pairings = swissPairings(tournament_id, mode)
+
+    # report the next round one match at a time
+    if (type(pairings) is list):
+        matches = [(p[0], p[2], tournament_id) for p in pairings
+                   if p[2] is not None][:repeat]
+        samples = []
+        for match in matches:
+            samples.extend(timeCalls(reportMatch, match, 1))
+        if (samples):
+            timings['reportMatch'] = summarise(samples)
+
+    result = {'players': player_count, 'rounds': rounds, 'timings': timings}
+    if (plans):
+        result['plans'] = dict(collectPlans(tournament_id))
+    return result
+
+
+def runSuite(players=SUITE_PLAYERS, rounds=SUITE_ROUNDS, repeat=20, seed=0,
+             plans=False):
+    """Runs benchmarkScenario() for every size and length given.
+
+    Lengths that need more rounds than a round robin of that size has are
+    skipped.
+
+    Returns:
+      A dict of scenario name (e.g.: "1000x5") -> benchmarkScenario() result
+    """
+    results = {}
+    for player_count in players:
+        for round_count in rounds:
+            if (round_count >= player_count):
+                continue
+            name = '%sx%s' % (player_count, round_count)
+            results[name] = benchmarkScenario(player_count, round_count,
+                                              repeat, seed, plans)
+    return results
+
+
+def compareResults(results, baseline, tolerance=0.5):
+    """Compares the p50 timings of a run with a baseline run.
+
+    Args:
+      results, baseline: runSuite() results
+      tolerance: how much slower (as a fraction) a timing may get before it
+                   counts as a regression
+
+    Returns:
+      A list of (scenario, function, p50, baseline p50) tuples, one for each
+        regression
+    """
+    regressions = []
+    for (name, scenario) in sorted(results.items()):
+        old = baseline.get(name, {}).get('timings', {})
+        for (function, timing) in sorted(scenario['timings'].items()):
+            if (function not in old):
+                continue
+            if (timing['p50'] > old[function]['p50'] * (1 + tolerance)):
+                regressions.append((name, function, timing['p50'],
+                                    old[function]['p50']))
+    return regressions
+
+
+def printResults(results, baseline=None):
+    """Prints a table of runSuite() results, next to a baseline if given."""
+    print('%-12s %-26s %10s %10s %12s' % ('scenario', 'function', 'p50 ms',
+                                          'p99 ms', 'baseline p50'))
+    for (name, scenario) in sorted(
+            results.items(), key=lambda s: (s[1]['players'], s[1]['rounds'])):
+        old = (baseline or {}).get(name, {}).get('timings', {})
+        for (function, timing) in sorted(scenario['timings'].items()):
+            line = '%-12s %-26s %10.2f %10.2f' % (name, function,
+                                                  timing['p50'], timing['p99'])
+            if (function in old):
+                line += ' %12.2f' % old[function]['p50']
+            print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Show query plans for a synthetic tournament.')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--before', action='store_true',
+                        help='show only the plans without the indexes')
+    parser.add_argument('--after', action='store_true',
+                        help='show only the plans with the indexes')
+    parser.add_argument('--suite', action='store_true',
+                        help='time the main functions at every size in '
+                             '--sizes and length in --round-counts')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='the numbers of players (default: %s)'
+                             % ' '.join(str(n) for n in SUITE_PLAYERS))
+    parser.add_argument('--large', action='store_true',
+                        help='add tournaments of %s players to the default '
+                             'sizes' % ' and '.join(str(n) for n in
+                                                    LARGE_SUITE_PLAYERS))
+    parser.add_argument('--round-counts', type=int, nargs='+',
+                        default=SUITE_ROUNDS)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='how many times to time each function')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the suite results (e.g.: as a baseline)')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare the suite results with a saved run; '
+                             'exits with status 1 if anything got slower')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='how much slower (0.5 = 50%%) counts as a '
+                             'regression')
+    parser.add_argument('--plans', action='store_true',
+                        help='save the EXPLAIN ANALYZE plans of every '
+                             'scenario with the suite results')
+    parser.add_argument('--memory', action='store_true',
+                        help='run the suite on the in-memory backend (no '
+                             'plans)')
+    args = parser.parse_args()
+
+    if (args.suite):
+        if (args.memory):
+            useBackend('memory')
+        sizes = args.sizes
+        if (sizes is None):
+            sizes = SUITE_PLAYERS + (LARGE_SUITE_PLAYERS if args.large
+                                     else [])
+        results = runSuite(sizes, args.round_counts, args.repeat,
+                           args.seed, plans=args.plans and not args.memory)
+
+        baseline = None
+        if (args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        printResults(results, baseline)
+
+        if (args.save):
+            with open(args.save, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if (baseline is not None):
+            regressions = compareResults(results, baseline, args.tolerance)
+            for (name, function, p50, old_p50) in regressions:
+                print('REGRESSION %s %s: %.2f ms (was %.2f ms)' % (
+                    name, function, p50, old_p50))
+            if (regressions):
+                raise SystemExit(1)
+        raise SystemExit(0)
+
+    tournament_id = buildTournament(args.players, args.rounds, args.seed)
+
+    if (not args.after):
+        showPlans(tournament_id, before=True)
+    if (not args.before):
+        showPlans(tournament_id, before=False)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# feed.py -- live standings, pushed to subscribers as they change
+#
+# Instead of every display polling playerStandings(), a StandingsFeed LISTENs
+# for the notifications the database sends whenever a tournament's matches or
+# players change (see notify_standings_changed() in tournament.sql), reads
+# the new standings once per change, and sends each subscriber only the rows
+# that moved:
+#
+#   feed = StandingsFeed()
+#   for diff in feed.subscribe(tournament_id):
+#       standings = applyDiff(standings, diff)
+#       redraw(standings)
+#
+# or, to be called back from the feed's thread instead:
+#
+#   feed.subscribe(tournament_id, callback=redraw_rows)
+#
+
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+import tournament
+
+
+logger = logging.getLogger('tournament.feed')
+
+
+def standingsDiff(old, new):
+    """Returns what changed between two lists of standings rows.
+
+    Returns:
+      A dict of:
+        size: how many rows the new standings have
+        changes: a (position, row) tuple for every position (from 0) whose
+          row is new or different
+    """
+    changes = [(i, row) for (i, row) in enumerate(new)
+               if i >= len(old) or old[i] != row]
+    return {'size': len(new), 'changes': changes}
+
+
+def applyDiff(standings, diff):
+    """Returns the standings a diff from standingsDiff() leads to."""
+    standings = list(standings[:diff['size']])
+    standings.extend([None] * (diff['size'] - len(standings)))
+    for (position, row) in diff['changes']:
+        standings[position] = row
+    return standings
+
+
+class Subscription(object):
+    """One subscriber to a tournament's standings; see
+    StandingsFeed.subscribe().
+
+    Iterating over a subscription without a callback yields each diff (a
+    dict from standingsDiff(), plus the tournament ID under 'tournament') as
+    it arrives, the first one holding the whole standings, until the
+    subscription is closed.
+    """
+
+    def __init__(self, feed, tournament_id, callback=None):
+        self.feed = feed
+        self.tournament_id = tournament_id
+        self.callback = callback
+        self.diffs = queue.Queue()
+        self.closed = False
+
+    def push(self, diff):
+        if (self.callback is None):
+            self.diffs.put(diff)
+            return
+        try:
+            self.callback(diff)
+        except Exception:
+            logger.exception('standings callback failed')
+
+    def get(self, timeout=None):
+        """Returns the next diff, or None if the subscription is closed (or
+        the timeout, in seconds, runs out first)."""
+        try:
+            return self.diffs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while (True):
+            diff = self.diffs.get()
+            if (diff is None):
+                return
+            yield diff
+
+    def close(self):
+        """Stops the subscription; an iterator over it ends."""
+        self.feed.unsubscribe(self)
+
+
+class StandingsFeed(object):
+    """Recomputes standings once per change and fans the result out.
+
+    Changes arrive on STANDINGS_CHANNEL (through
+    tournament.listenForStandingsChanges()), or through changed(). Changes
+    to the same tournament that arrive within interval seconds of each other
+    are read as one, and tournaments no one is subscribed to are ignored.
+
+    Args:
+      listen: if True (the default), LISTEN for changes with a connection of
+                the feed's own; pass False when the tournament functions
+                aren't using PostgreSQL, and call changed() instead
+      interval: how long (in seconds) to gather changes before reading
+      poll_interval: how many seconds to wait before reconnecting, if the
+                       connection is lost
+    """
+
+    def __init__(self, listen=True, interval=0.1, poll_interval=5):
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.lock = threading.Condition()
+        self.subscribers = {}  # tournament ID -> list of Subscription
+        self.standings = {}  # tournament ID -> the standings last sent
+        self.dirty = set()  # tournaments to read again
+        self.changes = 0  # how many calls to changed() there have been
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self._run,
+                                       name='standings-feed')
+        self.thread.daemon = True
+        self.thread.start()
+        self.listener = None
+        if (listen):
+            self.listener = tournament.listenForStandingsChanges(
+                poll_interval, callback=self.changed)
+
+    def subscribe(self, tournament_id, callback=None):
+        """Starts sending a tournament's standings to a new subscriber.
+
+        Args:
+          tournament_id: the ID of the tournament
+          callback: a function to call (from the feed's thread) with each
+                      diff; without one, iterate over the subscription
+
+        Returns:
+          A Subscription, whose first diff holds the whole standings
+
+        Raises:
+          ValueError: if the tournament ID is invalid
+        """
+        subscription = Subscription(self, tournament_id, callback)
+        with self.lock:
+            standings = self.standings.get(tournament_id)
+            changes = self.changes
+        if (standings is None):
+            # read without holding up the feed's other subscribers
+            standings = self._read(tournament_id)
+        with self.lock:
+            if (tournament_id not in self.standings and
+                    self.changes != changes):
+                # a change during the read may have been missed
+                self.dirty.add(tournament_id)
+                self.lock.notify_all()
+            # another subscriber may have got there first
+            standings = self.standings.setdefault(tournament_id, standings)
+            self.subscribers.setdefault(tournament_id,
+                                        []).append(subscription)
+        subscription.push(self._diff(tournament_id, [], standings))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if (subscription.closed):
+                return
+            subscription.closed = True
+            tournament_id = subscription.tournament_id
+            subscribers = self.subscribers.get(tournament_id, [])
+            subscribers.remove(subscription)
+            if (not subscribers):
+                # no one is watching, so stop keeping it up to date
+                self.subscribers.pop(tournament_id, None)
+                self.standings.pop(tournament_id, None)
+        subscription.diffs.put(None)
+
+    def changed(self, tournament_id=0):
+        """Notes that a tournament's standings have changed; 0 means every
+        tournament."""
+        with self.lock:
+            self.changes += 1
+            if (tournament_id):
+                if (tournament_id in self.subscribers):
+                    self.dirty.add(tournament_id)
+            else:
+                self.dirty.update(self.subscribers)
+            self.lock.notify_all()
+
+    def close(self):
+        """Stops the feed, and ends every subscription."""
+        if (self.listener is not None):
+            self.listener.set()
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+            subscriptions = [s for subscribers in self.subscribers.values()
+                             for s in subscribers]
+        for subscription in subscriptions:
+            self.unsubscribe(subscription)
+        for thread in (self.thread, self.listener and self.listener.thread):
+            if (thread is not None and
+                    thread is not threading.current_thread()):
+                thread.join()
+
+    def _read(self, tournament_id):
+        # a cached copy may be what the notification was about, so go to the
+        # database, without disturbing the cache the rest of the process uses
+        standings = tournament.playerStandings(tournament_id, cached=False)
+        if (not isinstance(standings, list)):
+            raise ValueError(standings)  # the error message
+        return standings
+
+    def _diff(self, tournament_id, old, new):
+        diff = standingsDiff(old, new)
+        diff['tournament'] = tournament_id
+        return diff
+
+    def _run(self):
+        while (True):
+            with self.lock:
+                while (not self.dirty and not self.stopped):
+                    self.lock.wait()
+                if (self.stopped):
+                    return
+            # let a burst of changes (e.g.: a round reported one match at a
+            # time) settle into one read
+            time.sleep(self.interval)
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = set()
+
+            for tournament_id in dirty:
+                try:
+                    new = self._read(tournament_id)
+                except Exception:
+                    logger.exception('could not read the standings of '
+                                     'tournament %s', tournament_id)
+                    continue
+                with self.lock:
+                    if (tournament_id not in self.standings):
+                        continue  # unsubscribed in the meantime
+                    old = self.standings[tournament_id]
+                    self.standings[tournament_id] = new
+                    subscribers = list(self.subscribers[tournament_id])
+                if (new == old):
+                    continue
+                diff = self._diff(tournament_id, old, new)
+                for subscription in subscribers:
+                    subscription.push(diff)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#
+# journal.py -- a write-ahead journal of match results
+#
+# With a journal in use, tournament.reportMatch() only appends the result to
+# a local file and returns; a background thread records the results in the
+# database in batches, one transaction per batch. If the database is slow or
+# briefly down, results keep being accepted and wait in the journal, and if
+# the process stops, the ones not yet recorded are replayed the next time the
+# journal is opened:
+#
+#   tournament.useJournal('results.journal')
+#   tournament.reportMatch(winner, loser, tournament_id)  # once it's on disk
+#   tournament.flushJournal()  # wait until everything is in the database
+#
+# The file has one JSON object per line: {"seq": n, "result": [tournament,
+# winner, loser, is_tie]} for each result, and {"done": [n, ...]} once a
+# batch has been dealt with. It is emptied whenever nothing is waiting.
+#
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger('tournament.journal')
+
+
+def resultKey(tournament, winner, loser):
+    """Returns the key that identifies a result: the tournament and the
+    pair of players (in either order), or the player given a bye. Two
+    players only meet once in a tournament, and a player only gets one bye,
+    so a second result with the same key is a duplicate."""
+    if (not loser):
+        return (tournament, winner, 0)
+    return (tournament, min(winner, loser), max(winner, loser))
+
+
+class ResultJournal(object):
+    """An append-only file of results, and the thread that records them.
+
+    Args:
+      path: the journal file; created if it doesn't exist, and replayed if
+              it does
+      record: a function that records a batch of results (a list of
+                (tournament, winner, loser, is_tie) tuples) in one
+                transaction, and returns a list with None for each result
+                recorded (or already there) or the error that rejected it;
+                if it raises an exception, the batch is retried
+      batch_size: the most results to record in one transaction
+      interval: how long (in seconds) to wait for more results to arrive
+                  before recording a batch that isn't full
+      retry_interval: how long to wait after a failed batch before trying
+                        again; doubled after each failure, up to
+                        max_retry_interval
+      sync: if True, a result is flushed to disk (fsync) before append()
+              returns
+      on_reject: a function called with (result, error) for each result
+                   the database rejects (optional)
+      transient: the exception types that mean the database is unavailable;
+                   a batch that fails with one is retried for as long as it
+                   takes
+      max_attempts: how many times in a row a batch can fail with any other
+                      exception before its results are tried one at a time;
+                      a result that fails that many times on its own is
+                      rejected (with the exception as its error), so one bad
+                      result can't hold up the ones after it
+    """
+
+    def __init__(self, path, record, batch_size=1000, interval=0.05,
+                 retry_interval=0.5, max_retry_interval=30, sync=True,
+                 on_reject=None, transient=(), max_attempts=5):
+        self.path = path
+        self.record = record
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.sync = sync
+        self.on_reject = on_reject
+        self.transient = tuple(transient)
+        self.max_attempts = max_attempts
+
+        self.lock = threading.Condition()
+        self.pending = OrderedDict()  # seq -> result, in the order received
+        self.keys = set()  # resultKey() of every pending result
+        self.rejected = []  # (result, error) for each result rejected
+        self.next_seq = 1
+        self.flushing = 0  # how many flush() calls are waiting
+        self.closing = False
+
+        self._replay()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o644)
+        self.thread = threading.Thread(target=self._run,
+                                       name='tournament-journal')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _replay(self):
+        """Loads the results left waiting in the file by an earlier run."""
+        if (not os.path.exists(self.path)):
+            return
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # a write cut short by a crash leaves a partial last line
+        end = data.rfind(b'\n') + 1
+        if (end < len(data)):
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+
+        results = OrderedDict()
+        done = set()
+        for line in data[:end].decode('utf-8').splitlines():
+            entry = json.loads(line)
+            if ('done' in entry):
+                done.update(entry['done'])
+            else:
+                results[entry['seq']] = tuple(entry['result'])
+                self.next_seq = max(self.next_seq, entry['seq'] + 1)
+
+        for (seq, result) in results.items():
+            key = resultKey(*result[:3])
+            if (seq not in done and key not in self.keys):
+                self.pending[seq] = result
+                self.keys.add(key)
+
+        if (self.pending):
+            logger.info('replaying %s results from %s', len(self.pending),
+                        self.path)
+
+    def _write(self, entry):
+        os.write(self.fd, (json.dumps(entry) + '\n').encode('utf-8'))
+
+    def append(self, tournament, winner, loser, is_tie=False):
+        """Adds a result to the journal.
+
+        Returns:
+          True, or False if a result with the same key is already waiting
+            (and this one was dropped)
+        """
+        result = (tournament, winner, loser, is_tie)
+        key = resultKey(tournament, winner, loser)
+
+        with self.lock:
+            if (self.closing):
+                raise ValueError('The journal is closed.')
+            if (key in self.keys):
+                return False
+            seq = self.next_seq
+            self.next_seq += 1
+            self._write({'seq': seq, 'result': result})
+            self.pending[seq] = result
+            self.keys.add(key)
+            if (len(self.pending) >= self.batch_size or
+                    len(self.pending) == 1):
+                self.lock.notify_all()
+
+        if (self.sync):
+            os.fsync(self.fd)  # concurrent appends can share this
+        return True
+
+    def flush(self, timeout=None):
+        """Waits until every result in the journal has been dealt with.
+
+        Returns:
+          True, or False if the timeout (in seconds) ran out first
+        """
+        with self.lock:
+            self.flushing += 1
+            self.lock.notify_all()
+            try:
+                return self._wait_until_empty(timeout)
+            finally:
+                self.flushing -= 1
+
+    def _wait_until_empty(self, timeout):
+        # Condition.wait() returns nothing on Python 2 (and may wake early),
+        # so keep track of the time here
+        deadline = None if timeout is None else time.time() + timeout
+        while (self.pending):
+            if (deadline is None):
+                self.lock.wait()
+                continue
+            remaining = deadline - time.time()
+            if (remaining <= 0):
+                return False
+            self.lock.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Records what it can (see flush()), then stops the thread. Results
+        still waiting stay in the file, to be replayed next time.
+
+        Returns:
+          True if nothing was left waiting
+        """
+        flushed = self.flush(timeout)
+        with self.lock:
+            self.closing = True
+            self.lock.notify_all()
+        self.thread.join()
+        os.close(self.fd)
+        return flushed
+
+    def _run(self):
+        delay = self.retry_interval
+        failures = 0  # how many times in a row the batch has failed
+        isolating = 0  # how many results are left to try one at a time
+        while (True):
+            with self.lock:
+                while (not self.pending and not self.closing):
+                    self.lock.wait()
+                if (self.closing):
+                    return
+                size = 1 if isolating else self.batch_size
+                if (len(self.pending) < size and not self.flushing):
+                    # give the batch a moment to fill up
+                    self.lock.wait(self.interval)
+                batch = list(self.pending.items())[:size]
+
+            try:
+                errors = self.record([result for (seq, result) in batch])
+            except Exception as e:
+                if (not isinstance(e, self.transient)):
+                    failures += 1
+                if (failures < self.max_attempts):
+                    logger.exception('could not record %s results; '
+                                     'retrying in %s s', len(batch), delay)
+                    with self.lock:
+                        if (not self.closing):
+                            self.lock.wait(delay)
+                    delay = min(delay * 2, self.max_retry_interval)
+                    continue
+                failures = 0
+                delay = self.retry_interval
+                if (len(batch) > 1):
+                    # find the result that keeps failing
+                    logger.exception('could not record %s results; trying '
+                                     'them one at a time', len(batch))
+                    isolating = len(batch)
+                    continue
+                errors = [str(e).strip() or type(e).__name__]
+            failures = 0
+            delay = self.retry_interval
+            isolating = max(isolating - 1, 0)
+
+            rejected = []
+            with self.lock:
+                for ((seq, result), error) in zip(batch, errors):
+                    del self.pending[seq]
+                    self.keys.discard(resultKey(*result[:3]))
+                    if (error is not None):
+                        rejected.append((result, error))
+                self.rejected.extend(rejected)
+                if (self.pending):
+                    self._write({'done': [seq for (seq, result) in batch]})
+                else:
+                    os.ftruncate(self.fd, 0)  # nothing left to replay
+                if (self.sync):
+                    os.fsync(self.fd)
+                self.lock.notify_all()
+
+            for (result, error) in rejected:
+                logger.warning('result %s was rejected: %s', result, error)
+                if (self.on_reject is not None):
+                    self.on_reject(result, error)
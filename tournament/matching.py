@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+#
+# matching.py -- maximum-weight matching on a general (sparse) graph
+#
+# This is Edmonds' blossom algorithm with primal-dual weights, following the
+# public-domain implementation by Joris van Rantwijk
+# (http://jorisvr.nl/article/maximum-matching). It is used by swissPairings()
+# to pair a whole round at once; see pairing.pairPlayersByMatching().
+#
+# The graph is given as a list of edges, and each vertex keeps a list of its
+# own edges, so the work done depends on the number of edges rather than on
+# the square of the number of vertices. The search can also start from a
+# matching that is already known to be good, which saves most of the work
+# when the graph has many equally good edges (as a Swiss round does).
+#
+
+
+def maxWeightMatching(edges, maxcardinality=False, initial=()):
+    """Computes a maximum-weight matching of a general graph.
+
+    Args:
+      edges: a list of (i, j, weight) tuples; vertices are numbered from 0
+               and weights are integers
+      maxcardinality: if True, only matchings with the most possible edges
+                        are considered (the heaviest of those is returned)
+      initial: indexes into edges of a matching to start from; every one of
+                 them must have the largest weight in the graph, and no two
+                 may share a vertex
+
+    Returns:
+      A list with one entry per vertex: the vertex it is matched to, or -1
+    """
+    if (not edges):
+        return []
+
+    nedge = len(edges)
+    nvertex = 0
+    for (i, j, w) in edges:
+        nvertex = max(nvertex, i + 1, j + 1)
+
+    maxweight = max(0, max(w for (i, j, w) in edges))
+
+    # edge k connects endpoint[2k] and endpoint[2k + 1]; a vertex's
+    # neighbend lists the endpoints at the far end of each of its edges
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * nedge)]
+    neighbend = [[] for i in range(nvertex)]
+    for k in range(nedge):
+        (i, j, w) = edges[k]
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    # mate[v] is the endpoint at the far end of v's matched edge, or -1
+    mate = nvertex * [-1]
+
+    # for top-level blossoms and vertices: 0 = free, 1 = S, 2 = T
+    label = (2 * nvertex) * [0]
+    # the endpoint through which a blossom or vertex got its label
+    labelend = (2 * nvertex) * [-1]
+    # the top-level blossom each vertex belongs to
+    inblossom = list(range(nvertex))
+    # blossoms are numbered from nvertex to 2 * nvertex - 1
+    blossomparent = (2 * nvertex) * [-1]
+    blossomchilds = (2 * nvertex) * [None]
+    blossombase = list(range(nvertex)) + nvertex * [-1]
+    blossomendps = (2 * nvertex) * [None]
+    # the least-slack edge to a different S-blossom
+    bestedge = (2 * nvertex) * [-1]
+    blossombestedges = (2 * nvertex) * [None]
+    unusedblossoms = list(range(nvertex, 2 * nvertex))
+
+    # dual variables; slack(k) = dualvar[i] + dualvar[j] - 2 * weight
+    dualvar = nvertex * [maxweight] + nvertex * [0]
+    allowedge = nedge * [False]
+    queue = []
+
+    # every vertex starts with the same dual value, so an edge of the
+    # largest weight has no slack and can be matched before the search
+    for k in initial:
+        (i, j, w) = edges[k]
+        mate[i] = 2 * k + 1
+        mate[j] = 2 * k
+
+    def slack(k):
+        (i, j, w) = edges[k]
+        return dualvar[i] + dualvar[j] - 2 * w
+
+    def blossomLeaves(b):
+        # the vertices inside blossom b; blossoms can be nested thousands of
+        # levels deep, so walk them with a stack rather than recursion
+        if (b < nvertex):
+            return [b]
+        leaves = []
+        stack = [b]
+        while (stack):
+            t = stack.pop()
+            if (t < nvertex):
+                leaves.append(t)
+            else:
+                stack.extend(blossomchilds[t])
+        return leaves
+
+    def assignLabel(w, t, p):
+        # label w's blossom t (S or T) through endpoint p; a T-blossom's
+        # mate becomes an S-blossom
+        while (True):
+            b = inblossom[w]
+            label[w] = label[b] = t
+            labelend[w] = labelend[b] = p
+            bestedge[w] = bestedge[b] = -1
+            if (t == 1):
+                queue.extend(blossomLeaves(b))
+                return
+            base = blossombase[b]
+            w = endpoint[mate[base]]
+            t = 1
+            p = mate[base] ^ 1
+
+    def scanBlossom(v, w):
+        # trace back from v and w to find a new blossom's base, or -1 if
+        # they lead to different roots (an augmenting path)
+        path = []
+        base = -1
+        while (v != -1 or w != -1):
+            b = inblossom[v]
+            if (label[b] & 4):
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5  # breadcrumb
+            if (labelend[b] == -1):
+                v = -1
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]
+            if (w != -1):
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def addBlossom(base, k):
+        # make a new blossom from the cycle closed by edge k
+        (v, w, wt) = edges[k]
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        while (bv != bb):
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+        while (bw != bb):
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        for v in blossomLeaves(b):
+            if (label[inblossom[v]] == 2):
+                # T-vertices inside the blossom become S-vertices
+                queue.append(v)
+            inblossom[v] = b
+        # work out the least-slack edges from the new blossom to every
+        # other S-blossom
+        bestedgeto = {}
+        for bv in path:
+            if (blossombestedges[bv] is None):
+                nblists = [[p // 2 for p in neighbend[v]]
+                           for v in blossomLeaves(bv)]
+            else:
+                nblists = [blossombestedges[bv]]
+            for nblist in nblists:
+                for k in nblist:
+                    (i, j, wt) = edges[k]
+                    if (inblossom[j] == b):
+                        i, j = j, i
+                    bj = inblossom[j]
+                    if (bj != b and label[bj] == 1 and
+                            (bj not in bestedgeto or
+                             slack(k) < slack(bestedgeto[bj]))):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = list(bestedgeto.values())
+        bestedge[b] = -1
+        for k in blossombestedges[b]:
+            if (bestedge[b] == -1 or slack(k) < slack(bestedge[b])):
+                bestedge[b] = k
+
+    def expandBlossom(b, endstage):
+        # turn blossom b's children back into top-level blossoms
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if (s < nvertex):
+                inblossom[s] = s
+            elif (endstage and dualvar[s] == 0):
+                expandBlossom(s, endstage)
+            else:
+                for v in blossomLeaves(s):
+                    inblossom[v] = s
+        if (not endstage and label[b] == 2):
+            # relabel the children along the even path through the blossom
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            j = blossomchilds[b].index(entrychild)
+            if (j & 1):
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            p = labelend[b]
+            while (j != 0):
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[blossomendps[b][j - endptrick] ^
+                               endptrick ^ 1]] = 0
+                assignLabel(endpoint[p ^ 1], 2, p)
+                allowedge[blossomendps[b][j - endptrick] // 2] = True
+                j += jstep
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                allowedge[p // 2] = True
+                j += jstep
+            bv = blossomchilds[b][j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            j += jstep
+            while (blossomchilds[b][j] != entrychild):
+                bv = blossomchilds[b][j]
+                if (label[bv] == 1):
+                    j += jstep
+                    continue
+                for v in blossomLeaves(bv):
+                    if (label[v] != 0):
+                        break
+                if (label[v] != 0):
+                    label[v] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assignLabel(v, 2, labelend[v])
+                j += jstep
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augmentBlossom(b, v):
+        # swap matched and unmatched edges along the path from v to the
+        # base of blossom b, then make v the base
+        t = v
+        while (blossomparent[t] != b):
+            t = blossomparent[t]
+        if (t >= nvertex):
+            augmentBlossom(t, v)
+        i = j = blossomchilds[b].index(t)
+        if (i & 1):
+            j -= len(blossomchilds[b])
+            jstep = 1
+            endptrick = 0
+        else:
+            jstep = -1
+            endptrick = 1
+        while (j != 0):
+            j += jstep
+            t = blossomchilds[b][j]
+            p = blossomendps[b][j - endptrick] ^ endptrick
+            if (t >= nvertex):
+                augmentBlossom(t, endpoint[p])
+            j += jstep
+            t = blossomchilds[b][j]
+            if (t >= nvertex):
+                augmentBlossom(t, endpoint[p ^ 1])
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+        blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augmentMatching(k):
+        # swap matched and unmatched edges along the augmenting path
+        # through edge k
+        (v, w, wt) = edges[k]
+        for (s, p) in ((v, 2 * k + 1), (w, 2 * k)):
+            while (True):
+                bs = inblossom[s]
+                if (bs >= nvertex):
+                    augmentBlossom(bs, s)
+                mate[s] = p
+                if (labelend[bs] == -1):
+                    break  # reached a free vertex: the root of the tree
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if (bt >= nvertex):
+                    augmentBlossom(bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    # each stage finds one augmenting path, so there are at most as many
+    # stages as free vertices
+    for t in range(nvertex):
+        label[:] = (2 * nvertex) * [0]
+        bestedge[:] = (2 * nvertex) * [-1]
+        blossombestedges[nvertex:] = nvertex * [None]
+        allowedge[:] = nedge * [False]
+        queue[:] = []
+
+        for v in range(nvertex):
+            if (mate[v] == -1 and label[inblossom[v]] == 0):
+                assignLabel(v, 1, -1)
+
+        augmented = False
+        while (True):
+            while (queue and not augmented):
+                v = queue.pop()
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if (inblossom[v] == inblossom[w]):
+                        continue
+                    if (not allowedge[k]):
+                        kslack = slack(k)
+                        if (kslack <= 0):
+                            allowedge[k] = True
+                    if (allowedge[k]):
+                        if (label[inblossom[w]] == 0):
+                            assignLabel(w, 2, p ^ 1)
+                        elif (label[inblossom[w]] == 1):
+                            base = scanBlossom(v, w)
+                            if (base >= 0):
+                                addBlossom(base, k)
+                            else:
+                                augmentMatching(k)
+                                augmented = True
+                                break
+                        elif (label[w] == 0):
+                            label[w] = 2
+                            labelend[w] = p ^ 1
+                    elif (label[inblossom[w]] == 1):
+                        b = inblossom[v]
+                        if (bestedge[b] == -1 or kslack < slack(bestedge[b])):
+                            bestedge[b] = k
+                    elif (label[w] == 0):
+                        if (bestedge[w] == -1 or kslack < slack(bestedge[w])):
+                            bestedge[w] = k
+
+            if (augmented):
+                break
+
+            # no augmenting path with the current duals; change them by the
+            # largest amount that keeps every slack non-negative
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+
+            if (not maxcardinality):
+                deltatype = 1
+                delta = min(dualvar[:nvertex])
+
+            for v in range(nvertex):
+                if (label[inblossom[v]] == 0 and bestedge[v] != -1):
+                    d = slack(bestedge[v])
+                    if (deltatype == -1 or d < delta):
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[v]
+
+            for b in range(2 * nvertex):
+                if (blossomparent[b] == -1 and label[b] == 1 and
+                        bestedge[b] != -1):
+                    d = slack(bestedge[b]) // 2
+                    if (deltatype == -1 or d < delta):
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[b]
+
+            for b in range(nvertex, 2 * nvertex):
+                if (blossombase[b] >= 0 and blossomparent[b] == -1 and
+                        label[b] == 2 and
+                        (deltatype == -1 or dualvar[b] < delta)):
+                    delta = dualvar[b]
+                    deltatype = 4
+                    deltablossom = b
+
+            if (deltatype == -1):
+                # nothing left to do in maximum-cardinality mode
+                deltatype = 1
+                delta = max(0, min(dualvar[:nvertex]))
+
+            for v in range(nvertex):
+                if (label[inblossom[v]] == 1):
+                    dualvar[v] -= delta
+                elif (label[inblossom[v]] == 2):
+                    dualvar[v] += delta
+            for b in range(nvertex, 2 * nvertex):
+                if (blossombase[b] >= 0 and blossomparent[b] == -1):
+                    if (label[b] == 1):
+                        dualvar[b] += delta
+                    elif (label[b] == 2):
+                        dualvar[b] -= delta
+
+            if (deltatype == 1):
+                break  # the matching is optimal
+            elif (deltatype == 2):
+                allowedge[deltaedge] = True
+                (i, j, wt) = edges[deltaedge]
+                if (label[inblossom[i]] == 0):
+                    i, j = j, i
+                queue.append(i)
+            elif (deltatype == 3):
+                allowedge[deltaedge] = True
+                (i, j, wt) = edges[deltaedge]
+                queue.append(i)
+            elif (deltatype == 4):
+                expandBlossom(deltablossom, False)
+
+        if (not augmented):
+            break
+
+        # expand the S-blossoms whose dual has reached zero
+        for b in range(nvertex, 2 * nvertex):
+            if (blossomparent[b] == -1 and blossombase[b] >= 0 and
+                    label[b] == 1 and dualvar[b] == 0):
+                expandBlossom(b, True)
+
+    for v in range(nvertex):
+        if (mate[v] >= 0):
+            mate[v] = endpoint[mate[v]]
+
+    return mate
@@ -0,0 +1,807 @@
+#!/usr/bin/env python
+#
+# memory.py -- an in-memory storage backend for tournament.py
+#
+# Keeps every table in Python instead of PostgreSQL, following the same rules
+# as the constraints and triggers in tournament.sql, so the whole tournament
+# API (and its test suite) can run without a database:
+#
+#   import tournament
+#   tournament.useBackend('memory')
+#
+
+from array import array
+import copy
+import threading
+
+try:
+    from psycopg2 import DataError, IntegrityError, InternalError
+except ImportError:
+    # without the database driver (e.g.: in simulate.py), the same errors
+    # are raised as exceptions of the same names
+    class DataError(Exception):
+        pass
+
+    class IntegrityError(Exception):
+        pass
+
+    class InternalError(Exception):
+        pass
+
+
+def _error(cls, message):
+    """Returns an exception like the one psycopg2 raises for a message from
+    the database (whose messages always end with a newline)."""
+    return cls(message + '\n')
+
+
+# the range of the database's int columns
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+def _check_ints(*values):
+    """Raises the error the database gives for a number too big (or small)
+    for an int column."""
+    for value in values:
+        if (value is not None and not INT_MIN <= value <= INT_MAX):
+            raise _error(DataError, 'integer out of range')
+
+
+class Match(object):
+    """One row of the matches table; a bye has no loser."""
+    __slots__ = ('id', 'tournament_id', 'winner', 'loser', 'is_tie',
+                 'is_bye', 'round')
+
+    def __init__(self, id, tournament_id, winner, loser, is_tie, is_bye,
+                 round=None):
+        self.id = id
+        self.tournament_id = tournament_id
+        self.winner = winner
+        self.loser = loser
+        self.is_tie = is_tie
+        self.is_bye = is_bye
+        self.round = round  # the stored round it was paired in, if any
+
+    def opponent(self, player):
+        """Returns the player's opponent if the match counts towards their
+        omw (i.e.: it wasn't a tie or a bye), else None."""
+        if (self.is_tie):
+            return None
+        return self.loser if self.winner == player else self.winner
+
+
+class _Tables(object):
+    """Everything a backend stores.
+
+    The players and standings tables are columns of arrays indexed by player
+    ID; a player_tournament of 0 marks a deleted (or never used) ID.
+    """
+    __slots__ = ('registrants', 'tournaments', 'player_tournament',
+                 'player_registrant', 'wins', 'matches', 'ties', 'byes',
+                 'omw', 'player_matches', 'rosters', 'entries', 'pairs',
+                 'pairings')
+
+    def __init__(self):
+        self.registrants = {}  # registrant ID -> name
+        self.tournaments = {}  # tournament ID -> name
+        self.player_tournament = array('l', [0])
+        self.player_registrant = array('l', [0])
+        self.wins = array('l', [0])
+        self.matches = array('l', [0])
+        self.ties = array('l', [0])
+        self.byes = array('l', [0])
+        self.omw = array('l', [0])
+        self.player_matches = [[]]  # player ID -> list of Match
+        self.rosters = {}  # tournament ID -> list of player IDs, in order
+        self.entries = {}  # (tournament ID, registrant ID) -> player ID
+        self.pairs = {}  # tournament ID -> set of (low ID, high ID) met
+        # tournament ID -> a list of (player one, player two) pairs per round
+        self.pairings = {}
+
+
+class MemorySession(object):
+    """A transaction on a MemoryBackend; see tournament.session().
+
+    The backend is locked for the whole session. Before the session changes
+    a row of the tables, it notes how to undo the change, so rollback() only
+    has to put back what the session changed, not everything stored.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.undo = []  # (function, args) for each change, oldest first
+        self.kept = set()  # (id(container), key) of each row kept so far
+
+    def keep(self, container, key, copied):
+        """Notes the value of container[key] (a copy, if copied is True and
+        it is a list, set or dict) before its first change in the session;
+        a row missing from a dict is deleted again on rollback."""
+        mark = (id(container), key)
+        if (mark in self.kept):
+            return  # a rollback puts back the oldest value
+        self.kept.add(mark)
+        try:
+            old = container[key]
+        except KeyError:
+            self.undo.append((container.pop, (key, None)))
+            return
+        if (copied and isinstance(old, (list, set, dict))):
+            old = copy.copy(old)
+        self.undo.append((container.__setitem__, (key, old)))
+
+    def commit(self):
+        self.end()
+
+    def rollback(self):
+        for (function, args) in reversed(self.undo):
+            function(*args)
+        self.end()
+
+    def end(self):
+        self.undo = []
+        self.kept = set()
+        self.backend.session = None
+        self.backend.lock.release()
+
+
+class MemoryBackend(object):
+    """Stores tournaments in memory, with the same results as the database.
+
+    Rematches, players paired with themselves, repeat byes and players from
+    another tournament are rejected with the same psycopg2 exception types
+    and messages as the triggers and constraints in tournament.sql, and the
+    standings (omw included) are kept up to date as the update_standings
+    trigger does.
+
+    Every method is atomic: it checks everything before it changes anything.
+    IDs are never reused, even after a rollback, just like serial columns.
+    """
+
+    def __init__(self):
+        self.tables = _Tables()
+        self.lock = threading.RLock()
+        self.session = None  # the MemorySession in progress, if any
+        self.sequences = {'registrants': 0, 'tournaments': 0, 'players': 0,
+                          'matches': 0}
+
+    def begin(self):
+        """Starts a transaction; returns a MemorySession."""
+        self.lock.acquire()
+        self.session = MemorySession(self)
+        return self.session
+
+    # every change to the tables goes through these, so that a session can
+    # undo it
+
+    def _keep(self, container, key):
+        """Called before changing the list, set or dict in container[key]
+        in place."""
+        if (self.session is not None):
+            self.session.keep(container, key, True)
+
+    def _set(self, container, key, value):
+        if (self.session is not None):
+            self.session.keep(container, key, False)
+        container[key] = value
+
+    def _pop(self, container, key):
+        if (key in container):
+            if (self.session is not None):
+                self.session.keep(container, key, False)
+            return container.pop(key)
+
+    def _set_attribute(self, row, name, value):
+        if (self.session is not None):
+            self.session.undo.append((setattr,
+                                      (row, name, getattr(row, name))))
+        setattr(row, name, value)
+
+    def _add_to(self, sets, key, member):
+        """Adds a member to the set in sets[key], creating it if needed."""
+        if (key not in sets):
+            self._set(sets, key, set())
+        members = sets[key]
+        if (member not in members):
+            if (self.session is not None):
+                self.session.undo.append((members.discard, (member,)))
+            members.add(member)
+
+    def _discard_from(self, sets, key, member):
+        members = sets.get(key, ())
+        if (member in members):
+            if (self.session is not None):
+                self.session.undo.append((members.add, (member,)))
+            members.discard(member)
+
+    def _nextval(self, sequence):
+        self.sequences[sequence] += 1
+        return self.sequences[sequence]
+
+    def _add_player(self, tournament, registrant, player=None):
+        """Inserts a row into players (and standings); returns its ID, which
+        is the next one in sequence unless one is given."""
+        t = self.tables
+        if (player is None):
+            player = self._nextval('players')
+
+        # IDs handed out in a rolled back session leave gaps; rows added
+        # here are unused (all 0) until set, so a rollback can leave them
+        while (len(t.player_tournament) <= player):
+            for column in (t.player_tournament, t.player_registrant, t.wins,
+                           t.matches, t.ties, t.byes, t.omw):
+                column.append(0)
+            t.player_matches.append([])
+
+        self._set(t.player_tournament, player, tournament)
+        self._set(t.player_registrant, player, registrant)
+        self._keep(t.rosters, tournament)
+        t.rosters.setdefault(tournament, []).append(player)
+        self._set(t.entries, (tournament, registrant), player)
+
+        return player
+
+    def _remove_players(self, players):
+        """Deletes players, with the same cascades as the foreign keys on
+        matches: the matches they won go, and they are taken off the ones
+        they lost."""
+        t = self.tables
+        gone = set(players)
+        affected = {}  # tournament ID -> players whose standings change
+
+        tournaments = set(t.player_tournament[player] for player in gone)
+
+        for player in gone:
+            tournament = t.player_tournament[player]
+            for match in t.player_matches[player]:
+                other = match.loser if match.winner == player else match.winner
+                if (match.loser is not None):
+                    self._discard_from(t.pairs, tournament,
+                                       (min(match.winner, match.loser),
+                                        max(match.winner, match.loser)))
+                if (other is None or other in gone):
+                    continue
+                if (match.winner == player):
+                    self._keep(t.player_matches, other)
+                    t.player_matches[other].remove(match)
+                else:
+                    self._set_attribute(match, 'loser', None)
+                affected.setdefault(tournament, set()).add(other)
+
+            self._keep(t.rosters, tournament)
+            t.rosters[tournament].remove(player)
+            self._pop(t.entries, (tournament, t.player_registrant[player]))
+            self._clear_player(player)
+
+        for players in affected.values():
+            self._refresh(players)
+
+        # a stored pairing goes with either of its players
+        for tournament in tournaments:
+            if (tournament in t.pairings):
+                self._set(t.pairings, tournament,
+                          [[(one, two) for (one, two) in pairs
+                            if one not in gone and two not in gone]
+                           for pairs in t.pairings[tournament]])
+
+    def _clear_player(self, player):
+        """Marks a player ID as unused, with no standings or matches."""
+        t = self.tables
+        for column in (t.player_tournament, t.player_registrant, t.wins,
+                       t.matches, t.ties, t.byes, t.omw):
+            self._set(column, player, 0)
+        self._set(t.player_matches, player, [])
+
+    def _refresh(self, players):
+        """Recalculates the standings of the given players, plus the omw of
+        everyone they have beaten or lost to (see refresh_standings())."""
+        t = self.tables
+        affected = set()
+
+        for player in players:
+            if (player is None or not t.player_tournament[player]):
+                continue
+            wins = matches = ties = byes = 0
+            for match in t.player_matches[player]:
+                matches += 1
+                if (match.is_tie):
+                    ties += 1
+                elif (match.winner == player):
+                    wins += 1
+                if (match.is_bye):
+                    byes += 1
+                opponent = match.opponent(player)
+                if (opponent is not None):
+                    affected.add(opponent)
+            self._set(t.wins, player, wins)
+            self._set(t.matches, player, matches)
+            self._set(t.ties, player, ties)
+            self._set(t.byes, player, byes)
+            affected.add(player)
+
+        for player in affected:
+            opponents = set(match.opponent(player)
+                            for match in t.player_matches[player])
+            opponents.discard(None)
+            self._set(t.omw, player, sum(t.wins[o] for o in opponents))
+
+    def _in_tournament(self, player, tournament):
+        t = self.tables
+        return (0 < player < len(t.player_tournament) and
+                t.player_tournament[player] == tournament)
+
+    def _has_met(self, tournament, one, two):
+        pair = (min(one, two), max(one, two))
+        return pair in self.tables.pairs.get(tournament, ())
+
+    def _insert_match(self, tournament, winner, loser, is_tie):
+        """Adds a match that has already been checked."""
+        t = self.tables
+        match = Match(self._nextval('matches'), tournament, winner, loser,
+                      is_tie and loser is not None, loser is None,
+                      len(t.pairings.get(tournament, ())) or None)
+        self._keep(t.player_matches, winner)
+        t.player_matches[winner].append(match)
+        if (loser is not None):
+            self._keep(t.player_matches, loser)
+            t.player_matches[loser].append(match)
+            self._add_to(t.pairs, tournament,
+                         (min(winner, loser), max(winner, loser)))
+
+    def _is_paired(self, tournament, winner, loser):
+        """Returns True if the tournament has no stored rounds, or if the
+        players (a loser of None is a bye) are a pair of the latest one."""
+        rounds = self.tables.pairings.get(tournament)
+        if (not rounds):
+            return True
+        if (loser is None):
+            return (winner, None) in rounds[-1]
+        return ((winner, loser) in rounds[-1] or
+                (loser, winner) in rounds[-1])
+
+    def _round_pairs(self, tournament, round_number):
+        """Returns the pairs of a stored round with the players' names, and
+        whether every result of the round is in."""
+        t = self.tables
+
+        def name(player):
+            if (player is None):
+                return None
+            return t.registrants[t.player_registrant[player]]
+
+        pairs = []
+        complete = True
+        for (one, two) in t.pairings[tournament][round_number - 1]:
+            pairs.append((one, name(one), two, name(two)))
+            if (not [match for match in t.player_matches[one]
+                     if match.round == round_number]):
+                complete = False
+        return pairs, complete
+
+    def _check_tournament_exists(self, tournament):
+        if (tournament not in self.tables.tournaments):
+            raise _error(IntegrityError,
+                         'insert or update on table "players" violates '
+                         'foreign key constraint "players_tournament_id_fkey"')
+
+    def _check_name(self, name):
+        if (name is None):
+            raise _error(IntegrityError,
+                         'null value in column "name" of relation '
+                         '"registrants" violates not-null constraint')
+
+    def _check_entries(self, registrants, tournament):
+        """Raises the error the players table would give for adding the
+        registrants to a tournament."""
+        t = self.tables
+        self._check_tournament_exists(tournament)
+        seen = set()
+        for registrant in registrants:
+            if (registrant not in t.registrants):
+                raise _error(IntegrityError,
+                             'insert or update on table "players" violates '
+                             'foreign key constraint '
+                             '"players_registrant_id_fkey"')
+            if ((tournament, registrant) in t.entries or registrant in seen):
+                raise _error(IntegrityError,
+                             'duplicate key value violates unique constraint '
+                             '"players_tournament_id_registrant_id_key"')
+            seen.add(registrant)
+
+    def deleteMatches(self, tournament=0):
+        with self.lock:
+            t = self.tables
+            if (tournament):
+                tournaments = [tournament] if tournament in t.rosters else []
+            else:
+                tournaments = list(t.rosters)
+            for tournament in tournaments:
+                for player in t.rosters[tournament]:
+                    self._set(t.player_matches, player, [])
+                    for column in (t.wins, t.matches, t.ties, t.byes, t.omw):
+                        self._set(column, player, 0)
+                self._set(t.pairs, tournament, set())
+                self._pop(t.pairings, tournament)
+
+    def deletePlayers(self):
+        with self.lock:
+            t = self.tables
+            self._remove_players([player for roster in t.rosters.values()
+                                  for player in roster])
+            self._set_attribute(t, 'registrants', {})
+
+    def createTournament(self, t_name):
+        with self.lock:
+            self._check_name(t_name)
+            tournament = self._nextval('tournaments')
+            self._set(self.tables.tournaments, tournament, t_name)
+            return tournament
+
+    def deleteTournament(self, tournament=0):
+        with self.lock:
+            t = self.tables
+            if (tournament):
+                tournaments = [tournament]
+                if (tournament not in t.tournaments):
+                    tournaments = []
+            else:
+                tournaments = list(t.tournaments)
+            for tournament in tournaments:
+                # like dropping the tournament's partitions: no cascades
+                # reach any other tournament
+                for player in self._pop(t.rosters, tournament) or []:
+                    self._pop(t.entries,
+                              (tournament, t.player_registrant[player]))
+                    self._clear_player(player)
+                self._pop(t.pairs, tournament)
+                self._pop(t.pairings, tournament)
+                self._pop(t.tournaments, tournament)
+
+    def countPlayers(self, tournament=None):
+        with self.lock:
+            t = self.tables
+            if (tournament is not None):
+                return len(t.rosters.get(tournament, ()))
+            return sum(len(roster) for roster in t.rosters.values())
+
+    def registerPlayer(self, p_name, tournament=None):
+        with self.lock:
+            self._check_name(p_name)
+            if (tournament and type(tournament) is int):
+                self._check_tournament_exists(tournament)
+            registrant = self._nextval('registrants')
+            self._set(self.tables.registrants, registrant, p_name)
+            if (tournament and type(tournament) is int):
+                self._add_player(tournament, registrant)
+
+    def registerPlayers(self, p_names, tournament=None):
+        with self.lock:
+            p_names = list(p_names)
+            for name in p_names:
+                self._check_name(name)
+            to_tournament = tournament and type(tournament) is int
+            if (to_tournament and p_names):
+                self._check_tournament_exists(tournament)
+
+            new_ids = []
+            for name in p_names:
+                registrant = self._nextval('registrants')
+                self._set(self.tables.registrants, registrant, name)
+                if (to_tournament):
+                    new_ids.append(self._add_player(tournament, registrant))
+                else:
+                    new_ids.append(registrant)
+            return new_ids
+
+    def assignPlayer(self, registrant, tournament):
+        with self.lock:
+            self._check_entries([registrant], tournament)
+            self._add_player(tournament, registrant)
+
+    def assignPlayers(self, registrants, tournament):
+        with self.lock:
+            if (registrants):
+                self._check_entries(registrants, tournament)
+            return [self._add_player(tournament, registrant)
+                    for registrant in registrants]
+
+    def unAssignPlayer(self, registrant, tournament):
+        with self.lock:
+            player = self.tables.entries.get((tournament, registrant))
+            if (player is not None):
+                self._remove_players([player])
+
+    def playerStandings(self, tournament):
+        with self.lock:
+            t = self.tables
+            roster = t.rosters.get(tournament, [])
+            # the same order as the player_standings view
+            ranked = sorted(roster, key=lambda p: (-t.wins[p], -t.omw[p], p))
+            return [(p, t.registrants[t.player_registrant[p]], t.wins[p],
+                     t.matches[p], t.omw[p]) for p in ranked]
+
+    def reportMatch(self, winner, loser, tournament, is_tie=False):
+        _check_ints(winner, loser, tournament)
+        with self.lock:
+            # the checks run in the same order as in the database: the
+            # stored pairings (see report_match()), the triggers
+            # (alphabetically), then the constraints
+            if (not self._is_paired(tournament, winner, loser or None)):
+                raise _error(InternalError,
+                             'These two players were not paired in the '
+                             'current round.')
+            if (loser != 0 and self._has_met(tournament, winner, loser)):
+                raise _error(InternalError,
+                             'These two players have faced each other in '
+                             'this tournament before.')
+            if (winner == loser):
+                raise _error(InternalError,
+                             'Winner and loser cannot be the same player.')
+            if (not self._in_tournament(winner, tournament)):
+                raise _error(IntegrityError,
+                             'insert or update on table "matches" violates '
+                             'foreign key constraint '
+                             '"matches_tournament_id_winner_fkey"')
+            if (loser != 0 and not self._in_tournament(loser, tournament)):
+                raise _error(IntegrityError,
+                             'insert or update on table "matches" violates '
+                             'foreign key constraint '
+                             '"matches_tournament_id_loser_fkey"')
+            if (loser == 0 and self.tables.byes[winner] > 0):
+                raise _error(IntegrityError,
+                             'duplicate key value violates unique constraint '
+                             '"one_bye_per_tournament"')
+
+            if (loser == 0):
+                # a bye is never a tie
+                self._insert_match(tournament, winner, None, False)
+            else:
+                self._insert_match(tournament, winner, loser, is_tie)
+            self._refresh([winner, loser or None])
+
+    def hasResult(self, tournament, winner, loser):
+        """Returns True if the players (a loser of None is a bye) already
+        have a result; see tournament._record_result()."""
+        with self.lock:
+            if (loser is not None):
+                return self._has_met(tournament, winner, loser)
+            return (self._in_tournament(winner, tournament) and
+                    self.tables.byes[winner] > 0)
+
+    def reportRound(self, tournament, winners, losers, ties):
+        _check_ints(tournament, *(winners + losers))
+        with self.lock:
+            seats = {}
+            for player in winners + losers:
+                if (player is not None):
+                    seats[player] = seats.get(player, 0) + 1
+
+            # the first problem in the round, as report_round() finds it
+            for (winner, loser) in zip(winners, losers):
+                problem = None
+                if (winner == loser):
+                    problem = 'Winner and loser cannot be the same player.'
+                elif (seats[winner] > 1 or seats.get(loser, 0) > 1):
+                    problem = ('A player cannot play more than one match in '
+                               'a round.')
+                elif (not self._in_tournament(winner, tournament) or
+                      (loser is not None and
+                       not self._in_tournament(loser, tournament))):
+                    problem = ('Both players must be registered in this '
+                               'tournament.')
+                elif (not self._is_paired(tournament, winner, loser)):
+                    problem = ('These two players were not paired in the '
+                               'current round.')
+                elif (loser is None and self.tables.byes[winner] > 0):
+                    problem = ('No player can receive more than one bye in a '
+                               'tournament.')
+                elif (loser is not None and
+                      self._has_met(tournament, winner, loser)):
+                    problem = ('These two players have faced each other in '
+                               'this tournament before.')
+                if (problem):
+                    raise _error(InternalError, problem)
+
+            for (winner, loser, is_tie) in zip(winners, losers, ties):
+                self._insert_match(tournament, winner, loser, is_tie)
+            self._refresh(list(seats))
+
+    def storePairings(self, pairings):
+        """Stores a new round of pairings for each tournament.
+
+        Args:
+          pairings: a dict of tournament ID -> list of (id1, name1, id2,
+                      name2) tuples, as returned by swissPairings()
+
+        Returns:
+          A dict of tournament ID -> the number of the stored round
+        """
+        with self.lock:
+            t = self.tables
+            for (tournament, pairs) in pairings.items():
+                for pair in pairs:
+                    for player in (pair[0], pair[2]):
+                        if (player is not None and
+                                not self._in_tournament(player, tournament)):
+                            raise _error(IntegrityError,
+                                         'insert or update on table '
+                                         '"pairings" violates foreign key '
+                                         'constraint')
+
+            round_numbers = {}
+            for (tournament, pairs) in pairings.items():
+                self._keep(t.pairings, tournament)
+                rounds = t.pairings.setdefault(tournament, [])
+                rounds.append([(pair[0], pair[2]) for pair in pairs])
+                round_numbers[tournament] = len(rounds)
+            return round_numbers
+
+    def openRounds(self, tournament_ids):
+        """Returns a dict of tournament ID -> the pairs of its latest stored
+        round, for each tournament still waiting for a result of it; see
+        tournament._open_rounds()."""
+        with self.lock:
+            rounds = {}
+            for tournament in tournament_ids:
+                round_number = self.currentRound(tournament)
+                if (round_number):
+                    pairs, complete = self._round_pairs(tournament,
+                                                        round_number)
+                    if (not complete):
+                        rounds[tournament] = pairs
+            return rounds
+
+    def currentRound(self, tournament):
+        with self.lock:
+            return len(self.tables.pairings.get(tournament, ()))
+
+    def roundPairings(self, tournament, round_number=None):
+        with self.lock:
+            rounds = self.currentRound(tournament)
+            if (round_number is None):
+                round_number = rounds
+            if (not 0 < round_number <= rounds):
+                return []
+            return self._round_pairs(tournament, round_number)[0]
+
+    def _tournament_matches(self, tournament):
+        """Returns every Match of a tournament, by ID."""
+        t = self.tables
+        matches = dict((id(match), match)
+                       for p in t.rosters.get(tournament, ())
+                       for match in t.player_matches[p])
+        return sorted(matches.values(), key=lambda m: m.id)
+
+    def pairingCounts(self, tournament):
+        """Returns (number of players, highest player ID, number of
+        matches), as tournament._PairingRows does."""
+        with self.lock:
+            t = self.tables
+            roster = t.rosters.get(tournament, ())
+            # a match goes with its winner, so each is counted once here
+            match_count = sum(1 for p in roster
+                              for match in t.player_matches[p]
+                              if match.winner == p)
+            return len(roster), max(roster or [0]), match_count
+
+    def pairingPlayers(self, tournament):
+        """Returns the (id, name) of every player."""
+        with self.lock:
+            t = self.tables
+            return [(p, t.registrants[t.player_registrant[p]])
+                    for p in t.rosters.get(tournament, ())]
+
+    def pairingMatches(self, tournament, after):
+        """Returns (id, winner, loser, is_tie, is_bye) for every match with
+        an ID above after, by ID."""
+        with self.lock:
+            return [(m.id, m.winner, m.loser, m.is_tie, m.is_bye)
+                    for m in self._tournament_matches(tournament)
+                    if m.id > after]
+
+    def snapshotRows(self, tournament):
+        """Returns everything a snapshot holds about a tournament, as a
+        tuple of (name, players, matches, pairings) in the formats of
+        snapshot.buildSnapshot(), or None if there is no such tournament."""
+        with self.lock:
+            t = self.tables
+            if (tournament not in t.tournaments):
+                return None
+            roster = sorted(t.rosters.get(tournament, ()))
+            players = [(p, t.player_registrant[p],
+                        t.registrants[t.player_registrant[p]], t.wins[p],
+                        t.matches[p], t.ties[p], t.byes[p], t.omw[p])
+                       for p in roster]
+            matches = [(m.id, m.winner, m.loser, m.is_tie, m.is_bye, m.round)
+                       for m in self._tournament_matches(tournament)]
+            pairings = [(i + 1, board + 1, one, two)
+                        for (i, pairs) in
+                        enumerate(t.pairings.get(tournament, ()))
+                        for (board, (one, two)) in enumerate(pairs)]
+            return t.tournaments[tournament], players, matches, pairings
+
+    def loadSnapshot(self, snapshot):
+        """Adds the tournament saved in a snapshot.Snapshot, keeping every
+        ID it had; see tournament.importSnapshot()."""
+        with self.lock:
+            t = self.tables
+            tournament = snapshot.tournament_id
+            players = snapshot.players()
+
+            if (tournament in t.tournaments):
+                raise _error(IntegrityError,
+                             'duplicate key value violates unique constraint '
+                             '"tournaments_pkey"')
+            for row in players:
+                if (row[0] < len(t.player_tournament) and
+                        t.player_tournament[row[0]]):
+                    raise _error(IntegrityError,
+                                 'duplicate key value violates unique '
+                                 'constraint "standings_pkey"')
+
+            self._set(t.tournaments, tournament, snapshot.tournamentName())
+            for (player, registrant, name, wins, played, ties, byes,
+                 omw) in players:
+                # a registrant already here is taken to be the same person
+                if (registrant not in t.registrants):
+                    self._set(t.registrants, registrant, name)
+                self._add_player(tournament, registrant, player)
+                self._set(t.wins, player, wins)
+                self._set(t.matches, player, played)
+                self._set(t.ties, player, ties)
+                self._set(t.byes, player, byes)
+                self._set(t.omw, player, omw)
+
+            matches = snapshot.matchRows()
+            for (match, winner, loser, is_tie, is_bye,
+                 round_number) in matches:
+                match = Match(match, tournament, winner, loser, is_tie,
+                              is_bye, round_number)
+                self._keep(t.player_matches, winner)
+                t.player_matches[winner].append(match)
+                if (loser is not None):
+                    self._keep(t.player_matches, loser)
+                    t.player_matches[loser].append(match)
+                    self._add_to(t.pairs, tournament,
+                                 (min(winner, loser), max(winner, loser)))
+
+            rounds = []
+            for (round_number, board, one, two) in snapshot.pairings():
+                while (len(rounds) < round_number):
+                    rounds.append([])
+                rounds[round_number - 1].append((one, two))
+            if (rounds):
+                self._set(t.pairings, tournament, rounds)
+
+            # like setval(): new IDs carry on after the ones loaded
+            for (sequence, ids) in (
+                    ('registrants', [row[1] for row in players]),
+                    ('tournaments', [tournament]),
+                    ('players', [row[0] for row in players]),
+                    ('matches', [row[0] for row in matches])):
+                self.sequences[sequence] = max([self.sequences[sequence]] +
+                                               ids)
+
+    def matchRows(self, tournament):
+        """Returns the tournament's matches as (winner, loser, is_tie,
+        is_bye) rows in the order they were reported; see
+        tournament._load_match_rows()."""
+        with self.lock:
+            t = self.tables
+            matches = dict((id(match), match)
+                           for player in t.rosters.get(tournament, ())
+                           for match in t.player_matches[player])
+            return [(m.winner, m.loser or 0, m.is_tie, m.is_bye)
+                    for m in sorted(matches.values(), key=lambda m: m.id)]
+
+    def pairingState(self, tournament):
+        """Returns (standings, played, had_bye), as described for
+        tournament._load_pairing_state()."""
+        with self.lock:
+            t = self.tables
+            standings = [row[:3] for row in self.playerStandings(tournament)]
+            played = set(frozenset(pair)
+                         for pair in t.pairs.get(tournament, ()))
+            had_bye = set(p for p in t.rosters.get(tournament, ())
+                          if t.byes[p] > 0)
+            return standings, played, had_bye
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# metrics.py -- sinks for the timings and counts recorded by tournament.py
+#
+# Nothing is recorded until a sink is added:
+#
+#   import logging
+#   import metrics
+#   import tournament
+#
+#   logging.basicConfig(level=logging.DEBUG)
+#   tournament.addMetricsSink(metrics.LoggingSink())
+#
+# Timings are named after the function called (e.g.: "playerStandings"), or
+# after the part of a call they measure: "checkout" (getting a connection
+# from the pool), "execute" (running a statement) and "fetch" (reading rows).
+# Counts are "connections_opened", "statements" and "rows_fetched".
+#
+
+from bisect import bisect_left
+import logging
+import os
+import threading
+
+
+# the upper bounds (in seconds) of the buckets a HistogramSink sorts timings
+# into; anything slower goes in a last, unbounded bucket
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger('tournament.metrics')
+
+
+class LoggingSink(object):
+    """Logs every timing and count as it happens."""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('tournament.metrics')
+        self.level = level
+
+    def timing(self, name, seconds):
+        self.logger.log(self.level, '%s took %.3f ms', name, seconds * 1000)
+
+    def increment(self, name, amount=1):
+        self.logger.log(self.level, '%s +%s', name, amount)
+
+
+class HistogramSink(object):
+    """Keeps a histogram of every timing, and a total of every count.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.histograms = {}  # name -> [counts per bucket, total seconds]
+        self.counters = {}  # name -> total
+
+    def timing(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if (histogram is None):
+                histogram = [[0] * (len(self.buckets) + 1), 0.0]
+                self.histograms[name] = histogram
+            histogram[0][bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def percentile(self, name, p):
+        """Returns the upper bound of the bucket holding the p-th percentile
+        of a timing (None if it falls in the last bucket, or if nothing has
+        been timed)."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if (histogram is None):
+                return None
+            counts = histogram[0]
+            wanted = p / 100.0 * sum(counts)
+            seen = 0
+            for (i, count) in enumerate(counts):
+                seen += count
+                if (seen >= wanted and count):
+                    return self.buckets[i] if i < len(self.buckets) else None
+
+    def snapshot(self):
+        """Returns a copy of everything recorded, as a tuple of
+        (histograms, counters); see the attributes of the same names."""
+        with self.lock:
+            histograms = dict((name, [list(h[0]), h[1]])
+                              for (name, h) in self.histograms.items())
+            return histograms, dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class PrometheusFileSink(HistogramSink):
+    """A HistogramSink that also writes everything it has recorded to a file
+    in the Prometheus text format, e.g.: for the node exporter's textfile
+    collector.
+
+    The file is rewritten whole (so a reader never sees half of it) every
+    interval seconds, if anything has been recorded since, by a background
+    thread of the sink's own, so the calls being measured never wait on the
+    disk. It is also written whenever write() is called, and a last time by
+    close().
+    """
+
+    def __init__(self, path, interval=10, prefix='tournament',
+                 buckets=DEFAULT_BUCKETS):
+        super(PrometheusFileSink, self).__init__(buckets)
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self.changed = False  # recorded anything since the last write
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self._run,
+                                       name='prometheus-file-sink')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def timing(self, name, seconds):
+        super(PrometheusFileSink, self).timing(name, seconds)
+        self.changed = True
+
+    def increment(self, name, amount=1):
+        super(PrometheusFileSink, self).increment(name, amount)
+        self.changed = True
+
+    def close(self):
+        """Stops the thread, and writes the file one last time."""
+        self.stopped.set()
+        if (self.thread is not threading.current_thread()):
+            self.thread.join()
+        self.write()
+
+    def _run(self):
+        # Event.wait() returns nothing on Python 2, so check is_set() instead
+        while (True):
+            self.stopped.wait(self.interval)
+            if (self.stopped.is_set()):
+                return
+            if (not self.changed):
+                continue
+            try:
+                self.write()
+            except EnvironmentError:
+                logger.exception('could not write %s', self.path)
+
+    def render(self):
+        """Returns everything recorded, in the Prometheus text format."""
+        histograms, counters = self.snapshot()
+        metric = '%s_seconds' % self.prefix
+        lines = ['# HELP %s Time taken by tournament functions and the '
+                 'parts of them.' % metric,
+                 '# TYPE %s histogram' % metric]
+
+        for name in sorted(histograms):
+            counts, total = histograms[name]
+            seen = 0
+            for (bound, count) in zip(self.buckets + ('+Inf',), counts):
+                seen += count
+                lines.append('%s_bucket{name="%s",le="%s"} %s' % (
+                    metric, name, bound, seen))
+            lines.append('%s_sum{name="%s"} %r' % (metric, name, total))
+            lines.append('%s_count{name="%s"} %s' % (metric, name, seen))
+
+        for name in sorted(counters):
+            counter = '%s_%s_total' % (self.prefix, name)
+            lines.append('# TYPE %s counter' % counter)
+            lines.append('%s %s' % (counter, counters[name]))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """Writes the file now."""
+        self.changed = False
+        temp_path = '%s.%s.%s.tmp' % (self.path, os.getpid(),
+                                      threading.current_thread().ident)
+        with open(temp_path, 'w') as f:
+            f.write(self.render())
+        os.rename(temp_path, self.path)  # atomic on POSIX
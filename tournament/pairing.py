@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# pairing.py -- the Swiss pairing engines, on standings already in memory
+#
+# pairPlayers() and pairPlayersByMatching() pair a round from the standings,
+# the pairs who have already met and the players who have had a bye. They
+# don't touch the database (nor import its driver), so simulations can use
+# them on their own; tournament.py has the same functions, timed like the
+# rest of its API:
+#
+#   pairing.pairPlayers(standings, played, had_bye)
+#
+
+from matching import maxWeightMatching
+
+
+# pairPlayersByMatching() first only considers each player against this many
+# of the players ranked below them; if that doesn't give everyone a partner,
+# the window is doubled until it does (or it covers the whole field)
+PAIRING_WINDOW = 8
+
+
+def _pair_ranked(ranked, played):
+    """Pairs every player in ranked with an opponent they haven't faced.
+
+    Players are taken in order, each one paired with the highest-ranked
+    remaining player they haven't played yet, so pairs stay inside a score
+    group whenever possible and only "float" down when they have to. If a
+    choice leaves someone further down with no possible opponent, the
+    search backs up and tries the next candidate.
+
+    Args:
+      ranked: a list of player IDs, best record first
+      played: a set of frozensets, one for each pair who have already met
+
+    Returns:
+      A list of (index1, index2) pairs of positions in ranked, or None if
+        there is no way to pair everyone without a rematch
+    """
+    count = len(ranked)
+    used = [False] * count
+    stack = []  # the pairs chosen so far, as (i, j) positions in ranked
+    i = 0
+    j = 0  # where to start looking for i's opponent
+
+    while (True):
+        # skip to the best player who hasn't been paired yet
+        while (i < count and used[i]):
+            i += 1
+            j = i
+        if (i == count):
+            return stack
+
+        # look for the best remaining opponent player i hasn't faced
+        j = max(j, i) + 1
+        while (j < count and (used[j] or
+               frozenset([ranked[i], ranked[j]]) in played)):
+            j += 1
+
+        if (j < count):
+            used[i] = used[j] = True
+            stack.append((i, j))
+            i += 1
+            j = i
+        elif (stack):
+            # dead end; undo the last pair and try its next candidate
+            i, j = stack.pop()
+            used[i] = used[j] = False
+        else:
+            return None
+
+
+def pairPlayers(standings, played, had_bye=()):
+    """Generates a round of Swiss pairings from data already in memory.
+
+    This is the engine behind tournament.swissPairings(); it can also be
+    used on its own (e.g.: for simulations).
+
+    Args:
+      standings: a list of (id, name) tuples (any extra columns are ignored)
+                   in standings order, best record first
+      played: a set of frozensets, one for each pair of player IDs who have
+                already faced each other
+      had_bye: the IDs of players who have already received a bye
+
+    Returns:
+      A list of (id1, name1, id2, name2) tuples like
+        tournament.swissPairings(), with the bye (if any) last as (id, name,
+        None, None); or None if no complete round of pairings is possible
+    """
+    players = [(row[0], row[1]) for row in standings]
+    bye = None
+
+    if (len(players) % 2 != 0):
+        # the bye goes to the lowest-ranked player who hasn't had one, as
+        # long as everyone else can still be paired without them
+        for k in range(len(players) - 1, -1, -1):
+            if (players[k][0] in had_bye):
+                continue
+            rest = players[:k] + players[k + 1:]
+            pairs = _pair_ranked([p[0] for p in rest], played)
+            if (pairs is not None):
+                bye = players[k]
+                players = rest
+                break
+        else:
+            return None
+    else:
+        pairs = _pair_ranked([p[0] for p in players], played)
+        if (pairs is None):
+            return None
+
+    pair_list = []
+
+    for (i, j) in pairs:
+        pair_list.append(players[i] + players[j])
+
+    if (bye is not None):
+        pair_list.append(bye + (None, None))
+
+    return pair_list
+
+
+def pairPlayersByMatching(standings, played, had_bye=()):
+    """Generates a round of Swiss pairings as a minimum-cost matching.
+
+    Every allowed pairing (no rematches) is an edge that costs the square of
+    the difference in the two players' wins, and the round is the complete
+    set of pairings with the lowest total cost. Unlike pairPlayers(), this
+    never depends on the order players are tried in: if any complete round
+    without a rematch exists, one is found.
+
+    Args:
+      standings: a list of (id, name, wins) tuples in standings order, best
+                   record first
+      played: a set of frozensets, one for each pair of player IDs who have
+                already faced each other
+      had_bye: the IDs of players who have already received a bye
+
+    Returns:
+      A list of (id1, name1, id2, name2) tuples like pairPlayers(), or None
+        if no complete round of pairings is possible
+    """
+    players = [(row[0], row[1]) for row in standings]
+    wins = [row[2] for row in standings]
+    count = len(players)
+    if (count == 0):
+        return []
+
+    # with an odd number of players, one extra vertex stands for the bye;
+    # whoever is matched to it gets the bye
+    vertices = count + count % 2
+    # a difference of one win must always cost more than any choice between
+    # players with the same wins
+    scale = count + 1
+    lowest = min(wins)
+    window = PAIRING_WINDOW
+
+    while (True):
+        edges = []
+        for i in range(count):
+            # connect each player to the next few players below them in the
+            # standings that they haven't faced yet
+            found = 0
+            for j in range(i + 1, count):
+                if (frozenset([players[i][0], players[j][0]]) in played):
+                    continue
+                edges.append((i, j, (wins[i] - wins[j]) ** 2 * scale))
+                found += 1
+                if (found == window):
+                    break
+        if (vertices > count):
+            # the bye should go to the lowest-ranked player who can take it
+            for i in range(count):
+                if (players[i][0] not in had_bye):
+                    cost = (wins[i] - lowest) ** 2 * scale + count - 1 - i
+                    edges.append((i, count, cost))
+
+        if (edges):
+            # the matching code finds the heaviest matching, so turn the
+            # costs into weights; the cheapest edges are the heaviest
+            top = max(e[2] for e in edges) + 1
+            edges = [(i, j, top - cost) for (i, j, cost) in edges]
+            mate = maxWeightMatching(edges, True, _greedy_matching(edges))
+            mate += [-1] * (vertices - len(mate))
+        else:
+            mate = [-1] * vertices
+
+        if (-1 not in mate):
+            break
+        if (window >= count):
+            return None  # every possible pairing was considered
+        window *= 2
+
+    pair_list = []
+    bye = None
+
+    for i in range(count):
+        if (mate[i] == count):
+            bye = players[i] + (None, None)
+        elif (mate[i] > i):
+            pair_list.append(players[i] + players[mate[i]])
+
+    if (bye is not None):
+        pair_list.append(bye)
+
+    return pair_list
+
+
+def _greedy_matching(edges):
+    """Picks a starting matching from the heaviest edges, in order.
+
+    maxWeightMatching() only has to improve on this rather than build a
+    matching from nothing, which saves most of its work in a Swiss round,
+    where most players can be paired within their own score group.
+    """
+    top = max(e[2] for e in edges)
+    matched = set()
+    initial = []
+
+    for k in range(len(edges)):
+        (i, j, w) = edges[k]
+        if (w == top and i not in matched and j not in matched):
+            matched.add(i)
+            matched.add(j)
+            initial.append(k)
+
+    return initial
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# pairing_state.py -- what pairing needs to know about a tournament, kept up
+# to date one match at a time
+#
+# swissPairings() keeps a PairingState for each tournament it pairs. After a
+# round is reported only that round's matches are read and applied, so the
+# cost of getting ready to pair the next round depends on how many results
+# came in, not on the whole history of the event.
+#
+
+
+class PlayedPairs(object):
+    """The pairs of players who have already met, as one bitset per player.
+
+    Supports "frozenset([id1, id2]) in played", so it can be passed to
+    pairPlayers() and pairPlayersByMatching() in place of a set of pairs.
+    """
+    __slots__ = ('bits', 'slots')
+
+    def __init__(self, bits, slots):
+        self.bits = bits  # player ID -> int with a bit set per opponent
+        self.slots = slots  # player ID -> which bit stands for that player
+
+    def __contains__(self, pair):
+        one, two = pair
+        slot = self.slots.get(two)
+        if (slot is None):
+            return False
+        return bool(self.bits.get(one, 0) >> slot & 1)
+
+    def __len__(self):
+        return sum(bin(bits).count('1') for bits in self.bits.values()) // 2
+
+
+class PairingState(object):
+    """The standings, pairs already played and byes of one tournament.
+
+    The standings (wins and omw) follow the same rules as the standings
+    table in tournament.sql. Players are ranked within score groups (the
+    players with the same number of wins), so a result only moves the
+    players it involves from one group to another.
+    """
+
+    def __init__(self):
+        self.names = {}  # player ID -> name
+        self.wins = {}
+        self.omw = {}
+        self.opponents = {}  # player ID -> IDs of opponents, ties excluded
+        self.groups = {}  # wins -> set of player IDs with that many wins
+        self.bits = {}
+        self.slots = {}
+        self.had_bye = set()
+        # where the state is up to, so the next sync knows what to read
+        self.last_match_id = 0
+        self.match_count = 0
+        self.player_count = 0
+        self.last_player_id = 0
+
+    def addPlayer(self, player, name):
+        """Adds a player who has no results yet."""
+        self.names[player] = name
+        self.wins[player] = 0
+        self.omw[player] = 0
+        self.opponents[player] = []
+        self.groups.setdefault(0, set()).add(player)
+        self.slots[player] = len(self.slots)
+        self.bits[player] = 0
+        self.player_count += 1
+        self.last_player_id = max(self.last_player_id, player)
+
+    def _add_win(self, player):
+        wins = self.wins[player]
+        self.groups[wins].discard(player)
+        if (not self.groups[wins]):
+            del self.groups[wins]
+        self.wins[player] = wins + 1
+        self.groups.setdefault(wins + 1, set()).add(player)
+        # a win counts towards the omw of everyone the player has beaten or
+        # lost to
+        for opponent in self.opponents[player]:
+            self.omw[opponent] += 1
+
+    def applyMatch(self, match_id, winner, loser, is_tie, is_bye):
+        """Applies one row of the matches table, which must be newer than
+        any applied so far; a loser of None is a bye, or a player who has
+        since left the tournament."""
+        self.last_match_id = max(self.last_match_id, match_id)
+        self.match_count += 1
+
+        if (is_bye):
+            self.had_bye.add(winner)
+        if (loser is None):
+            if (not is_tie):
+                self._add_win(winner)
+            return
+
+        self.bits[winner] |= 1 << self.slots[loser]
+        self.bits[loser] |= 1 << self.slots[winner]
+        if (is_tie):
+            return
+
+        self._add_win(winner)
+        self.opponents[winner].append(loser)
+        self.opponents[loser].append(winner)
+        self.omw[winner] += self.wins[loser]
+        self.omw[loser] += self.wins[winner]
+
+    def standings(self):
+        """Returns the (id, name, wins) of every player, in the same order as
+        the player_standings view: by wins, then omw, then ID."""
+        standings = []
+        for wins in sorted(self.groups, reverse=True):
+            group = sorted(self.groups[wins],
+                           key=lambda p: (-self.omw[p], p))
+            standings.extend((p, self.names[p], wins) for p in group)
+        return standings
+
+    def played(self):
+        """Returns a PlayedPairs of the pairs who have met so far; later
+        matches applied to the state don't change it."""
+        return PlayedPairs(dict(self.bits), self.slots)
+
+
+def syncPairingState(state, counts):
+    """Works out what a tournament's PairingState is missing, whatever the
+    rows are read with (a cursor, a storage backend, asyncpg).
+
+    Only the matches reported since the state was last brought up to date
+    are read, as long as nothing else changed: if any match was deleted (or
+    one with a lower ID than the last one read has since been committed), or
+    a player added or removed, everything is read again.
+
+    This is a generator: each step yields what to read, and the caller
+    sends back the rows. A step is ('matches', after), for the (id, winner,
+    loser, is_tie, is_bye) of every match with an ID above after, by ID, or
+    ('players', None), for the (id, name) of every player. The last step is
+    ('done', (state, matches)), which needs nothing sent back.
+
+    Args:
+      state: the PairingState from last time, or None
+      counts: (number of players, highest player ID, number of matches), as
+        they are now
+
+    Yields:
+      What to read next, then the state (a new one, with its players, if it
+      had to be read in full) and the rows of the matches still to apply to
+      it
+    """
+    player_count, last_player_id, match_count = counts
+
+    if (state is not None and state.player_count == player_count and
+            state.last_player_id == last_player_id):
+        matches = yield ('matches', state.last_match_id)
+        if (state.match_count + len(matches) == match_count):
+            yield ('done', (state, matches))
+            return
+
+    state = PairingState()
+    players = yield ('players', None)
+    for (player, name) in players:
+        state.addPlayer(player, name)
+    matches = yield ('matches', 0)
+    yield ('done', (state, matches))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# simulate.py -- Monte Carlo simulation of whole Swiss tournaments
+#
+# Plays many tournaments between players of known strength, pairing each
+# round as swissPairings() does and recording results under the same rules as
+# reportMatch(), to see how an event of a given size and length behaves.
+# Everything is kept in memory (see memory.py); no database is needed.
+#
+#   python simulate.py --tournaments 1000 --players 15 16 17 --rounds 4
+#
+
+from __future__ import division
+
+import argparse
+import multiprocessing
+import random
+
+from memory import MemoryBackend
+from pairing import pairPlayers, pairPlayersByMatching
+
+
+def expectedScore(rating, opponent_rating):
+    """Returns the chance that a player beats an opponent (Elo formula)."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def rankCorrelation(standings, ratings):
+    """Returns Spearman's rank correlation between the standings and the
+    players' real strength: 1 if they are in exactly the right order.
+
+    Args:
+      standings: player IDs from first place to last
+      ratings: dict of player ID -> rating
+    """
+    n = len(standings)
+    if (n < 2):
+        return 1.0
+    strongest = sorted(standings, key=lambda p: (-ratings[p], p))
+    true_rank = dict((p, i) for (i, p) in enumerate(strongest))
+    distance = sum((i - true_rank[p]) ** 2 for (i, p) in enumerate(standings))
+    return 1 - 6 * distance / (n * (n * n - 1))
+
+
+def simulateTournament(seed, player_count, rounds, tie_rate=0.05,
+                       spread=200, mode='backtrack', ratings=None):
+    """Plays one tournament.
+
+    Args:
+      seed: seed for the random number generator; the same seed (and
+              arguments) always plays out the same tournament
+      player_count: the number of players
+      rounds: the number of rounds to play
+      tie_rate: the chance that any match is a tie
+      spread: the standard deviation of the players' Elo ratings, which are
+                drawn at random around 1500 (ignored if ratings is given)
+      mode: 'backtrack' or 'matching', as for swissPairings()
+      ratings: a rating for each player, strongest first or in any order
+                 (optional)
+
+    Returns:
+      A dict of:
+        failed_round: the round that couldn't be paired, or None
+        bye_ranks: how each player given a bye ranks by strength (0 is the
+          strongest), in round order
+        correlations: the rankCorrelation() of the standings after each
+          round played
+        strongest_won: True if the strongest player finished first
+    """
+    rng = random.Random(seed)
+    if (ratings is None):
+        ratings = [rng.gauss(1500, spread) for i in range(player_count)]
+
+    backend = MemoryBackend()
+    tournament = backend.createTournament('Simulation %s' % seed)
+    player_ids = backend.registerPlayers(
+        ['Player %s' % i for i in range(len(ratings))], tournament)
+    rating = dict(zip(player_ids, ratings))
+    strength_rank = dict(
+        (p, i) for (i, p) in
+        enumerate(sorted(player_ids, key=lambda p: (-rating[p], p))))
+
+    failed_round = None
+    bye_ranks = []
+    correlations = []
+
+    for round_number in range(1, rounds + 1):
+        standings, played, had_bye = backend.pairingState(tournament)
+        if (mode == 'matching'):
+            pairs = pairPlayersByMatching(standings, played, had_bye)
+        else:
+            pairs = pairPlayers([row[:2] for row in standings], played,
+                                had_bye)
+        if (pairs is None):
+            failed_round = round_number
+            break
+
+        winners = []
+        losers = []
+        ties = []
+        for (one, name_one, two, name_two) in pairs:
+            if (two is None):
+                bye_ranks.append(strength_rank[one])
+                winners.append(one)
+                losers.append(None)
+                ties.append(False)
+            elif (rng.random() < tie_rate):
+                winners.append(one)
+                losers.append(two)
+                ties.append(True)
+            else:
+                if (rng.random() >= expectedScore(rating[one], rating[two])):
+                    one, two = two, one
+                winners.append(one)
+                losers.append(two)
+                ties.append(False)
+        backend.reportRound(tournament, winners, losers, ties)
+
+        final = [row[0] for row in backend.playerStandings(tournament)]
+        correlations.append(rankCorrelation(final, rating))
+
+    final = [row[0] for row in backend.playerStandings(tournament)]
+
+    return {
+        'failed_round': failed_round,
+        'bye_ranks': bye_ranks,
+        'correlations': correlations,
+        'strongest_won': bool(final) and strength_rank[final[0]] == 0,
+    }
+
+
+def _simulate(args):
+    """simulateTournament() for Pool.imap(), which passes one argument."""
+    return simulateTournament(*args)
+
+
+def simulate(tournaments, player_count, rounds, tie_rate=0.05, spread=200,
+             mode='backtrack', seed=0, processes=None):
+    """Plays many tournaments, spread across a pool of processes.
+
+    Tournament i is played with the seed seed + i, so the summary is the
+    same however many processes are used.
+
+    Args:
+      tournaments: how many tournaments to play
+      player_count, rounds, tie_rate, spread, mode: as for
+        simulateTournament()
+      seed: the seed of the first tournament
+      processes: the number of worker processes; None uses one per CPU, and
+                   1 plays every tournament in this process
+
+    Returns:
+      A dict summarising the tournaments (see printSummary())
+    """
+    tasks = [(seed + i, player_count, rounds, tie_rate, spread, mode)
+             for i in range(tournaments)]
+
+    if (processes == 1):
+        results = [_simulate(task) for task in tasks]
+    else:
+        workers = processes or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunk_size = max(1, tournaments // (4 * workers))
+            results = list(pool.imap(_simulate, tasks, chunk_size))
+        finally:
+            pool.close()
+            pool.join()
+
+    failures = [r['failed_round'] for r in results if r['failed_round']]
+    byes_by_decile = [0] * 10
+    for r in results:
+        for rank in r['bye_ranks']:
+            byes_by_decile[rank * 10 // player_count] += 1
+
+    convergence = []
+    for i in range(rounds):
+        reached = [r['correlations'][i] for r in results
+                   if len(r['correlations']) > i]
+        if (reached):
+            convergence.append(sum(reached) / len(reached))
+
+    return {
+        'tournaments': tournaments,
+        'players': player_count,
+        'rounds': rounds,
+        'failures': len(failures),
+        'failed_rounds': sorted(set(failures)),
+        'byes_by_decile': byes_by_decile,
+        'convergence': convergence,
+        'strongest_won': sum(1 for r in results if r['strongest_won']),
+    }
+
+
+def printSummary(summary):
+    """Prints what simulate() found."""
+    count = summary['tournaments']
+    print('%s tournaments of %s players, %s rounds' % (
+        count, summary['players'], summary['rounds']))
+    print('  pairing failed: %s (%.1f%%)%s' % (
+        summary['failures'], 100 * summary['failures'] / count,
+        ' in rounds %s' % summary['failed_rounds']
+        if summary['failed_rounds'] else ''))
+    print('  byes by strength decile (strongest first): %s' % (
+        summary['byes_by_decile'],))
+    print('  rank correlation with strength after each round: %s' % (
+        ', '.join('%.3f' % c for c in summary['convergence']),))
+    print('  strongest player finished first: %.1f%%' % (
+        100 * summary['strongest_won'] / count,))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Simulate many Swiss tournaments in memory.')
+    parser.add_argument('--tournaments', type=int, default=1000)
+    parser.add_argument('--players', type=int, nargs='+', default=[16],
+                        help='one or more field sizes to simulate')
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--tie-rate', type=float, default=0.05)
+    parser.add_argument('--spread', type=float, default=200,
+                        help='standard deviation of the Elo ratings')
+    parser.add_argument('--mode', choices=['backtrack', 'matching'],
+                        default='backtrack')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    for player_count in args.players:
+        printSummary(simulate(args.tournaments, player_count, args.rounds,
+                              args.tie_rate, args.spread, args.mode,
+                              args.seed, args.processes))
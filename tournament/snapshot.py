@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+# snapshot.py -- one tournament saved as a compact binary file
+#
+# A snapshot holds everything about one tournament: its players and their
+# names, their standings (wins, matches, ties, byes and omw), its matches and
+# its stored rounds of pairings. Each is kept as a column of fixed-width
+# integers and written to the file as is, so reading a snapshot back is one
+# read of the file and one copy per column, however big the event:
+#
+#   tournament.exportSnapshot(tournament_id, 'event.snap')
+#   tournament.importSnapshot('event.snap')  # e.g.: into another database
+#
+# A snapshot can also be used without a database:
+#
+#   saved = snapshot.readSnapshot('event.snap')
+#   pairing.pairPlayers(*saved.pairingState())
+#
+# The file starts with a header (HEADER, then the length of every column in
+# the order of COLUMNS), followed by the columns in that order, each padded
+# to a multiple of 8 bytes. Integers are little-endian.
+#
+
+from array import array
+import os
+import struct
+import sys
+
+
+MAGIC = b'TSNP'
+VERSION = 1
+
+# magic, version, number of columns, tournament ID
+HEADER = struct.Struct('<4sHHi')
+
+# the columns of a snapshot, and their array type codes ('i' is a 32-bit
+# integer, 'B' a byte); the columns in each group are parallel
+COLUMNS = (
+    ('tournament_name', 'B'),  # UTF-8
+    # one element per player, by player ID
+    ('player_ids', 'i'),
+    ('registrant_ids', 'i'),
+    ('name_offsets', 'i'),  # where each name starts in names, plus its end
+    ('names', 'B'),  # UTF-8
+    ('wins', 'i'),
+    ('matches', 'i'),
+    ('ties', 'i'),
+    ('byes', 'i'),
+    ('omw', 'i'),
+    # one element per match, in the order they were reported
+    ('match_ids', 'i'),
+    ('winners', 'i'),
+    ('losers', 'i'),  # 0 for no loser
+    ('match_flags', 'B'),  # IS_TIE | IS_BYE
+    ('match_rounds', 'i'),  # 0 if the match wasn't in a stored round
+    # one element per stored pair, by round, then board
+    ('pairing_rounds', 'i'),
+    ('pairing_boards', 'i'),
+    ('player_ones', 'i'),
+    ('player_twos', 'i'),  # 0 for a bye
+)
+
+IS_TIE = 1
+IS_BYE = 2
+
+_ALIGNMENT = 8
+
+
+def _encode(text):
+    if (isinstance(text, bytes)):
+        return text
+    return text.encode('utf-8')
+
+
+def _decode(data):
+    """Returns a name as the database driver would: str on every version of
+    Python (which is bytes on Python 2)."""
+    if (str is bytes):
+        return data
+    return data.decode('utf-8')
+
+
+def _to_bytes(column):
+    if (hasattr(column, 'tobytes')):
+        return column.tobytes()
+    return column.tostring()  # Python 2
+
+
+def _from_bytes(column, data):
+    if (hasattr(column, 'frombytes')):
+        column.frombytes(data)
+    else:
+        # Python 2, whose fromstring() won't take a memoryview
+        if (isinstance(data, memoryview)):
+            data = data.tobytes()
+        column.fromstring(data)
+
+
+class Snapshot(object):
+    """One tournament, as the columns listed in COLUMNS.
+
+    Build one with buildSnapshot() or readSnapshot().
+    """
+    __slots__ = ('tournament_id',) + tuple(name for (name, code) in COLUMNS)
+
+    def __init__(self, tournament_id=0):
+        self.tournament_id = tournament_id
+        for (name, code) in COLUMNS:
+            setattr(self, name, array(code))
+
+    def tournamentName(self):
+        return _decode(_to_bytes(self.tournament_name))
+
+    def playerName(self, i):
+        """Returns the name of the i-th player (not player ID i)."""
+        start, end = self.name_offsets[i], self.name_offsets[i + 1]
+        return _decode(_to_bytes(self.names[start:end]))
+
+    def players(self):
+        """Returns a (player ID, registrant ID, name, wins, matches, ties,
+        byes, omw) row per player, by player ID."""
+        return [(self.player_ids[i], self.registrant_ids[i],
+                 self.playerName(i), self.wins[i], self.matches[i],
+                 self.ties[i], self.byes[i], self.omw[i])
+                for i in range(len(self.player_ids))]
+
+    def matchRows(self):
+        """Returns a (match ID, winner, loser, is_tie, is_bye, round) row
+        per match, in the order they were reported; loser and round are None
+        if the match has none."""
+        return [(self.match_ids[i], self.winners[i], self.losers[i] or None,
+                 bool(self.match_flags[i] & IS_TIE),
+                 bool(self.match_flags[i] & IS_BYE),
+                 self.match_rounds[i] or None)
+                for i in range(len(self.match_ids))]
+
+    def pairings(self):
+        """Returns a (round, board, player one, player two) row per stored
+        pair, by round, then board; player two is None for a bye."""
+        return [(self.pairing_rounds[i], self.pairing_boards[i],
+                 self.player_ones[i], self.player_twos[i] or None)
+                for i in range(len(self.pairing_rounds))]
+
+    def standings(self):
+        """Returns the standings as tournament.playerStandings() does: a list
+        of (id, name, wins, matches, omw), in the same order as the
+        player_standings view."""
+        ranked = sorted(range(len(self.player_ids)),
+                        key=lambda i: (-self.wins[i], -self.omw[i],
+                                       self.player_ids[i]))
+        return [(self.player_ids[i], self.playerName(i), self.wins[i],
+                 self.matches[i], self.omw[i]) for i in ranked]
+
+    def pairingState(self):
+        """Returns (standings, played, had_bye), ready to be passed to
+        pairing.pairPlayers() or pairPlayersByMatching()."""
+        standings = [row[:3] for row in self.standings()]
+        played = set(frozenset([self.winners[i], self.losers[i]])
+                     for i in range(len(self.match_ids)) if self.losers[i])
+        had_bye = set(self.player_ids[i] for i in range(len(self.player_ids))
+                      if self.byes[i] > 0)
+        return standings, played, had_bye
+
+
+def buildSnapshot(tournament_id, tournament_name, players, matches,
+                  pairings):
+    """Builds a Snapshot from rows in the formats returned by
+    Snapshot.players(), Snapshot.matchRows() and Snapshot.pairings()."""
+    s = Snapshot(tournament_id)
+    _from_bytes(s.tournament_name, _encode(tournament_name))
+
+    s.name_offsets.append(0)
+    for (player, registrant, name, wins, played, ties, byes,
+         omw) in players:
+        s.player_ids.append(player)
+        s.registrant_ids.append(registrant)
+        _from_bytes(s.names, _encode(name))
+        s.name_offsets.append(len(s.names))
+        s.wins.append(wins)
+        s.matches.append(played)
+        s.ties.append(ties)
+        s.byes.append(byes)
+        s.omw.append(omw)
+
+    for (match, winner, loser, is_tie, is_bye, round_number) in matches:
+        s.match_ids.append(match)
+        s.winners.append(winner)
+        s.losers.append(loser or 0)
+        s.match_flags.append((IS_TIE if is_tie else 0) |
+                             (IS_BYE if is_bye else 0))
+        s.match_rounds.append(round_number or 0)
+
+    for (round_number, board, one, two) in pairings:
+        s.pairing_rounds.append(round_number)
+        s.pairing_boards.append(board)
+        s.player_ones.append(one)
+        s.player_twos.append(two or 0)
+
+    return s
+
+
+def writeSnapshot(snapshot, path):
+    """Writes a Snapshot to a file.
+
+    The file is written under a temporary name and then renamed, so a crash
+    part way through never leaves half a snapshot behind.
+    """
+    columns = [getattr(snapshot, name) for (name, code) in COLUMNS]
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(COLUMNS),
+                            snapshot.tournament_id))
+        f.write(struct.pack('<%dI' % len(columns),
+                            *[len(column) for column in columns]))
+        f.write(b'\0' * (-f.tell() % _ALIGNMENT))
+        for column in columns:
+            if (sys.byteorder == 'big' and column.itemsize > 1):
+                column = array(column.typecode, column)
+                column.byteswap()
+            column.tofile(f)
+            f.write(b'\0' * (-f.tell() % _ALIGNMENT))
+
+    os.rename(temp_path, path)  # atomic on POSIX
+
+
+def readSnapshot(path):
+    """Reads a Snapshot written by writeSnapshot().
+
+    Raises:
+      ValueError: if the file isn't a snapshot this version can read
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if (len(data) < HEADER.size):
+        raise ValueError('%s is not a version %s tournament snapshot.'
+                         % (path, VERSION))
+    magic, version, column_count, tournament_id = HEADER.unpack_from(data, 0)
+    if (magic != MAGIC or version != VERSION or
+            column_count != len(COLUMNS)):
+        raise ValueError('%s is not a version %s tournament snapshot.'
+                         % (path, VERSION))
+    if (len(data) < HEADER.size + 4 * column_count):
+        raise ValueError('%s is truncated.' % path)
+    lengths = struct.unpack_from('<%dI' % column_count, data, HEADER.size)
+
+    # slices of a memoryview aren't copies, so each column is copied once,
+    # straight into its array
+    view = memoryview(data)
+    s = Snapshot(tournament_id)
+    offset = HEADER.size + 4 * column_count
+    for ((name, code), length) in zip(COLUMNS, lengths):
+        offset += -offset % _ALIGNMENT
+        column = getattr(s, name)
+        end = offset + length * column.itemsize
+        if (end > len(data)):
+            raise ValueError('%s is truncated.' % path)
+        _from_bytes(column, view[offset:end])
+        if (sys.byteorder == 'big' and column.itemsize > 1):
+            column.byteswap()
+        offset = end
+    return s
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# tiebreak.py -- tiebreak scores for a tournament, computed with NumPy
+#
+# Every score is worked out for the whole field at once from the matches of a
+# tournament, kept as a sparse (coordinate list) opponent matrix: one entry
+# per player per match played against an opponent. Needs NumPy:
+#
+#   pip install numpy
+#
+
+import numpy as np
+
+
+# the tiebreaks computeTiebreaks() knows about:
+#   score: match points, with a win (or bye) worth 1 and a tie worth 1/2
+#   omw: the total wins of the player's opponents, ties excluded (the same
+#     number as the omw column of the player_standings view)
+#   omw_pct: opponents' match-win percentage, the average of the opponents'
+#     points per match, each counted as at least 1/3
+#   sonneborn_berger: the scores of the opponents the player beat, plus half
+#     the scores of the ones they tied with
+#   buchholz: the total score of the player's opponents
+#   cumulative: the player's running score added up round by round, which
+#     favours players who won early
+TIEBREAKS = ('score', 'omw', 'omw_pct', 'sonneborn_berger', 'buchholz',
+             'cumulative')
+
+
+def computeTiebreaks(player_ids, matches):
+    """Computes every tiebreak in TIEBREAKS for every player.
+
+    Args:
+      player_ids: the IDs of the players in the tournament
+      matches: the tournament's matches as (winner, loser, is_tie, is_bye)
+                 rows in the order they were reported; a loser of 0 (or
+                 None) is a bye, or a match whose loser has left the
+                 tournament, which still counts as a tie if it was one
+
+    Returns:
+      A dict of tiebreak name -> array of values, in the same order as
+        player_ids; 'wins' and 'matches' are included as well
+    """
+    ids = np.asarray(player_ids, dtype=np.int64)
+    n = len(ids)
+    rows = np.array([(w, l or 0, t, b) for (w, l, t, b) in matches],
+                    dtype=np.int64).reshape(-1, 4)
+
+    # player IDs -> positions in player_ids
+    order = np.argsort(ids)
+    winner = order[np.searchsorted(ids, rows[:, 0], sorter=order)]
+    has_loser = rows[:, 1] != 0
+    loser = np.zeros(len(rows), dtype=np.int64)
+    loser[has_loser] = order[np.searchsorted(ids, rows[has_loser, 1],
+                                             sorter=order)]
+    # the stored flags, rather than the loser: a loser who has left the
+    # tournament doesn't turn a tie into a win (a bye is never a tie)
+    is_tie = (rows[:, 2] != 0) & (rows[:, 3] == 0)
+
+    # what the winner and loser of each match earned
+    winner_points = np.where(is_tie, 0.5, 1.0)
+    loser_points = np.where(is_tie, 0.5, 0.0)
+
+    wins = np.bincount(winner[~is_tie], minlength=n)
+    played = (np.bincount(winner, minlength=n) +
+              np.bincount(loser[has_loser], minlength=n))
+    score = (np.bincount(winner, weights=winner_points, minlength=n) +
+             np.bincount(loser[has_loser], weights=loser_points[has_loser],
+                         minlength=n))
+
+    # the opponent matrix: entry k says player[k] met opponent[k] and earned
+    # result[k] from it
+    player = np.concatenate((winner[has_loser], loser[has_loser]))
+    opponent = np.concatenate((loser[has_loser], winner[has_loser]))
+    result = np.concatenate((winner_points[has_loser],
+                             loser_points[has_loser]))
+    decisive = np.concatenate((~is_tie[has_loser], ~is_tie[has_loser]))
+
+    omw = np.bincount(player[decisive], weights=wins[opponent[decisive]],
+                      minlength=n)
+
+    match_win_pct = np.maximum(score / np.maximum(played, 1), 1.0 / 3)
+    opponent_count = np.bincount(player, minlength=n)
+    omw_pct = (np.bincount(player, weights=match_win_pct[opponent],
+                           minlength=n) / np.maximum(opponent_count, 1))
+
+    buchholz = np.bincount(player, weights=score[opponent], minlength=n)
+    sonneborn_berger = np.bincount(player, weights=result * score[opponent],
+                                   minlength=n)
+
+    # cumulative: a result from round j of g adds to the running score in
+    # every round from j on, so it counts (g - j) times
+    seat = np.concatenate((winner, loser[has_loser]))
+    points = np.concatenate((winner_points, loser_points[has_loser]))
+    reported = np.concatenate((np.arange(len(rows)),
+                               np.nonzero(has_loser)[0]))
+    by_seat = np.lexsort((reported, seat))
+    seat = seat[by_seat]
+    rounds_before = (np.arange(len(seat)) -
+                     np.searchsorted(seat, seat, side='left'))
+    cumulative = np.bincount(
+        seat, weights=points[by_seat] * (played[seat] - rounds_before),
+        minlength=n)
+
+    return {
+        'wins': wins,
+        'matches': played,
+        'score': score,
+        'omw': omw.astype(np.int64),
+        'omw_pct': omw_pct,
+        'sonneborn_berger': sonneborn_berger,
+        'buchholz': buchholz,
+        'cumulative': cumulative,
+    }
+
+
+def rankPlayers(player_ids, matches, order):
+    """Sorts the players by wins, then by the given tiebreaks.
+
+    Args:
+      player_ids: the IDs of the players in the tournament
+      matches: the tournament's matches, as for computeTiebreaks()
+      order: the names of the tiebreaks to use, most important first; a
+               higher value ranks higher, and player ID settles anything
+               still tied
+
+    Returns:
+      A tuple of (positions, scores): the positions in player_ids from first
+        place to last, and the dict returned by computeTiebreaks()
+    """
+    scores = computeTiebreaks(player_ids, matches)
+
+    # np.lexsort sorts by its last key first
+    keys = [np.asarray(player_ids)]
+    keys.extend(-scores[name] for name in reversed(order))
+    keys.append(-scores['wins'])
+
+    return np.lexsort(keys), scores
@@ -3,13 +3,652 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+from collections import OrderedDict
 from contextlib import contextmanager
+import functools
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import select
+import threading
+import time
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from journal import ResultJournal
+from memory import MemoryBackend
+import pairing
+from pairing_state import syncPairingState
+from snapshot import buildSnapshot, readSnapshot, writeSnapshot
+
+
+logger = logging.getLogger('tournament')
+
+# connection settings; change these with configure() rather than editing
+# them directly so that an existing pool gets rebuilt with the new values
+DSN = 'dbname=tournament'
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 10
+# connections that have been idle in the pool longer than this many seconds
+# are checked with a "SELECT 1" before being handed out again
+HEALTH_CHECK_INTERVAL = 30
+# swissPairings() remembers the standings and pairs already played of this
+# many tournaments between calls, so it only has to read the results
+# reported since (see pairing_state.py); the least recently paired are
+# dropped first
+PAIRING_STATE_SIZE = 64
+# pairAll() pairs tournaments on a pool of this many worker processes; None
+# starts one per CPU, and 1 pairs them one after another in this process
+PAIRING_PROCESSES = None
+
+# playerStandings() keeps the standings of this many tournaments in memory,
+# dropping the least recently used ones first; 0 turns the cache off
+STANDINGS_CACHE_SIZE = 64
+# the channel used to tell other processes that standings have changed
+STANDINGS_CHANNEL = 'standings_changed'
+
+# how playerStandings() breaks ties between players with the same number of
+# wins, most important first; any of the names in tiebreak.TIEBREAKS may be
+# used. Anything but ('omw',), which the database keeps up to date itself,
+# is computed with NumPy from the tournament's matches
+TIEBREAK_ORDER = ('omw',)
+
+# the streaming functions (e.g.: iterStandings()) read rows from the database
+# this many at a time, unless told otherwise
+FETCH_SIZE = 2000
+
+# the bulk functions (e.g.: registerPlayers()) send rows to the database in
+# batches of this many, so a huge import doesn't build one enormous statement
+BATCH_SIZE = 1000
+
+# the statements in _STATEMENTS are prepared once per connection and then run
+# by name; turn this off behind a connection pooler that doesn't give each
+# client a server connection of its own (e.g.: PgBouncer in transaction mode)
+PREPARE_STATEMENTS = True
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}  # id(connection) -> time the connection went back to the pool
+_local = threading.local()  # holds the active session (if any) per thread
+
+_standings_cache = OrderedDict()  # tournament ID -> standings list
+_cache_lock = threading.Lock()
+# bumped whenever a tournament's standings change, so that a read which was
+# already running at the time doesn't put stale standings into the cache;
+# the ID 0 stands for "every tournament"
+_generations = {}
+_notify_changes = False
+
+_pairing_states = OrderedDict()  # tournament ID -> PairingState
+_pairing_lock = threading.Lock()
+
+_cursor_names = itertools.count(1)  # for naming server-side cursors
+
+_worker_pool = None  # the process pool pairAll() uses
+
+_journal = None  # the ResultJournal reportMatch() writes to; see useJournal()
+
+# errors that say the database couldn't be reached (or the transaction
+# couldn't finish), rather than that a result is wrong; the journal retries
+# a batch that fails with one of these for as long as it takes
+_TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# the statements run most often, by name: (parameter types, SQL); see
+# _execute(). The names are prefixed so they can't clash with statements
+# prepared by anyone else on the same connection
+_STATEMENTS = {
+    'tournament_standings': (
+        'int',
+        'SELECT player_id, player_name, count_wins, count_matches, omw '
+        'FROM player_standings WHERE tournament_id = $1'),
+    'tournament_swiss_pairings': (
+        'int',
+        'SELECT * FROM swiss_pairings($1)'),
+    'tournament_report_match': (
+        'int, int, int, boolean',
+        'SELECT report_match($1, $2, $3, $4)'),
+    'tournament_report_round': (
+        'int, int[], int[], boolean[]',
+        'SELECT report_round($1, $2, $3, $4)'),
+    'tournament_delete_matches': (
+        'int',
+        'DELETE FROM matches WHERE tournament_id = $1'),
+    'tournament_delete_all_matches': (
+        '',
+        'DELETE FROM matches'),
+    'tournament_delete_rounds': (
+        'int',
+        'DELETE FROM rounds WHERE tournament_id = $1'),
+    'tournament_delete_all_rounds': (
+        '',
+        'DELETE FROM rounds'),
+    'tournament_count_players': (
+        'int',
+        'SELECT COUNT(*) FROM players WHERE tournament_id = $1'),
+    'tournament_count_all_players': (
+        '',
+        'SELECT COUNT(*) FROM players'),
+    'tournament_current_round': (
+        'int',
+        'SELECT COALESCE(MAX(round), 0) FROM rounds WHERE tournament_id = $1'),
+    # what _load_pairing_state() reads
+    'tournament_pairing_counts': (
+        'int',
+        'SELECT (SELECT COUNT(*) FROM players WHERE tournament_id = $1), '
+        '(SELECT COALESCE(MAX(id), 0) FROM players WHERE tournament_id = $1), '
+        '(SELECT COUNT(*) FROM matches WHERE tournament_id = $1)'),
+    'tournament_pairing_players': (
+        'int',
+        'SELECT p.id, r.name FROM players p, registrants r '
+        'WHERE p.tournament_id = $1 AND p.registrant_id = r.id'),
+    'tournament_pairing_matches': (
+        'int, int',
+        'SELECT id, winner, loser, is_tie, is_bye FROM matches '
+        'WHERE tournament_id = $1 AND id > $2 ORDER BY id'),
+    # what _load_pairing_states() reads, for many tournaments at once; the
+    # view is already sorted by tournament, then rank
+    'tournament_pairing_standings': (
+        'int[]',
+        'SELECT tournament_id, player_id, player_name, count_wins, '
+        'count_byes FROM player_standings WHERE tournament_id = ANY ($1)'),
+    'tournament_played_pairs': (
+        'int[]',
+        'SELECT tournament_id, winner, loser FROM matches '
+        'WHERE tournament_id = ANY ($1) AND loser IS NOT NULL'),
+    # what _rank_by_tiebreaks() reads; a loser of 0 is a bye, or a player
+    # who has since left the tournament
+    'tournament_match_rows': (
+        'int',
+        'SELECT winner, COALESCE(loser, 0), is_tie, is_bye FROM matches '
+        'WHERE tournament_id = $1 ORDER BY id'),
+    # what pairAll() and the other round functions read and write
+    'tournament_lock_tournaments': (
+        'int[]',
+        # NO KEY UPDATE leaves matches and players free to reference the rows
+        'SELECT id FROM tournaments WHERE id = ANY ($1) ORDER BY id '
+        'FOR NO KEY UPDATE'),
+    'tournament_open_rounds': (
+        'int[]',
+        '''
+        SELECT tournament_id, player_one_id, player_one_name, player_two_id,
+            player_two_name, reported
+        FROM round_pairings
+        WHERE (tournament_id, round) IN (
+            SELECT tournament_id, MAX(round)
+            FROM rounds
+            WHERE tournament_id = ANY ($1)
+            GROUP BY tournament_id
+        )
+        ORDER BY tournament_id, board
+        '''),
+    # each tournament's new round is numbered one after the last one stored,
+    # and its pairs keep the order they were paired in
+    'tournament_store_pairings': (
+        'int[], int[], int[], int[]',
+        '''
+        WITH new_rounds AS (
+            INSERT INTO rounds (tournament_id, round)
+            SELECT t.id, COALESCE((
+                SELECT MAX(r.round) FROM rounds r WHERE r.tournament_id = t.id
+            ), 0) + 1
+            FROM unnest($1::int[]) AS t (id)
+            RETURNING tournament_id, round
+        ), new_pairings AS (
+            INSERT INTO pairings (tournament_id, round, board, player_one,
+                player_two)
+            SELECT p.tournament_id, n.round,
+                row_number() OVER (PARTITION BY p.tournament_id
+                                   ORDER BY p.pos),
+                p.player_one, p.player_two
+            FROM unnest($2::int[], $3::int[], $4::int[]) WITH ORDINALITY
+                AS p (tournament_id, player_one, player_two, pos)
+            JOIN new_rounds n ON n.tournament_id = p.tournament_id
+        )
+        SELECT tournament_id, round FROM new_rounds
+        '''),
+    'tournament_round_pairings': (
+        'int, int',
+        'SELECT player_one_id, player_one_name, player_two_id, '
+        'player_two_name FROM round_pairings WHERE tournament_id = $1 '
+        'AND round = COALESCE($2, (SELECT MAX(round) FROM rounds '
+        'WHERE tournament_id = $1)) ORDER BY board'),
+}
+
+# where the data is kept: None for the PostgreSQL database, otherwise a
+# storage backend such as memory.MemoryBackend; see useBackend()
+_backend = None
+
+# where timings and counts go (see addMetricsSink()); while this is empty,
+# nothing is measured. It is replaced rather than changed, so it can be read
+# without a lock
+_sinks = ()
+
+
+def addMetricsSink(sink):
+    """Start sending timings and counts to a sink (see metrics.py).
+
+    A sink is any object with timing(name, seconds) and increment(name,
+    amount) methods.
+    """
+    global _sinks
+    _sinks = _sinks + (sink,)
+
+
+def removeMetricsSink(sink):
+    """Stop sending timings and counts to a sink."""
+    global _sinks
+    _sinks = tuple(s for s in _sinks if s is not sink)
+
+
+def _timing(name, seconds):
+    for sink in _sinks:
+        sink.timing(name, seconds)
+
+
+def _increment(name, amount=1):
+    for sink in _sinks:
+        sink.increment(name, amount)
+
+
+def _instrumented(function):
+    """Decorator that times every call of a function, when a sink wants it."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if (not _sinks):
+            return function(*args, **kwargs)
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _timing(name, time.time() - start)
+
+    return wrapper
+
+
+class _InstrumentedConnection(psycopg2.extensions.connection):
+    """A connection that counts itself being opened, and remembers which
+    statements it has prepared (see _execute())."""
+
+    def __init__(self, *args, **kwargs):
+        super(_InstrumentedConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+        if (_sinks):
+            _increment('connections_opened')
+
+
+class _InstrumentedCursor(psycopg2.extensions.cursor):
+    """A cursor that times its statements and counts the rows it reads;
+    only handed out while there are sinks (see Session.cursor())."""
+
+    def execute(self, sql, args=None):
+        start = time.time()
+        try:
+            return super(_InstrumentedCursor, self).execute(sql, args)
+        finally:
+            _timing('execute', time.time() - start)
+            _increment('statements')
+
+    def _fetched(self, start, rows):
+        _timing('fetch', time.time() - start)
+        _increment('rows_fetched', rows)
+
+    def fetchone(self):
+        start = time.time()
+        row = super(_InstrumentedCursor, self).fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.time()
+        if (size is None):
+            rows = super(_InstrumentedCursor, self).fetchmany()
+        else:
+            rows = super(_InstrumentedCursor, self).fetchmany(size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.time()
+        rows = super(_InstrumentedCursor, self).fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+def configure(dsn=None, min_connections=None, max_connections=None,
+              health_check_interval=None):
+    """Change the database connection settings.
+
+    Any existing connection pool is closed; a new one is created with the
+    new settings the next time a connection is needed.
+
+    Args:
+      dsn: the libpq connection string (e.g. "dbname=tournament host=db")
+      min_connections: number of connections the pool keeps open
+      max_connections: most connections the pool will open at once
+      health_check_interval: seconds a connection may sit idle before it is
+                    tested again on checkout; 0 tests it every time
+    """
+    global DSN, MIN_CONNECTIONS, MAX_CONNECTIONS, HEALTH_CHECK_INTERVAL
+
+    if (dsn is not None):
+        DSN = dsn
+    if (min_connections is not None):
+        MIN_CONNECTIONS = min_connections
+    if (max_connections is not None):
+        MAX_CONNECTIONS = max_connections
+    if (health_check_interval is not None):
+        HEALTH_CHECK_INTERVAL = health_check_interval
+
+    closePool()
+
+
+def useBackend(backend='postgres'):
+    """Choose where the tournament functions keep their data.
+
+    Every function in this module works the same way on each backend, so
+    code (e.g.: the test suite or a simulation) can be pointed at memory to
+    run without a database, then back at PostgreSQL with one call.
+
+    Args:
+      backend: 'postgres' (the default) for the database set up with
+                 configure(), 'memory' for a new, empty in-memory store, or
+                 a backend object (e.g.: a memory.MemoryBackend kept from
+                 earlier, to carry on where it left off)
+
+    Returns:
+      The backend now in use (None for PostgreSQL)
+    """
+    global _backend
+
+    if (backend == 'postgres'):
+        backend = None
+    elif (backend == 'memory'):
+        backend = MemoryBackend()
+
+    _backend = backend
+    # standings (and pairing states) kept from the old backend don't belong
+    # to the new one
+    invalidateStandings()
+    with _pairing_lock:
+        _pairing_states.clear()
+
+    return _backend
+
+
+def useJournal(path, **options):
+    """Write results to a local journal before they reach the database.
+
+    While a journal is in use, reportMatch() (outside of a session) checks
+    its arguments, appends the result to the journal file and returns; a
+    background thread records the results in the database in batches,
+    retrying until the database takes them. Results still in the file when
+    the program stops are recorded the next time the same journal is used.
+    A result whose players (or bye) are already recorded or waiting is
+    skipped, so results can safely be reported twice.
+
+    Results the database rejects (e.g.: rematches, or IDs too big for it)
+    can't be reported back to reportMatch()'s caller; they are logged and
+    kept in the journal's rejected list, and passed to on_reject if that is
+    given. So is a result that keeps failing for any other reason than the
+    database being unavailable, so that it can't hold up the rest.
+
+    Args:
+      path: the journal file, or None to stop using a journal
+      options: passed on to journal.ResultJournal (e.g.: batch_size,
+                 interval, sync, on_reject); batch_size defaults to
+                 BATCH_SIZE
+
+    Returns:
+      The journal.ResultJournal now in use, or None
+    """
+    global _journal
+
+    if (_journal is not None):
+        _journal.close()
+        _journal = None
+
+    if (path is not None):
+        options.setdefault('batch_size', BATCH_SIZE)
+        options.setdefault('transient', _TRANSIENT_ERRORS)
+        _journal = ResultJournal(path, _record_results, **options)
+
+    return _journal
+
+
+def flushJournal(timeout=None):
+    """Wait until every result in the journal (if one is in use) is in the
+    database; returns False if the timeout (in seconds) ran out first."""
+    if (_journal is None):
+        return True
+    return _journal.flush(timeout)
+
+
+def closePool():
+    """Close every connection in the pool (e.g.: when shutting down)."""
+    global _pool
+
+    with _pool_lock:
+        if (_pool is not None):
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
+
+
+def closeWorkerPool():
+    """Stop the worker processes started by pairAll() (if any)."""
+    global _worker_pool
+
+    with _pool_lock:
+        if (_worker_pool is not None):
+            _worker_pool.close()
+            _worker_pool.join()
+        _worker_pool = None
+
+
+def _get_worker_pool():
+    """Returns the pairAll() process pool, starting it on first use."""
+    global _worker_pool
+
+    if (_worker_pool is None):
+        with _pool_lock:
+            if (_worker_pool is None):
+                _worker_pool = _worker_context().Pool(PAIRING_PROCESSES)
+    return _worker_pool
+
+
+def _worker_context():
+    """Returns how to start the pairAll() workers.
+
+    A forked worker would inherit this process's connections and any lock
+    held by its other threads (the journal's, a feed's, a metrics sink's),
+    so workers are started from a fresh interpreter (forkserver, or spawn
+    where there is no forkserver) when Python can. Python 2 can only fork,
+    so pairAll() starts the pool before it checks out a connection.
+    """
+    if (not hasattr(multiprocessing, 'get_context')):
+        return multiprocessing  # Python 2
+    if ('forkserver' in multiprocessing.get_all_start_methods()):
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _get_pool():
+    """Returns the connection pool, creating it on first use."""
+    global _pool
+
+    if (_pool is None):
+        with _pool_lock:
+            if (_pool is None):
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    MIN_CONNECTIONS, MAX_CONNECTIONS, DSN,
+                    connection_factory=_InstrumentedConnection)
+    return _pool
+
+
+def _is_healthy(conn):
+    """Returns True if a pooled connection can still be used."""
+    if (conn.closed):
+        return False
+
+    idle_since = _last_used.get(id(conn))
+    if (idle_since is not None and
+            time.time() - idle_since < HEALTH_CHECK_INTERVAL):
+        # the connection was used recently, so skip the round trip
+        return True
+
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()  # don't leave the ping's transaction open
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    """Takes a working connection out of the pool."""
+    if (not _sinks):
+        return _checkout_healthy()
+
+    start = time.time()
+    try:
+        return _checkout_healthy()
+    finally:
+        _timing('checkout', time.time() - start)
+
+
+def _checkout_healthy():
+    pool = _get_pool()
+
+    # a pool holds at most MAX_CONNECTIONS, so that many tries is enough to
+    # get past every broken connection (e.g.: after a database restart)
+    for attempt in range(MAX_CONNECTIONS + 1):
+        conn = pool.getconn()
+        if (_is_healthy(conn)):
+            return conn
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)  # throw the broken connection away
+
+    raise psycopg2.OperationalError('Could not get a working connection.')
+
+
+def _checkin(conn):
+    """Returns a connection to the pool."""
+    broken = bool(conn.closed)
+    if (broken):
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.time()
+    _get_pool().putconn(conn, close=broken)
 
 
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    The connection does not come from the pool, so the caller is responsible
+    for closing it.
+    """
+    return psycopg2.connect(DSN, connection_factory=_InstrumentedConnection)
+
+
+class Session(object):
+    """A unit of work: one pooled connection and one transaction.
+
+    Every tournament function called inside a session uses the session's
+    connection, and nothing is committed until the session ends. If any of
+    them raises an error, everything done in the session is rolled back.
+
+    Use it through session():
+
+        with session():
+            registerPlayer("Chandra Nalaar", tournament_id)
+            registerPlayer("Markov Chaney", tournament_id)
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.touched = set()  # tournaments changed in this transaction
+
+    def cursor(self, name=None):
+        return _new_cursor(self.conn, name)
+
+    def touch(self, tournament):
+        """Notes that a tournament's standings change in this transaction.
+
+        A tournament of 0 (or None) means every tournament.
+        """
+        self.touched.add(tournament or 0)
+
+    def touches(self, tournament):
+        """Returns True if this transaction changed a tournament."""
+        return 0 in self.touched or tournament in self.touched
+
+    def commit(self):
+        if (self.touched and _notify_changes):
+            # NOTIFY is only delivered when the transaction commits
+            cur = self.conn.cursor()
+            for tournament in self.touched:
+                cur.execute('SELECT pg_notify(%s, %s)',
+                            (STANDINGS_CHANNEL, str(tournament),))
+            cur.close()
+        self.conn.commit()
+        # only drop cached standings once the change is visible to others
+        for tournament in self.touched:
+            invalidateStandings(tournament)
+        self.touched.clear()
+
+    def rollback(self):
+        self.conn.rollback()
+        self.touched.clear()
+
+
+@contextmanager
+def session():
+    """Run several tournament functions on one connection and transaction.
+
+    Sessions may be nested; the inner ones just join the outer session, so
+    only the outermost one commits.
+    """
+    current = getattr(_local, 'session', None)
+    if (current is not None):
+        yield current
+        return
+
+    conn = None
+    if (_backend is not None):
+        # a storage backend keeps its own transactions
+        current = _backend.begin()
+    else:
+        conn = _checkout()
+        current = Session(conn)
+    _local.session = current
+    try:
+        yield current
+        current.commit()  # the unit of work succeeded, so save all of it
+    except:
+        if (conn is None or not conn.closed):
+            current.rollback()
+        raise  # pass any error back to the calling function as is
+    finally:
+        _local.session = None
+        if (conn is not None):
+            _checkin(conn)
+
+
+def _new_cursor(conn, name=None):
+    """Returns a cursor on a connection; a named cursor is a server-side one,
+    which only sends rows as they are fetched."""
+    if (_sinks):
+        return conn.cursor(name, cursor_factory=_InstrumentedCursor)
+    return conn.cursor(name)
 
 
 @contextmanager
@@ -18,22 +657,365 @@ def get_cursor():
     Helper function to cut down on unnecessary code when creating and closing
     cusrors and database connections. Thanks to the Udacity project review
     team for the suggestion!
+
+    Connections come from the pool. If a session is active, its connection
+    is used and the commit is left to the session.
     """
-    conn = connect()
-    cur = conn.cursor()
-    try:
-        # the yield function here will provide the cursor if there are no
-        # errors, so that it can be "return"ed to the calling function
-        yield cur
-        conn.commit()  # commit any database changes, such as an INSERT
+    with session() as current:
+        cur = current.cursor()
+        try:
+            # the yield function here will provide the cursor if there are no
+            # errors, so that it can be "return"ed to the calling function
+            yield cur
+        finally:
+            cur.close()
+
+
+def _execute(cursor, name, data=()):
+    """Runs one of the statements in _STATEMENTS on a cursor.
+
+    The first time a connection runs a statement, it is prepared (PREPARE)
+    on the server, so its SQL is parsed and planned once per connection
+    rather than on every call; from then on it is run by name (EXECUTE).
+    Server-side cursors can't run EXECUTE; see _unprepared().
+
+    Args:
+      cursor: a client-side cursor
+      name: the name of the statement
+      data: the values of its parameters
+    """
+    if (not PREPARE_STATEMENTS):
+        cursor.execute(*_unprepared(name, data))
         return
-    except:
-        raise  # pass any error back to the calling function as is
+
+    types, sql = _STATEMENTS[name]
+    prepared = cursor.connection.prepared
+    if (name not in prepared):
+        # a prepared statement outlives the transaction it was prepared in
+        cursor.execute('PREPARE %s%s AS %s' % (
+            name, ' (%s)' % types if types else '', sql))
+        prepared.add(name)
+
+    if (data):
+        # cast like the parameters, so that e.g.: a list of None is an int[]
+        placeholders = ', '.join('%%s::%s' % t for t in types.split(', '))
+        cursor.execute('EXECUTE %s (%s)' % (name, placeholders),
+                       data)  # prevents SQL injection
+    else:
+        cursor.execute('EXECUTE %s' % name)
+
+
+def _unprepared(name, data=()):
+    """Returns a statement from _STATEMENTS as the SQL and parameters to
+    pass to cursor.execute(), for running it without preparing it."""
+    types, sql = _STATEMENTS[name]
+    types = types.split(', ')
+    # $1 becomes %(1)s::type, and so on
+    sql = re.sub(r'\$(\d+)',
+                 lambda m: '%%(%s)s::%s' % (m.group(1),
+                                            types[int(m.group(1)) - 1]),
+                 sql)
+    return sql, dict((str(i + 1), value) for (i, value) in enumerate(data))
+
+
+@contextmanager
+def _streaming_cursor():
+    """Like get_cursor(), but gives a server-side cursor.
+
+    Outside a session, the cursor gets a pooled connection of its own
+    rather than starting a session, since a generator reading from it may
+    be left half finished while the caller does other work.
+    """
+    name = 'tournament_stream_%s' % next(_cursor_names)
+    current = getattr(_local, 'session', None)
+    if (current is not None):
+        cur = current.cursor(name)
+        try:
+            yield cur
+        finally:
+            cur.close()
+        return
+
+    conn = _checkout()
+    try:
+        cur = _new_cursor(conn, name)
+        try:
+            yield cur
+        finally:
+            if (not conn.closed):
+                cur.close()
+                conn.rollback()  # nothing was changed
     finally:
-        cur.close()
-        conn.close()
+        _checkin(conn)
+
+
+def _stream_rows(sql, data, fetch_size=None):
+    """Runs a query and yields its rows, fetch_size (or FETCH_SIZE) at a
+    time."""
+    with _streaming_cursor() as cursor:
+        cursor.execute(sql, data)
+        while True:
+            rows = cursor.fetchmany(fetch_size or FETCH_SIZE)
+            if (not rows):
+                break
+            for row in rows:
+                yield row
+
+
+def configureStandingsCache(max_size=None, notify=None):
+    """Change the settings of the standings cache used by playerStandings().
+
+    Args:
+      max_size: the most tournaments to keep standings for; 0 turns the
+                  cache off
+      notify: if True, every transaction that changes a tournament also
+                sends a NOTIFY on STANDINGS_CHANNEL when it commits, so that
+                processes running listenForStandingsChanges() drop their
+                cached copy; the database's triggers already do this for
+                changes to matches and players, so this only adds the
+                changes they can't see (e.g.: deleting a whole tournament)
+    """
+    global STANDINGS_CACHE_SIZE, _notify_changes
+
+    if (max_size is not None):
+        STANDINGS_CACHE_SIZE = max_size
+    if (notify is not None):
+        _notify_changes = notify
+
+    invalidateStandings()
+
+
+def invalidateStandings(tournament=0):
+    """Drops cached standings.
+
+    Args:
+      tournament: the ID of the tournament whose standings changed; if 0,
+                    drop the standings of every tournament
+    """
+    with _cache_lock:
+        _generations[tournament] = _generations.get(tournament, 0) + 1
+        if (tournament):
+            _standings_cache.pop(tournament, None)
+        else:
+            _standings_cache.clear()
+
+
+def _cache_generation(tournament):
+    """Returns a token that changes whenever a tournament is invalidated."""
+    with _cache_lock:
+        return (_generations.get(0, 0), _generations.get(tournament, 0))
+
+
+def _cache_get(tournament):
+    """Returns cached standings for a tournament, or None."""
+    with _cache_lock:
+        standings = _standings_cache.pop(tournament, None)
+        if (standings is not None):
+            # move it to the most recently used end
+            _standings_cache[tournament] = standings
+        return standings
+
+
+def _cache_put(tournament, standings, generation):
+    """Caches standings, unless they changed since they were read."""
+    with _cache_lock:
+        current = (_generations.get(0, 0), _generations.get(tournament, 0))
+        if (current != generation or STANDINGS_CACHE_SIZE <= 0):
+            return
+        _standings_cache[tournament] = standings
+        while (len(_standings_cache) > STANDINGS_CACHE_SIZE):
+            _standings_cache.popitem(last=False)  # least recently used
+
+
+def _touch(tournament):
+    """Marks a tournament's standings as changed by the current session.
+
+    Must be called inside a get_cursor() block.
+    """
+    _local.session.touch(tournament)
+
+
+class StandingsListener(object):
+    """The thread started by listenForStandingsChanges().
+
+    Like the threading.Event it stands in for, set() stops it; it also wakes
+    the thread, so it stops straight away.
+    """
+
+    def __init__(self, callback, poll_interval):
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        # written to by set(), to wake the thread from select()
+        self.wake_read, self.wake_write = os.pipe()
+        self.thread = threading.Thread(target=self._run,
+                                       name='standings-listener')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def set(self):
+        with self.lock:
+            if (not self.stopped.is_set()):
+                self.stopped.set()
+                os.write(self.wake_write, b'x')
+
+    def is_set(self):
+        return self.stopped.is_set()
+
+    def join(self, timeout=None):
+        """Waits for the thread to stop (see set())."""
+        self.thread.join(timeout)
+
+    def _run(self):
+        try:
+            while (not self.stopped.is_set()):
+                try:
+                    self._listen()
+                except psycopg2.Error:
+                    logger.exception('lost the standings notifications; '
+                                     'reconnecting in %s s',
+                                     self.poll_interval)
+                    # anything could have changed while no one was listening
+                    self.callback(0)
+                    self.stopped.wait(self.poll_interval)
+        finally:
+            with self.lock:
+                self.stopped.set()
+                os.close(self.wake_read)
+                os.close(self.wake_write)
+
+    def _listen(self):
+        conn = connect()
+        try:
+            conn.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute('LISTEN ' + STANDINGS_CHANNEL)
+            while (not self.stopped.is_set()):
+                ready = select.select([conn, self.wake_read], [], [],
+                                      self.poll_interval)[0]
+                if (conn in ready):
+                    conn.poll()
+                    while (conn.notifies):
+                        notify = conn.notifies.pop(0)
+                        self.callback(int(notify.payload))
+        finally:
+            conn.close()
+
+
+def listenForStandingsChanges(poll_interval=5, callback=None):
+    """Keeps this process's standings cache in step with other processes.
+
+    Starts a background thread that LISTENs on STANDINGS_CHANNEL with its own
+    connection and drops cached standings whenever another process changes
+    them (see notify_standings_changed() in tournament.sql, and
+    configureStandingsCache(notify=True)). If the connection is lost, it
+    reconnects, and treats every tournament as changed.
+
+    Args:
+      poll_interval: how many seconds to wait for a notification before
+                       checking whether to stop, and before reconnecting
+      callback: a function to call (from the thread) with the ID of each
+                  tournament whose standings changed (0 for every
+                  tournament) instead of dropping cached standings
+
+    Returns:
+      A StandingsListener; call its set() to stop listening
+    """
+    if (callback is None):
+        callback = invalidateStandings
+    return StandingsListener(callback, poll_interval)
+
+
+def _check_tournament(tournament):
+    """Returns an error message if a tournament ID is invalid, else None."""
+    if (type(tournament) is not int):
+        return 'Tournament is invalid (must be a number).'
+
+
+def _check_registrant(registrant, tournament):
+    """Returns an error message if a registrant or tournament ID is invalid,
+    else None."""
+    if (type(registrant) is not int or type(tournament) is not int):
+        return 'Either the registrant or tournament you entered is invalid.'
+
+
+def _check_registrants(registrants, tournament):
+    """Returns an error message if any of a list of registrant IDs, or the
+    tournament ID, is invalid, else None."""
+    if (type(tournament) is not int):
+        return 'Tournament is invalid (must be a number).'
+    if ([r for r in registrants if type(r) is not int]):
+        return 'Every registrant must be a number.'
+
+
+def _check_match(winner, loser, tournament, is_tie):
+    """Returns an error message if a match result is invalid, else None."""
+    if (type(winner) is not int):
+        return 'Winner is invalid (must be a number).'
+    elif (type(loser) is not int):
+        return 'Loser is invalid (must be a number).'
+    elif (type(tournament) is not int):
+        return 'Tournament is invalid (must be a number).'
+    elif (type(is_tie) is not bool):
+        err_msg = 'The entry for whether this match was a tie is invalid '
+        err_msg += '(must be "True" or "False" (or blank)).'
+        return err_msg
+
+
+def _round_arrays(tournament, results):
+    """Checks a round of results and splits it into parallel lists.
+
+    Returns:
+      A tuple of (error, winners, losers, ties); error is an error message
+        if any result is invalid, else None; a bye's loser is None
+    """
+    winners = []
+    losers = []
+    ties = []
+
+    for result in results:
+        if (len(result) == 2):
+            winner, loser = result
+            is_tie = False
+        else:
+            winner, loser, is_tie = result
+
+        err_msg = _check_match(winner, loser, tournament, is_tie)
+        if (err_msg):
+            return err_msg, None, None, None
+
+        winners.append(winner)
+        # the database records a bye as a match with no loser
+        losers.append(loser if loser != 0 else None)
+        ties.append(is_tie)
+
+    return None, winners, losers, ties
+
+
+def _check_tiebreaks(tiebreaks):
+    """Returns an error message if a tiebreak order is invalid, else None."""
+    names = ('score', 'omw', 'omw_pct', 'sonneborn_berger', 'buchholz',
+             'cumulative')  # the same as tiebreak.TIEBREAKS
+    if ([name for name in tiebreaks if name not in names]):
+        err_msg = 'Tiebreak order is invalid (must be a list of: '
+        err_msg += ', '.join(names) + ').'
+        return err_msg
 
 
+def _check_pairing_mode(tournament, mode):
+    """Returns an error message if swissPairings() arguments are invalid,
+    else None."""
+    if (type(tournament) is not int):
+        return 'Tournament is invalid (must be a number).'
+    elif (mode not in ('backtrack', 'matching', 'database')):
+        err_msg = 'Pairing mode is invalid (must be "backtrack", "matching" '
+        err_msg += 'or "database").'
+        return err_msg
+
+
+@_instrumented
 def deleteMatches(tournament=0):
     """Remove all the match records from the database.
 
@@ -41,41 +1023,76 @@ def deleteMatches(tournament=0):
       tournament: the ID of the tournament for which to delete matches; if 0,
                     delete all matches in all tournaments
     """
-    sql = 'DELETE FROM matches'
-    data = ('',)
+    # the rounds of pairings handed out for the deleted results go with them
+    statements = ('tournament_delete_all_matches',
+                  'tournament_delete_all_rounds')
+    data = ()
 
     if (type(tournament) is int and tournament != 0):
         # if function is called with a tournament specified, only delete the
         # matches in that tournament
-        sql += ' WHERE tournament_id = %s'
-        data = (tournament,)  # prevents SQL injection
+        statements = ('tournament_delete_matches', 'tournament_delete_rounds')
+        data = (tournament,)
+    else:
+        tournament = 0
+
+    if (_backend is not None):
+        return _backend.deleteMatches(tournament)
 
     with get_cursor() as cursor:
-        cursor.execute(sql, data)
+        for name in statements:
+            _execute(cursor, name, data)
+        _touch(tournament)
 
 
+@_instrumented
 def deletePlayers():
     """Remove all the player records from the database.
 
     This will also delete the player-to-tournament associations for the
     deleted players.
     """
+    if (_backend is not None):
+        return _backend.deletePlayers()
+
     sql = 'DELETE FROM registrants'
     with get_cursor() as cursor:
         cursor.execute(sql)
+        _touch(0)
 
 
+@_instrumented
 def createTournament(t_name):
     """Adds a tournament to the database.
 
-    The database assigns a unique serial id number for the tournament.
+    The database assigns a unique serial id number for the tournament, and
+    the tournament gets its own partitions of the players and matches
+    tables (see create_tournament_partitions() in tournament.sql).
+
+    Attaching the partitions holds up writes to every tournament until the
+    transaction that attached them ends. Outside a session they are
+    attached in a short transaction of their own; inside one, they are
+    attached in the session's transaction (which may already hold locks
+    that a transaction of their own would wait for), so other tournaments
+    wait until the session ends.
 
     Args:
       name: the name of the tournament (need not be unique).
     """
+    if (_backend is not None):
+        return _backend.createTournament(t_name)
+
+    if (getattr(_local, 'session', None) is None):
+        tournament_id = _create_partitions()
+        with get_cursor() as cursor:
+            cursor.execute('INSERT INTO tournaments (id, name) '
+                           'VALUES (%s, %s)', (tournament_id, t_name,))
+        return tournament_id
+
     # use "RETURNING id" to make sure to return the tournament ID so
     # we can pass it back to the calling function (i.e.: in case we
-    # want to assign a player to that tournament)
+    # want to assign a player to that tournament); the partitions are
+    # created as the row is inserted
     sql = 'INSERT INTO tournaments (name) VALUES (%s) RETURNING id'
     data = (t_name,)  # prevents SQL injection
 
@@ -86,26 +1103,117 @@ def createTournament(t_name):
     return tournament_id
 
 
+def _create_partitions(tournament=None):
+    """Creates a tournament's partitions in a transaction of their own, on
+    a pooled connection, before the tournament itself is inserted.
+
+    Args:
+      tournament: the ID of the tournament; if None, a new ID is taken from
+                    the tournaments table's sequence
+
+    Returns:
+      The ID of the tournament
+    """
+    conn = _checkout()
+    try:
+        cur = conn.cursor()
+        if (tournament is None):
+            cur.execute("SELECT nextval('tournaments_id_seq')")
+            tournament = cur.fetchone()[0]
+        cur.execute('SELECT create_tournament_partitions(%s)',
+                    (tournament,))
+        cur.close()
+        conn.commit()
+    except:
+        if (not conn.closed):
+            conn.rollback()
+        raise
+    finally:
+        _checkin(conn)
+
+    return tournament
+
+
+@_instrumented
 def deleteTournament(tournament=0):
     """Remove one or all tournaments from the database. This will remove all
         matches associated with the deleted tournament(s) as well.
 
+    A tournament's players and matches are removed by dropping its
+    partitions, which is much quicker than deleting them row by row.
+    Outside a session the partitions are detached concurrently, which
+    leaves other tournaments' queries running, in three steps of their own:
+    if one fails, calling this again finishes the job.
+
     Args:
       tournament: the ID of the tournament to be deleted; if 0, delete all
     """
+    partitions_sql = 'SELECT drop_tournament_partitions(id) FROM tournaments'
+    clear_sql = 'SELECT c.* FROM tournaments t, '
+    clear_sql += 'clear_tournament_partitions(t.id) c'
     sql = 'DELETE FROM tournaments'
     data = ('',)
 
     if (type(tournament) is int and tournament != 0):
         # if function is called with a tournament specified, only delete
         # that tournament; otherwise, delete all tournaments
+        partitions_sql += ' WHERE id = %s'
+        clear_sql += ' WHERE t.id = %s'
         sql += ' WHERE id = %s'
         data = (tournament,)  # prevents SQL injection
+    else:
+        tournament = 0
+
+    if (_backend is not None):
+        return _backend.deleteTournament(tournament)
+
+    if (getattr(_local, 'session', None) is not None):
+        # a concurrent detach can't run inside the session's transaction
+        with get_cursor() as cursor:
+            cursor.execute(partitions_sql, data)
+            cursor.execute(sql, data)
+            _touch(tournament)
+        return
 
+    with get_cursor() as cursor:
+        cursor.execute(clear_sql, data)
+        partitions = cursor.fetchall()
+    _detach_partitions(partitions)
     with get_cursor() as cursor:
         cursor.execute(sql, data)
+        _touch(tournament)
+
+
+def _detach_partitions(partitions):
+    """Detaches and drops partitions with DETACH PARTITION ... CONCURRENTLY,
+    whose locks don't hold up queries on the rest of the table, on a pooled
+    connection outside any transaction.
+
+    Args:
+      partitions: rows of clear_tournament_partitions() (see tournament.sql)
+    """
+    if (not partitions):
+        return
+
+    conn = _checkout()
+    try:
+        conn.autocommit = True  # CONCURRENTLY can't run in a transaction
+        cur = conn.cursor()
+        for (parent, partition, detach_pending) in partitions:
+            # a concurrent detach that was interrupted must be finished
+            how = 'FINALIZE' if detach_pending else 'CONCURRENTLY'
+            # the names come from the database, already quoted
+            cur.execute('ALTER TABLE %s DETACH PARTITION %s %s'
+                        % (parent, partition, how))
+            cur.execute('DROP TABLE %s' % partition)
+        cur.close()
+    finally:
+        if (not conn.closed):
+            conn.autocommit = False
+        _checkin(conn)
 
 
+@_instrumented
 def countPlayers(tournament=None):
     """Returns the number of players currently registered.
 
@@ -115,24 +1223,27 @@ def countPlayers(tournament=None):
     Args:
       tournament: ID of the tournament for which to count players (optional)
     """
-    data = ('',)
+    if (_backend is not None):
+        return _backend.countPlayers(tournament)
 
     if (tournament is not None):
         # if function is called with a tournament specified, only count the
         # players in that tournament
-        sql = 'SELECT COUNT(*) FROM players WHERE tournament_id = %s'
-        data = (tournament,)  # prevents SQL injection
+        name = 'tournament_count_players'
+        data = (tournament,)
     else:
         # otherwise, return a count of all players in all tournaments
-        sql = 'SELECT COUNT(*) FROM players'
+        name = 'tournament_count_all_players'
+        data = ()
 
     with get_cursor() as cursor:
-        cursor.execute(sql, data)
+        _execute(cursor, name, data)
         player_count = cursor.fetchone()[0]
 
     return player_count
 
 
+@_instrumented
 def registerPlayer(p_name, tournament=None):
     """Adds a player to the tournament database.
 
@@ -146,27 +1257,104 @@ def registerPlayer(p_name, tournament=None):
       name: the player's full name (need not be unique).
       tournament: the ID of the tournament to register the player in (optional)
     """
+    if (_backend is not None):
+        return _backend.registerPlayer(p_name, tournament)
+
     # use "RETURNING" to make sure to return the registrant ID so
     # we can pass it back to the calling function (i.e.: in case we
     # want to assign that registrant to a tournament)
     sql = 'INSERT INTO registrants (name) VALUES (%s) RETURNING *'
     data = (p_name,)  # prevents SQL injection
 
+    # both INSERTs share one connection and one transaction, so a failure
+    # adding the player to the tournament won't leave a stray registrant
     with get_cursor() as cursor:
         cursor.execute(sql, data)
         # put the new registrant data into new_player
         new_player = cursor.fetchone()[0]
 
-    if (tournament and type(tournament) is int):
-        # if tournament is specified, user wants this registrant to be added
-        # as a player to a tournament; so, do that
-        sql = 'INSERT INTO players (tournament_id, registrant_id) VALUES '
-        sql += '(%s, %s)'
-        data = (tournament, new_player,)  # prevents SQL injection
-        with get_cursor() as cursor:
+        if (tournament and type(tournament) is int):
+            # if tournament is specified, user wants this registrant to be
+            # added as a player to a tournament; so, do that
+            sql = 'INSERT INTO players (tournament_id, registrant_id) VALUES '
+            sql += '(%s, %s)'
+            data = (tournament, new_player,)  # prevents SQL injection
             cursor.execute(sql, data)
+            _touch(tournament)
+
+
+def _batches(items):
+    """Splits any iterable into lists of at most BATCH_SIZE items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if (len(batch) == BATCH_SIZE):
+            yield batch
+            batch = []
+    if (batch):
+        yield batch
+
+
+@_instrumented
+def registerPlayers(p_names, tournament=None):
+    """Adds many players to the tournament database at once.
+
+    The names are sent to the database in batches, each with a single
+    statement, and the whole import happens in one transaction: either every
+    player is added or none are.
+
+    Args:
+      p_names: any iterable of player names (e.g.: a column of a CSV file)
+      tournament: the ID of the tournament to register the players in
+                    (optional)
 
+    Returns:
+      A list of the new IDs in the same order as the names: player IDs if a
+      tournament was given, otherwise registrant IDs
+    """
+    if (_backend is not None):
+        return _backend.registerPlayers(p_names, tournament)
+
+    # the names are unnested in their original order, and serial IDs are
+    # handed out in the order rows are inserted; so sorting the returned IDs
+    # puts them back in the order of the names
+    registrants_sql = '''
+        INSERT INTO registrants (name)
+        SELECT name FROM unnest(%s::text[]) WITH ORDINALITY AS n (name, pos)
+        ORDER BY pos
+        RETURNING id
+    '''
+    players_sql = '''
+        WITH new_registrants AS (
+            INSERT INTO registrants (name)
+            SELECT name
+            FROM unnest(%s::text[]) WITH ORDINALITY AS n (name, pos)
+            ORDER BY pos
+            RETURNING id
+        )
+        INSERT INTO players (tournament_id, registrant_id)
+        SELECT %s, id FROM new_registrants ORDER BY id
+        RETURNING id
+    '''
+    new_ids = []
 
+    with get_cursor() as cursor:
+        for batch in _batches(p_names):
+            if (tournament and type(tournament) is int):
+                # add the registrants and their tournament entries in the
+                # same statement
+                data = (batch, tournament,)  # prevents SQL injection
+                cursor.execute(players_sql, data)
+                _touch(tournament)
+            else:
+                data = (batch,)  # prevents SQL injection
+                cursor.execute(registrants_sql, data)
+            new_ids.extend(sorted(row[0] for row in cursor.fetchall()))
+
+    return new_ids
+
+
+@_instrumented
 def assignPlayer(registrant, tournament):
     """Assigns a registrant to a tournament
 
@@ -178,17 +1366,64 @@ def assignPlayer(registrant, tournament):
       tournament: ID of the tournament
     """
     # check function inputs to make sure they're of the right data type
-    if (type(registrant) is not int or type(tournament) is not int):
-        return '''
-        Either the registrant or the tournament you entered is invalid.
-        '''
+    err_msg = _check_registrant(registrant, tournament)
+    if (err_msg):
+        return err_msg
+
+    if (_backend is not None):
+        return _backend.assignPlayer(registrant, tournament)
 
     sql = 'INSERT INTO players (tournament_id, registrant_id) VALUES (%s, %s)'
     data = (tournament, registrant,)  # prevents SQL injection
     with get_cursor() as cursor:
         cursor.execute(sql, data)
+        _touch(tournament)
+
+
+@_instrumented
+def assignPlayers(registrants, tournament):
+    """Assigns many existing registrants to a tournament at once.
+
+    As with registerPlayers(), the whole batch happens in one transaction.
+
+    Args:
+      registrants: any iterable of registrant IDs
+      tournament: ID of the tournament
+
+    Returns:
+      A list of the new player IDs in the same order as the registrants, or
+      an error message (and no one assigned) if any registrant ID is invalid
+    """
+    # check function input to make sure it's of the right data type, before
+    # anything is inserted
+    registrants = list(registrants)
+    err_msg = _check_registrants(registrants, tournament)
+    if (err_msg):
+        return err_msg
+
+    if (_backend is not None):
+        return _backend.assignPlayers(registrants, tournament)
+
+    sql = '''
+        INSERT INTO players (tournament_id, registrant_id)
+        SELECT %s, registrant_id
+        FROM unnest(%s::int[]) WITH ORDINALITY AS r (registrant_id, pos)
+        ORDER BY pos
+        RETURNING id
+    '''
+    new_ids = []
+
+    with get_cursor() as cursor:
+        for batch in _batches(registrants):
+            data = (tournament, batch,)  # prevents SQL injection
+            cursor.execute(sql, data)
+            new_ids.extend(sorted(row[0] for row in cursor.fetchall()))
+        _touch(tournament)
+
+    return new_ids
 
 
+@_instrumented
 def unAssignPlayer(registrant, tournament):
     """Removes a registrant from a tournament
 
@@ -197,19 +1432,25 @@ def unAssignPlayer(registrant, tournament):
       tournament: ID of the tournament
     """
     # check function inputs to make sure they're of the right data type
-    if (type(registrant) is not int or type(tournament) is not int):
-        return 'Either the registrant or tournament you entered is invalid.'
+    err_msg = _check_registrant(registrant, tournament)
+    if (err_msg):
+        return err_msg
+
+    if (_backend is not None):
+        return _backend.unAssignPlayer(registrant, tournament)
 
     # note that registrant is not deleted, so can be assigned to other
     # tournaments
-    sql = 'DELETE FROM players WHERE tournament_id = %s AND player_id = %s'
+    sql = 'DELETE FROM players WHERE tournament_id = %s AND registrant_id = %s'
     data = (tournament, registrant,)  # prevents SQL injection
 
     with get_cursor() as cursor:
         cursor.execute(sql, data)
+        _touch(tournament)
 
 
-def playerStandings(tournament):
+@_instrumented
+def playerStandings(tournament, tiebreaks=None, cached=True):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place,
@@ -217,6 +1458,10 @@ def playerStandings(tournament):
 
     Args:
       tournament: the ID of the tournament for which to display standings
+      tiebreaks: how to order players with the same number of wins, as a
+                   list of tiebreak names (see TIEBREAK_ORDER, the default)
+      cached: if False, the standings are always read from the database
+                (and the standings cache is left as it is)
 
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches, omw):
@@ -227,27 +1472,115 @@ def playerStandings(tournament):
         omw: the number of wins of all the player's previous opponents
     """
     # check function input to make sure it's of the right data type
-    if (type(tournament) is not int):
-        return 'Tournament is invalid (must be a number).'
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
 
-    # execute the view player_standings to generate the standings list
-    sql = 'SELECT player_id, player_name, count_wins, count_matches, omw FROM '
-    sql += 'player_standings WHERE tournament_id = %s'
-    data = (tournament,)  # prevents SQL injection
+    if (tiebreaks is None):
+        tiebreaks = TIEBREAK_ORDER
+    err_msg = _check_tiebreaks(tiebreaks)
+    if (err_msg):
+        return err_msg
 
-    with get_cursor() as cursor:
-        cursor.execute(sql, data)
-        players = cursor.fetchall()
+    if (tuple(tiebreaks) != ('omw',)):
+        return _rank_by_tiebreaks(tournament, tiebreaks)
 
-    player_list = []
+    if (_backend is not None):
+        # nothing to gain from caching standings that are already in memory
+        return _backend.playerStandings(tournament)
+
+    # standings read outside a transaction that has changed them can come
+    # from (and go into) the cache; the functions that change results drop
+    # the cached copy
+    current = getattr(_local, 'session', None)
+    use_cache = cached and (current is None or
+                            not current.touches(tournament))
+
+    if (use_cache):
+        player_list = _cache_get(tournament)
+        if (player_list is not None):
+            return list(player_list)  # a copy, so the cache can't be changed
+        generation = _cache_generation(tournament)
+
+    # the view reads the standings table, which the database keeps up to date
+    # as matches are reported, through an index already sorted by rank
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_standings', (tournament,))
+        player_list = cursor.fetchall()
 
-    # build the list of tuples to pass back to the calling function
-    for player in players:
-        player_list.append(player)
+    if (use_cache):
+        _cache_put(tournament, list(player_list), generation)
 
     return player_list
 
 
+@_instrumented
+def iterStandings(tournament, fetch_size=None):
+    """Returns the standings like playerStandings(), but as an iterator that
+    reads them from the database a few rows at a time.
+
+    Use it to send a large tournament's standings somewhere (e.g.: a file)
+    without holding them all in memory.
+
+    Args:
+      tournament: the ID of the tournament for which to display standings
+      fetch_size: how many rows to read at a time (default FETCH_SIZE)
+
+    Returns:
+      An iterator of (id, name, wins, matches, omw) tuples, as in
+        playerStandings()
+    """
+    # check function input to make sure it's of the right data type
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+
+    if (_backend is not None):
+        return iter(_backend.playerStandings(tournament))
+
+    # cached standings are already in memory
+    current = getattr(_local, 'session', None)
+    if (current is None or not current.touches(tournament)):
+        player_list = _cache_get(tournament)
+        if (player_list is not None):
+            return iter(list(player_list))
+
+    return _stream_standings(tournament, fetch_size)
+
+
+def _stream_standings(tournament, fetch_size=None):
+    """Yields the rows of the player_standings view for a tournament."""
+    sql, data = _unprepared('tournament_standings', (tournament,))
+    return _stream_rows(sql, data, fetch_size)
+
+
+def _rank_by_tiebreaks(tournament, tiebreaks):
+    """Returns playerStandings() re-sorted by the given tiebreaks."""
+    import tiebreak  # needs NumPy, so only imported when it is used
+
+    # read the standings and the matches from the same transaction
+    with session():
+        standings = playerStandings(tournament, ('omw',))
+        matches = _load_match_rows(tournament)
+
+    positions, scores = tiebreak.rankPlayers([row[0] for row in standings],
+                                             matches, tiebreaks)
+    return [standings[i] for i in positions]
+
+
+def _load_match_rows(tournament):
+    """Returns a tournament's matches as (winner, loser, is_tie, is_bye)
+    rows in the order they were reported; a loser of 0 is a bye (or a
+    player who has since left the tournament)."""
+    if (_backend is not None):
+        return _backend.matchRows(tournament)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_match_rows', (tournament,))
+        return cursor.fetchall()
+
+
+@_instrumented
 def reportMatch(winner, loser, tournament, is_tie=False):
     """Records the outcome of a single match between two players.
 
@@ -260,6 +1593,12 @@ def reportMatch(winner, loser, tournament, is_tie=False):
     receive a bye more than once in a tournament. The system prevents that
     from happening.
 
+    Once rounds of pairings are stored for the tournament (see
+    startRound()), only a pair (or bye) of the latest round can be reported.
+
+    If a journal is in use (see useJournal()), the result is only written
+    to the journal, and recorded in the database soon after.
+
     Args:
       winner: the id number of the tournament_player who won
       loser: the id number of the tournament_player who lost
@@ -267,36 +1606,147 @@ def reportMatch(winner, loser, tournament, is_tie=False):
       is_tie: if the match results in a tie, this value is True
     """
     # check function inputs to make sure they're of the right data type
-    if (type(winner) is not int):
-        return 'Winner is invalid (must be a number).'
-    elif (type(loser) is not int):
-        return 'Loser is invalid (must be a number).'
-    elif (type(tournament) is not int):
-        return 'Tournament is invalid (must be a number).'
-    elif (type(is_tie) is not bool):
-        err_msg = 'The entry for whether this match was a tie is invalid '
-        err_msg += '(must be "True" or "False" (or blank)).'
+    err_msg = _check_match(winner, loser, tournament, is_tie)
+    if (err_msg):
         return err_msg
 
-    if (loser != 0):
-        # if a loser player ID is passed to the function, this is a normal
-        # match; record it in the database
-        sql = 'INSERT INTO matches (winner, loser, tournament_id, is_tie) '
-        sql += 'VALUES (%s, %s, %s, %s)'
-        data = (winner, loser, tournament, is_tie,)  # prevents SQL injection
+    if (_journal is not None and getattr(_local, 'session', None) is None):
+        # a session's results must commit (or roll back) with the session,
+        # so only results reported outside of one are journaled
+        _journal.append(tournament, winner, loser, is_tie)
+        return
+
+    if (_backend is not None):
+        return _backend.reportMatch(winner, loser, tournament, is_tie)
+
+    # report_match() checks the result against the stored pairings, if there
+    # are any, and records it; if 0 is passed to the function as the loser,
+    # this is a bye match, which the database records with no loser (see
+    # docstring for definition of a bye)
+    data = (tournament, winner, loser or None, is_tie,)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_report_match', data)
+        _touch(tournament)
+
+
+def _record_results(results):
+    """Records a batch of results from the journal in one transaction.
+
+    A result whose players (or bye) are already recorded is skipped, so a
+    batch can safely be replayed; a result the database rejects is left out
+    without spoiling the rest of the batch.
+
+    Args:
+      results: a list of (tournament, winner, loser, is_tie) tuples, as for
+                 reportMatch()
+
+    Returns:
+      A list with None for each result recorded or skipped, or the error
+        message that rejected it
+    """
+    errors = []
+    with session():
+        for (tournament, winner, loser, is_tie) in results:
+            errors.append(_record_result(tournament, winner, loser or None,
+                                         is_tie))
+    return errors
+
+
+def _record_result(tournament, winner, loser, is_tie):
+    """Records one result for _record_results(); a loser of None is a bye.
+    """
+    if (_backend is not None):
+        if (_backend.hasResult(tournament, winner, loser)):
+            return None
+        try:
+            _backend.reportMatch(winner, loser or 0, tournament, is_tie)
+        except _TRANSIENT_ERRORS:
+            raise
+        except psycopg2.Error as e:
+            return str(e).strip()
+        return None
+
+    if (loser is not None):
+        # a lookup on the one_match_per_pair index
+        exists_sql = 'SELECT EXISTS (SELECT 1 FROM matches '
+        exists_sql += 'WHERE tournament_id = %s AND loser IS NOT NULL '
+        exists_sql += 'AND LEAST(winner, loser) = LEAST(%s, %s) '
+        exists_sql += 'AND GREATEST(winner, loser) = GREATEST(%s, %s))'
+        data = (tournament, winner, loser, winner,
+                loser,)  # prevents SQL injection
     else:
-        # if 0 is passed to the function as the loser, this is a bye match;
-        # record it as such in the database (see docstring for definition
-        # of a bye)
-        sql = 'INSERT INTO matches (winner, tournament_id, is_bye) VALUES '
-        sql += '(%s, %s, True)'
-        data = (winner, tournament,)  # prevents SQL injection
+        # a lookup on the one_bye_per_tournament index
+        exists_sql = 'SELECT EXISTS (SELECT 1 FROM matches '
+        exists_sql += 'WHERE tournament_id = %s AND winner = %s AND is_bye)'
+        data = (tournament, winner,)  # prevents SQL injection
 
     with get_cursor() as cursor:
-        cursor.execute(sql, data)
+        # a rejected result only undoes itself, not the whole batch
+        cursor.execute('SAVEPOINT journal_result')
+        try:
+            cursor.execute(exists_sql, data)
+            if (cursor.fetchone()[0]):
+                cursor.execute('RELEASE SAVEPOINT journal_result')
+                return None
+            _execute(cursor, 'tournament_report_match',
+                     (tournament, winner, loser, is_tie,))
+        except _TRANSIENT_ERRORS:
+            raise  # the whole batch is retried
+        except psycopg2.Error as e:
+            # e.g.: a rematch, or a player ID too big for the database
+            cursor.execute('ROLLBACK TO SAVEPOINT journal_result')
+            return str(e).strip()
+        cursor.execute('RELEASE SAVEPOINT journal_result')
+        _touch(tournament)
+    return None
+
+
+@_instrumented
+def reportRound(tournament, results):
+    """Records the outcomes of every match in a round at once.
+
+    The whole round is checked for rematches, players paired with
+    themselves, players in more than one match and repeat byes with a single
+    query, then every result is inserted with a single statement. If any
+    result is invalid, nothing in the round is recorded.
+
+    Args:
+      tournament: the ID of the tournament this round was played in
+      results: a list of (winner, loser) or (winner, loser, is_tie) tuples,
+                 following the same rules as the arguments of reportMatch();
+                 a loser of 0 is a bye
+    """
+    # check function inputs to make sure they're of the right data type
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+    err_msg, winners, losers, ties = _round_arrays(tournament, results)
+    if (err_msg):
+        return err_msg
+
+    if (not winners):
+        return
+
+    if (_backend is not None):
+        return _backend.reportRound(tournament, winners, losers, ties)
+
+    # report_round() validates and inserts the whole round in the database
+    data = (tournament, winners, losers, ties,)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_report_round', data)
+        _touch(tournament)
 
 
-def swissPairings(tournament):
+# the pairing engines live in pairing.py, which needs no database; these
+# are the same functions, timed like the rest of the API
+pairPlayers = _instrumented(pairing.pairPlayers)
+pairPlayersByMatching = _instrumented(pairing.pairPlayersByMatching)
+
+
+@_instrumented
+def swissPairings(tournament, mode='backtrack'):
     """Returns a list of pairs of players for the next round of a match.
 
     Assuming that there are an even number of players registered, each player
@@ -313,6 +1763,15 @@ def swissPairings(tournament):
 
     Args:
       tournament: the ID of the tournament for which to generate pairings
+      mode: how to generate the pairings:
+              'backtrack' (the default) loads the standings and the pairs
+                already played once and pairs them in Python (see
+                pairPlayers())
+              'matching' pairs the whole round at once as a minimum-cost
+                matching (see pairPlayersByMatching()); slower than
+                'backtrack' but always finds a complete round if one exists
+              'database' runs the same search as 'backtrack' inside the
+                database, in the swiss_pairings() function
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -322,23 +1781,598 @@ def swissPairings(tournament):
         name2: the second player's name
     """
     # check function input to make sure it's of the right data type
-    if (type(tournament) is not int):
-        return 'Tournament is invalid (must be a number).'
+    err_msg = _check_pairing_mode(tournament, mode)
+    if (err_msg):
+        return err_msg
+
+    if (mode != 'database' or _backend is not None):
+        # a storage backend has no swiss_pairings() function, but 'backtrack'
+        # runs the same search
+        standings, played, had_bye = _load_pairing_state(tournament)
+        if (mode == 'matching'):
+            pair_list = pairPlayersByMatching(standings, played, had_bye)
+        else:
+            pair_list = pairPlayers(standings, played, had_bye)
+        if (pair_list is None):
+            return 'No complete round of pairings is possible.'
+        return pair_list
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_swiss_pairings', (tournament,))
+        return cursor.fetchall()
+
+
+@_instrumented
+def iterPairings(tournament, mode='backtrack', fetch_size=None):
+    """Returns the pairings like swissPairings(), but as an iterator.
+
+    In 'database' mode the pairs are read from the database a few rows at a
+    time; the other modes pair the whole round in memory anyway.
+
+    Args:
+      tournament: the ID of the tournament for which to generate pairings
+      mode: as for swissPairings()
+      fetch_size: how many rows to read at a time (default FETCH_SIZE)
+
+    Returns:
+      An iterator of (id1, name1, id2, name2) tuples, as in swissPairings()
+    """
+    # check function input to make sure it's of the right data type
+    err_msg = _check_pairing_mode(tournament, mode)
+    if (err_msg):
+        return err_msg
+
+    if (mode != 'database' or _backend is not None):
+        pair_list = swissPairings(tournament, mode)
+        if (type(pair_list) is not list):
+            return pair_list  # no complete round is possible
+        return iter(pair_list)
+
+    return _stream_pairings(tournament, fetch_size)
+
+
+@_instrumented
+def pairAll(tournament_ids, mode='backtrack'):
+    """Pairs the next round of many tournaments at once, and stores the
+    pairings.
+
+    Everything pairing needs is read for all the tournaments together, the
+    tournaments are paired in parallel on a pool of PAIRING_PROCESSES worker
+    processes, and the new round of every tournament that could be paired
+    is stored (see startRound()) in a single transaction. A tournament whose
+    latest stored round is still waiting for results gets that round back
+    instead of a new one.
+
+    Args:
+      tournament_ids: the IDs of the tournaments to pair
+      mode: 'backtrack' or 'matching', as for swissPairings(); 'database'
+              runs the same search as 'backtrack', in Python
+
+    Returns:
+      A dict of tournament ID -> the list of pairs, as swissPairings()
+        returns them, or an error message if no complete round of pairings
+        is possible for that tournament
+    """
+    tournament_ids = list(tournament_ids)
+
+    # check function inputs to make sure they're of the right data type
+    for tournament in tournament_ids:
+        err_msg = _check_pairing_mode(tournament, mode)
+        if (err_msg):
+            return err_msg
+
+    parallel = len(tournament_ids) > 1 and PAIRING_PROCESSES != 1
+    if (parallel):
+        _get_worker_pool()  # before a connection is checked out
+
+    with session():
+        # rounds in progress are served from storage; everything else is
+        # paired now, while the tournaments are locked
+        pairings = _open_rounds(tournament_ids)
+        to_pair = [t for t in tournament_ids if t not in pairings]
+
+        states = _load_pairing_states(to_pair)
+        tasks = [states[tournament] + (mode,) for tournament in to_pair]
+
+        if (len(tasks) > 1 and PAIRING_PROCESSES != 1):
+            results = _get_worker_pool().map(_pair_state, tasks)
+        else:
+            results = [_pair_state(task) for task in tasks]
+
+        paired = {}
+        for (tournament, pair_list) in zip(to_pair, results):
+            if (pair_list is None):
+                pairings[tournament] = ('No complete round of pairings is '
+                                        'possible.')
+            else:
+                pairings[tournament] = pair_list
+                if (pair_list):
+                    paired[tournament] = pair_list
+
+        if (paired):
+            _store_pairings(paired)
+
+    return pairings
+
+
+@_instrumented
+def startRound(tournament, mode='backtrack'):
+    """Pairs the next round of a tournament, and stores it.
+
+    A round is only paired once: until every result of the latest stored
+    round has been reported, calling this again returns that round from
+    storage. Results are checked against the stored pairs (see
+    reportMatch()).
+
+    Args:
+      tournament: the ID of the tournament to pair
+      mode: how to pair the round, as for swissPairings()
+
+    Returns:
+      A list of pairs, as swissPairings() returns them, or an error message
+    """
+    # check function input to make sure it's of the right data type
+    err_msg = _check_pairing_mode(tournament, mode)
+    if (err_msg):
+        return err_msg
+
+    return pairAll([tournament], mode)[tournament]
+
+
+@_instrumented
+def currentRound(tournament):
+    """Returns the number of the latest stored round of a tournament, from
+    1, or 0 if no round has been stored."""
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+
+    if (_backend is not None):
+        return _backend.currentRound(tournament)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_current_round', (tournament,))
+        return cursor.fetchone()[0]
+
+
+@_instrumented
+def roundPairings(tournament, round_number=None):
+    """Returns the stored pairs of one round of a tournament.
+
+    Args:
+      tournament: the ID of the tournament
+      round_number: which round, from 1; the latest if None
+
+    Returns:
+      A list of pairs, as swissPairings() returns them, in the order they
+        were paired; empty if there is no such round
+    """
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+    if (round_number is not None and type(round_number) is not int):
+        return 'Round is invalid (must be a number).'
+
+    if (_backend is not None):
+        return _backend.roundPairings(tournament, round_number)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_round_pairings',
+                 (tournament, round_number,))
+        return cursor.fetchall()
+
+
+def _pair_state(task):
+    """Pairs one tournament for pairAll(), in a worker process.
+
+    Args:
+      task: a tuple of (standings, played, had_bye, mode)
+    """
+    standings, played, had_bye, mode = task
+    if (mode == 'matching'):
+        return pairPlayersByMatching(standings, played, had_bye)
+    return pairPlayers(standings, played, had_bye)
+
+
+def _open_rounds(tournament_ids):
+    """Locks the tournaments against being paired by anyone else until the
+    current transaction ends, and reads the ones whose latest stored round
+    still has results to come.
+
+    Returns:
+      A dict of tournament ID -> the pairs of its round in progress
+    """
+    if (_backend is not None):
+        return _backend.openRounds(tournament_ids)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_lock_tournaments', (tournament_ids,))
+        _execute(cursor, 'tournament_open_rounds', (tournament_ids,))
+        return _open_rounds_from_rows(cursor.fetchall())
+
+
+def _open_rounds_from_rows(rows):
+    """Builds the result of _open_rounds() from the rows of the
+    tournament_open_rounds statement."""
+    rounds = {}
+    waiting = set()
+    for row in rows:
+        row = tuple(row)
+        rounds.setdefault(row[0], []).append(row[1:5])
+        if (not row[5]):
+            waiting.add(row[0])
+    return dict((tournament, rounds[tournament]) for tournament in waiting)
+
+
+def _load_pairing_states(tournament_ids):
+    """Reads everything pairing needs for many tournaments at once.
+
+    Returns:
+      A dict of tournament ID -> (standings, played, had_bye), as described
+        for _load_pairing_state()
+    """
+    if (_backend is not None):
+        return dict((tournament, _backend.pairingState(tournament))
+                    for tournament in tournament_ids)
+    if (not tournament_ids):
+        return {}
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_pairing_standings', (tournament_ids,))
+        standings = cursor.fetchall()
+        _execute(cursor, 'tournament_played_pairs', (tournament_ids,))
+        played = cursor.fetchall()
+
+    return _pairing_states_from_rows(tournament_ids, standings, played)
+
+
+def _pairing_states_from_rows(tournament_ids, standings, played):
+    """Builds the result of _load_pairing_states() from the rows of the
+    tournament_pairing_standings and tournament_played_pairs statements."""
+    states = dict((tournament, ([], set(), set()))
+                  for tournament in tournament_ids)
+    for (tournament, player, name, wins, byes) in standings:
+        states[tournament][0].append((player, name, wins))
+        if (byes > 0):
+            states[tournament][2].add(player)
+    for (tournament, winner, loser) in played:
+        states[tournament][1].add(frozenset([winner, loser]))
+    return states
 
-    # call the function swiss_pairings(), passing in the tournament ID
+
+def _store_pairings(pairings):
+    """Stores a new round for each tournament, in one statement.
+
+    Args:
+      pairings: a dict of tournament ID -> list of pairs from swissPairings()
+
+    Returns:
+      A dict of tournament ID -> the number of the stored round
+    """
+    if (_backend is not None):
+        return _backend.storePairings(pairings)
+
+    with get_cursor() as cursor:
+        _execute(cursor, 'tournament_store_pairings',
+                 _pairing_arrays(pairings))
+        return dict(cursor.fetchall())
+
+
+def _pairing_arrays(pairings):
+    """Returns the parameters of the tournament_store_pairings statement
+    for _store_pairings(): the tournament IDs, then parallel lists of the
+    tournament, player one and player two of every pair."""
+    tournament_ids = []
+    player_ones = []
+    player_twos = []
+    for (tournament, pairs) in pairings.items():
+        for pair in pairs:
+            tournament_ids.append(tournament)
+            player_ones.append(pair[0])
+            player_twos.append(pair[2])
+    return list(pairings), tournament_ids, player_ones, player_twos
+
+
+def _stream_pairings(tournament, fetch_size=None):
+    """Yields the rows of the swiss_pairings() function for a tournament."""
     # swiss_pairings() checks to see which players have already been matched
     # up and gives us a new round of pairings
-    sql = 'SELECT * FROM swiss_pairings(%s)'
+    sql, data = _unprepared('tournament_swiss_pairings', (tournament,))
+    return _stream_rows(sql, data, fetch_size)
+
+
+class _PairingRows(object):
+    """Reads what _sync_pairing_state() needs from the database; a storage
+    backend has the same methods."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def pairingCounts(self, tournament):
+        """Returns (number of players, highest player ID, number of
+        matches)."""
+        _execute(self.cursor, 'tournament_pairing_counts', (tournament,))
+        return self.cursor.fetchone()
+
+    def pairingPlayers(self, tournament):
+        """Returns the (id, name) of every player."""
+        _execute(self.cursor, 'tournament_pairing_players', (tournament,))
+        return self.cursor.fetchall()
+
+    def pairingMatches(self, tournament, after):
+        """Returns (id, winner, loser, is_tie, is_bye) for every match with
+        an ID above after, by ID."""
+        _execute(self.cursor, 'tournament_pairing_matches',
+                 (tournament, after,))
+        return self.cursor.fetchall()
+
+
+def _sync_pairing_state(state, rows, tournament):
+    """Finds what a tournament's PairingState is missing (see
+    pairing_state.syncPairingState()).
+
+    Args:
+      state: the PairingState from last time, or None
+      rows: where to read from: a _PairingRows, or a storage backend
+      tournament: the ID of the tournament
+
+    Returns:
+      A tuple of (state, matches): the state (a new one, with its players,
+        if it had to be read in full), and the rows of the matches still to
+        apply to it
+    """
+    steps = syncPairingState(state, rows.pairingCounts(tournament))
+    step, value = next(steps)
+    while (step != 'done'):
+        if (step == 'players'):
+            found = rows.pairingPlayers(tournament)
+        else:
+            found = rows.pairingMatches(tournament, value)
+        step, value = steps.send(found)
+    return value
+
+
+def _load_pairing_state(tournament):
+    """Reads everything pairing needs for a tournament in one connection.
+
+    The state from the last call is brought up to date with just the
+    matches reported since (see _sync_pairing_state()).
+
+    Returns:
+      A tuple of (standings, played, had_bye): the (id, name, wins) of every
+        player in standings order, the pairs who have already met (see
+        pairing_state.PlayedPairs), and a set of the IDs of players who have
+        had a bye
+    """
+    state = _take_pairing_state(tournament)
+
+    if (_backend is not None):
+        state, matches = _sync_pairing_state(state, _backend, tournament)
+    else:
+        with get_cursor() as cursor:
+            state, matches = _sync_pairing_state(state, _PairingRows(cursor),
+                                                 tournament)
+
+    return _keep_pairing_state(tournament, state, matches)
+
+
+def _take_pairing_state(tournament):
+    """Returns the PairingState kept for a tournament (or None), which is
+    no longer kept until _keep_pairing_state() puts it back."""
+    with _pairing_lock:
+        return _pairing_states.pop(tournament, None)
+
+
+def _keep_pairing_state(tournament, state, matches):
+    """Applies the rows of new matches to a PairingState and keeps it for
+    next time.
+
+    Returns:
+      (standings, played, had_bye), as for _load_pairing_state()
+    """
+    for match in matches:
+        state.applyMatch(*match)
+    result = (state.standings(), state.played(), set(state.had_bye))
+
+    with _pairing_lock:
+        _pairing_states[tournament] = state
+        while (len(_pairing_states) > PAIRING_STATE_SIZE):
+            _pairing_states.popitem(last=False)
+
+    return result
+
+
+@_instrumented
+def exportSnapshot(tournament, path):
+    """Saves everything about a tournament to a snapshot file.
+
+    The file (see snapshot.py) holds the tournament's players, standings,
+    matches and stored rounds, and can be loaded back with importSnapshot()
+    or read without a database with snapshot.readSnapshot().
+
+    Args:
+      tournament: the ID of the tournament to save
+      path: the file to write
+
+    Raises:
+      ValueError: if there is no such tournament
+    """
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+
+    if (_backend is not None):
+        rows = _backend.snapshotRows(tournament)
+    else:
+        rows = _snapshot_rows(tournament)
+    if (rows is None):
+        raise ValueError('Tournament %s does not exist.' % tournament)
+
+    writeSnapshot(buildSnapshot(tournament, *rows), path)
+
+
+def _snapshot_rows(tournament):
+    """Reads everything a snapshot holds about a tournament, as a tuple of
+    (name, players, matches, pairings) in the formats of
+    snapshot.buildSnapshot(), or None if there is no such tournament."""
+    name_sql = 'SELECT name FROM tournaments WHERE id = %s'
+    players_sql = '''
+        SELECT p.id, p.registrant_id, r.name, s.wins, s.matches, s.ties,
+            s.byes, s.omw
+        FROM players p
+            JOIN registrants r ON r.id = p.registrant_id
+            JOIN standings s ON s.tournament_id = p.tournament_id
+                AND s.player_id = p.id
+        WHERE p.tournament_id = %s
+        ORDER BY p.id
+    '''
+    matches_sql = 'SELECT id, winner, loser, is_tie, is_bye, round '
+    matches_sql += 'FROM matches WHERE tournament_id = %s ORDER BY id'
+    pairings_sql = 'SELECT round, board, player_one, player_two '
+    pairings_sql += 'FROM pairings WHERE tournament_id = %s '
+    pairings_sql += 'ORDER BY round, board'
     data = (tournament,)  # prevents SQL injection
 
     with get_cursor() as cursor:
-        cursor.execute(sql, data)
-        pairs = cursor.fetchall()
+        cursor.execute(name_sql, data)
+        row = cursor.fetchone()
+        if (row is None):
+            return None
+        cursor.execute(players_sql, data)
+        players = cursor.fetchall()
+        cursor.execute(matches_sql, data)
+        matches = cursor.fetchall()
+        cursor.execute(pairings_sql, data)
+        pairings = cursor.fetchall()
+
+    return row[0], players, matches, pairings
+
+
+@_instrumented
+def importSnapshot(path):
+    """Loads a tournament saved by exportSnapshot() back in, e.g.: to
+    restore an archived event, or to recover one after a crash.
+
+    The tournament, its players and its matches keep the IDs they had, so
+    the tournament must not already exist. A registrant already in the
+    database with the same ID is taken to be the same person. Everything is
+    bulk loaded with COPY in one transaction, and the standings are written
+    as they were saved instead of being recalculated match by match.
 
-    pair_list = []
+    Args:
+      path: the snapshot file to load
+
+    Returns:
+      The ID of the tournament
+    """
+    saved = readSnapshot(path)
+    tournament = saved.tournament_id
 
-    # build the list of tuples to return to the calling function
-    for pair in pairs:
-        pair_list.append(pair)
+    if (_backend is not None):
+        _backend.loadSnapshot(saved)
+        return tournament
 
-    return pair_list
+    players = saved.players()
+    matches = saved.matchRows()
+    pairings = saved.pairings()
+    data = (tournament,)  # prevents SQL injection
+
+    # the players go through a temporary table, from which the registrants
+    # not already in the database, the players and the standings are taken
+    staging_sql = '''
+        CREATE TEMPORARY TABLE snapshot_players (
+            id integer, registrant_id integer, name text, wins integer,
+            matches integer, ties integer, byes integer, omw integer)
+    '''
+    registrants_sql = 'INSERT INTO registrants (id, name) '
+    registrants_sql += 'SELECT registrant_id, name FROM snapshot_players '
+    registrants_sql += 'ON CONFLICT (id) DO NOTHING'
+    players_sql = 'INSERT INTO players (id, tournament_id, registrant_id) '
+    players_sql += 'SELECT id, %s, registrant_id FROM snapshot_players'
+    standings_sql = '''
+        UPDATE standings s
+        SET wins = sp.wins, matches = sp.matches, ties = sp.ties,
+            byes = sp.byes, omw = sp.omw
+        FROM snapshot_players sp
+        WHERE s.tournament_id = %s AND s.player_id = sp.id
+    '''
+    rounds_sql = 'INSERT INTO rounds (tournament_id, round) '
+    rounds_sql += 'SELECT %s, generate_series(1, %s)'
+    # like a serial column, new IDs carry on after the ones loaded
+    sequence_sql = 'SELECT setval(%s, GREATEST(last_value, %s)) FROM '
+    sequences = (
+        ('registrants_id_seq', [row[1] for row in players]),
+        ('tournaments_id_seq', [tournament]),
+        ('players_id_seq', [row[0] for row in players]),
+        ('matches_id_seq', [row[0] for row in matches]),
+    )
+
+    if (getattr(_local, 'session', None) is None):
+        # otherwise they are created as the tournament is inserted
+        _create_partitions(tournament)
+
+    with get_cursor() as cursor:
+        cursor.execute('INSERT INTO tournaments (id, name) VALUES (%s, %s)',
+                       (tournament, saved.tournamentName(),))
+
+        cursor.execute(staging_sql)
+        _copy_rows(cursor, 'snapshot_players',
+                   ('id', 'registrant_id', 'name', 'wins', 'matches', 'ties',
+                    'byes', 'omw'), players)
+        cursor.execute(registrants_sql)
+        cursor.execute(players_sql, data)
+
+        # the matches were checked when they were reported, and the saved
+        # standings already count them
+        cursor.execute("SELECT set_config('tournament.skip_match_checks', "
+                       "'on', true), set_config('tournament.skip_standings', "
+                       "'on', true)")
+        _copy_rows(cursor, 'matches',
+                   ('id', 'tournament_id', 'winner', 'loser', 'is_tie',
+                    'is_bye', 'round'),
+                   [(row[0], tournament) + row[1:] for row in matches])
+        cursor.execute("SELECT set_config('tournament.skip_match_checks', "
+                       "'off', true), set_config('tournament.skip_standings', "
+                       "'off', true)")
+        cursor.execute(standings_sql, data)
+
+        if (pairings):
+            cursor.execute(rounds_sql, (tournament, pairings[-1][0],))
+            _copy_rows(cursor, 'pairings',
+                       ('tournament_id', 'round', 'board', 'player_one',
+                        'player_two'),
+                       [(tournament,) + row for row in pairings])
+
+        for (sequence, ids) in sequences:
+            if (ids):
+                cursor.execute(sequence_sql + sequence,
+                               (sequence, max(ids),))
+
+        cursor.execute('DROP TABLE snapshot_players')
+        _touch(tournament)
+
+    return tournament
+
+
+def _copy_value(value):
+    """Formats one value for COPY's text format."""
+    if (value is None):
+        return '\\N'
+    if (value is True or value is False):
+        return 't' if value else 'f'
+    if (type(value) is int):
+        return str(value)
+    for (char, escaped) in (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'),
+                            ('\r', '\\r')):
+        value = value.replace(char, escaped)
+    return value
+
+
+def _copy_rows(cursor, table, columns, rows):
+    """Bulk loads rows into a table with COPY."""
+    text = ''.join('\t'.join(_copy_value(value) for value in row) + '\n'
+                   for row in rows)
+    if (not isinstance(text, bytes)):
+        text = text.encode('utf-8')
+    sql = 'COPY %s (%s) FROM STDIN' % (table, ', '.join(columns))
+    cursor.copy_expert(sql, io.BytesIO(text))
@@ -19,72 +19,99 @@ CREATE TABLE tournaments (
     name      text NOT NULL
 );
 
+-- players and matches are partitioned by tournament: create_tournament_partitions() gives each new tournament its own
+-- partition of each table, so one event's queries never read another's rows and deleting an event just drops its partitions
+-- there are no default partitions, since every tournament gets its partitions as it is created (see the
+-- add_tournament_partitions trigger); a default partition would have to be scanned every time a partition is attached, and
+-- would rule out detaching one with DETACH PARTITION ... CONCURRENTLY
 CREATE TABLE players (
-    id               serial PRIMARY KEY,
+    id               serial,
     tournament_id   integer NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
     registrant_id   integer NOT NULL REFERENCES registrants (id) ON DELETE CASCADE,
+    PRIMARY KEY (tournament_id, id),
     UNIQUE (tournament_id, registrant_id) -- register a player for a tournament only once
-);
+) PARTITION BY LIST (tournament_id);
 
 CREATE TABLE matches (
-    id               serial PRIMARY KEY,
+    id               serial,
     tournament_id   integer NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
-    winner          integer NOT NULL REFERENCES players (id) ON DELETE CASCADE,
-    loser           integer REFERENCES players (id) ON DELETE SET NULL,
+    winner          integer NOT NULL,
+    loser           integer,
     is_tie          boolean DEFAULT FALSE,
-    is_bye          boolean DEFAULT FALSE
+    is_bye          boolean DEFAULT FALSE,
+    round           integer, -- the stored round the match was paired in (see report_match()), or NULL if none was
+    PRIMARY KEY (tournament_id, id),
+    -- both players must be in the same tournament as the match
+    FOREIGN KEY (tournament_id, winner) REFERENCES players (tournament_id, id) ON DELETE CASCADE,
+    -- a column list for SET NULL needs PostgreSQL 15; tournament_id is part of the partition key, so it must stay
+    FOREIGN KEY (tournament_id, loser) REFERENCES players (tournament_id, id) ON DELETE SET NULL (loser)
+) PARTITION BY LIST (tournament_id);
+
+CREATE TABLE standings (
+    -- one row per player, kept up to date by triggers so that reading the standings doesn't have to count matches
+    player_id       integer PRIMARY KEY,
+    tournament_id   integer NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    wins            integer NOT NULL DEFAULT 0,
+    matches         integer NOT NULL DEFAULT 0,
+    ties            integer NOT NULL DEFAULT 0,
+    byes            integer NOT NULL DEFAULT 0,
+    omw             integer NOT NULL DEFAULT 0, -- total wins of the player's former opponents (ties excluded)
+    FOREIGN KEY (tournament_id, player_id) REFERENCES players (tournament_id, id) ON DELETE CASCADE
+);
+
+CREATE TABLE rounds (
+    -- one row per round of pairings stored for a tournament, e.g.: by startRound(); a round is paired once, and later
+    -- requests for it are answered from the pairings table
+    tournament_id   integer NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    round           integer NOT NULL,
+    created         timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (tournament_id, round)
+);
+
+CREATE TABLE pairings (
+    -- the pairings handed out for each round, in the order they were paired
+    tournament_id   integer NOT NULL,
+    round           integer NOT NULL,
+    board           integer NOT NULL, -- the pair's place in the round, from 1
+    player_one      integer NOT NULL,
+    player_two      integer, -- NULL for a bye
+    PRIMARY KEY (tournament_id, round, board),
+    FOREIGN KEY (tournament_id, round) REFERENCES rounds (tournament_id, round) ON DELETE CASCADE,
+    FOREIGN KEY (tournament_id, player_one) REFERENCES players (tournament_id, id) ON DELETE CASCADE,
+    FOREIGN KEY (tournament_id, player_two) REFERENCES players (tournament_id, id) ON DELETE CASCADE
 );
 
 -- Create Indexes
 CREATE UNIQUE INDEX one_bye_per_tournament ON matches (tournament_id, winner) WHERE is_bye; -- enforce one bye per tournament rule in DB
+CREATE UNIQUE INDEX one_match_per_pair ON matches (tournament_id, LEAST(winner, loser), GREATEST(winner, loser)) WHERE loser IS NOT NULL; -- canonical unordered pair key; makes rematch checks an index lookup and backs up the no_rematches trigger
+CREATE INDEX matches_by_winner ON matches (winner, is_tie, loser); -- wins and opponents of a player, answered from the index alone
+CREATE INDEX matches_by_loser ON matches (loser, is_tie, winner); -- losses and opponents of a player, answered from the index alone
+CREATE INDEX players_by_registrant ON players (registrant_id); -- cascading deletes from registrants
+CREATE INDEX standings_by_rank ON standings (tournament_id, wins DESC, omw DESC, player_id); -- read a tournament's standings already sorted
+CREATE UNIQUE INDEX pairings_by_pair ON pairings (tournament_id, round, LEAST(player_one, player_two), GREATEST(player_one, player_two)); -- the same unordered pair key as one_match_per_pair (a bye's key is (player_one, player_one)); makes checking a result against its pairing an index lookup
+CREATE INDEX pairings_by_player_one ON pairings (tournament_id, player_one); -- cascading deletes from players
+CREATE INDEX pairings_by_player_two ON pairings (tournament_id, player_two); -- cascading deletes from players
 
 -- Create Views
 CREATE VIEW player_standings AS
     -- this view generates a list of player standings based on:
     --     o number of wins the player has had
     --     o number of "opponent match wins" (omw) for the player's former opponents
+    -- the numbers themselves are kept up to date in the standings table by the update_standings trigger
     SELECT
-        t.id AS tournament_id,
-        p.id AS player_id,
+        s.tournament_id,
+        s.player_id,
         r.name AS player_name,
-        (
-            SELECT
-                COUNT(id)
-            FROM matches
-            WHERE winner = p.id OR loser = p.id
-        ) AS count_matches, -- display number of matches the player has been in
-        (
-            SELECT COUNT(id)
-            FROM matches
-            WHERE winner = p.id AND is_tie = FALSE
-        ) AS count_wins, -- display the number of wins for the player
-        (
-            SELECT SUM(count_wins1) -- add up the wins of the player's former opponents
-            FROM
-                (
-                    SELECT COUNT(p1.id) AS count_wins1
-                    FROM
-                        players p1,
-                        matches m1
-                    WHERE m1.winner = p1.id AND m1.is_tie = FALSE AND p1.id IN (
-                        SELECT p2.id
-                        FROM
-                            players p2,
-                            matches m1
-                        WHERE
-                            (
-                                p2.id = m1.winner AND m1.loser = p.id AND is_tie = FALSE
-                            ) OR (
-                                p2.id = m1.loser AND m1.winner = p.id AND is_tie = FALSE
-                            )
-                    )
-                ) AS count_all_wins
-        ) AS omw -- display the player's omw score
+        s.matches AS count_matches, -- display number of matches the player has been in
+        s.wins AS count_wins, -- display the number of wins for the player
+        s.omw, -- display the player's omw score
+        s.ties AS count_ties, -- display the number of ties for the player
+        s.byes AS count_byes -- display the number of byes the player has received
     FROM
-        tournaments t,
+        standings s,
         players p,
         registrants r
-    WHERE p.registrant_id = r.id AND t.id = p.tournament_id
+    WHERE s.tournament_id = p.tournament_id AND s.player_id = p.id AND p.registrant_id = r.id
     ORDER BY
         tournament_id,
         count_wins DESC,
@@ -93,7 +120,6 @@ CREATE VIEW player_standings AS
 
 CREATE VIEW unmatched_pairs AS
     -- this view generates a list of players in each tournament who have not yet faced each other
-    -- the view is called by the function swiss_pairings()
     SELECT
         ps.tournament_id,
         ps.player_id AS player_one_id,
@@ -102,39 +128,57 @@ CREATE VIEW unmatched_pairs AS
         player_two.name AS player_two_name,
         ps.count_wins AS player_one_wins,
         ps.omw AS player_one_omw,
-        (
-            SELECT count(id)
-            FROM matches
-            WHERE winner = player_two.id AND is_tie = FALSE
-        ) AS player_two_wins -- display player two's wins; this will be used as a sorting mechanism
+        player_two.wins AS player_two_wins -- display player two's wins; this will be used as a sorting mechanism
     FROM
         player_standings ps, -- iterate through the player_standings view
         (
             SELECT
                 p1.id,
-                r1.name
+                p1.tournament_id,
+                r1.name,
+                s1.wins
             FROM
                 players p1,
-                registrants r1
-            WHERE p1.registrant_id = r1.id
+                registrants r1,
+                standings s1
+            WHERE p1.registrant_id = r1.id AND s1.tournament_id = p1.tournament_id AND s1.player_id = p1.id
         ) AS player_two -- for each player in player_standings, add a row to the results for another player who has not yet faced player_one
     WHERE
-        ps.player_id < player_two.id AND (
-            SELECT id
-            FROM matches
+        player_two.tournament_id = ps.tournament_id AND ps.player_id < player_two.id AND NOT EXISTS (
+            SELECT 1
+            FROM matches m
             WHERE
-                (
-                    ps.player_id = winner AND player_two.id = loser
-                ) OR (
-                    player_two.id = winner AND ps.player_id = loser
-                )
-        ) IS NULL -- ensure these two players have not met before in the current tournament
+                m.tournament_id = ps.tournament_id AND m.loser IS NOT NULL AND
+                LEAST(m.winner, m.loser) = ps.player_id AND GREATEST(m.winner, m.loser) = player_two.id
+        ) -- ensure these two players have not met before in the current tournament (a lookup on the one_match_per_pair index)
     ORDER BY
         player_one_wins DESC,
         player_one_omw DESC,
         player_two_wins DESC,
         player_one_id,
-        player_two_id; -- provide the unmatched_pairs results to swiss_pairings() pre-sorted
+        player_two_id; -- provide the unmatched_pairs results pre-sorted by standings
+
+CREATE VIEW round_pairings AS
+    -- this view lists the stored pairings of every round with the players' names, and whether each result is in yet
+    SELECT
+        p.tournament_id,
+        p.round,
+        p.board,
+        p.player_one AS player_one_id,
+        r1.name AS player_one_name,
+        p.player_two AS player_two_id,
+        r2.name AS player_two_name,
+        EXISTS (
+            SELECT 1
+            FROM matches m
+            WHERE m.tournament_id = p.tournament_id AND m.round = p.round AND m.winner IN (p.player_one, p.player_two)
+        ) AS reported -- whoever won (or tied) is recorded as the winner
+    FROM
+        pairings p
+        JOIN players p1 ON p1.tournament_id = p.tournament_id AND p1.id = p.player_one
+        JOIN registrants r1 ON r1.id = p1.registrant_id
+        LEFT JOIN players p2 ON p2.tournament_id = p.tournament_id AND p2.id = p.player_two
+        LEFT JOIN registrants r2 ON r2.id = p2.registrant_id;
 
 -- Create Functions
 CREATE FUNCTION no_rematches() RETURNS TRIGGER
@@ -146,11 +190,27 @@ DECLARE
     count_rematches int;
 
 BEGIN
+    -- report_round() has already checked the whole round in one query
+    IF current_setting('tournament.skip_match_checks', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
     -- set initial values for variables
     count_rematches := 0;
 
     -- search matches table for any instances of the two players meeting before in this tournament
-    SELECT COUNT(*) INTO count_rematches FROM matches WHERE tournament_id = NEW.tournament_id AND (winner = NEW.winner AND loser = NEW.loser) OR (winner = NEW.loser AND loser = NEW.winner);
+    -- a bye (or a match whose loser was deleted) can't be a rematch
+    IF NEW.loser IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    -- search matches table for any instances of the two players meeting before in this tournament; the pair is looked up
+    -- lowest player ID first, the same way the one_match_per_pair index stores it
+    SELECT COUNT(*) INTO count_rematches
+    FROM matches
+    WHERE
+        tournament_id = NEW.tournament_id AND loser IS NOT NULL AND id != NEW.id AND
+        LEAST(winner, loser) = LEAST(NEW.winner, NEW.loser) AND GREATEST(winner, loser) = GREATEST(NEW.winner, NEW.loser);
 
     IF count_rematches != 0 THEN
         -- raise exception if this is a rematch
@@ -170,6 +230,11 @@ AS
 $BODY$
 
 BEGIN
+    -- report_round() has already checked the whole round in one query
+    IF current_setting('tournament.skip_match_checks', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
     IF NEW.winner = NEW.loser THEN
         -- if the player_id is the same for both winner and loser, raise an exception
         RAISE EXCEPTION 'Winner and loser cannot be the same player.';
@@ -182,91 +247,467 @@ END
 $BODY$
 LANGUAGE plpgsql;
 
-CREATE FUNCTION swiss_pairings(tournament int) RETURNS TABLE (player_one_id int, player_one_name text, player_two_id int, player_two_name text)
+CREATE FUNCTION refresh_standings(tournament int, player_ids int[]) RETURNS void
 AS
--- swiss_pairings() generates the set of matched pairs based on:
---     o which players have already faced each other
---     o how many players are in a tournament
---     o whether or not a bye needs to be assigned
---     o player standings as of the time the function is called
+-- refresh_standings() recalculates the standings rows of the given players, plus the omw of everyone they have beaten or lost to
+-- every query names the tournament, so only that tournament's partition of matches is read
+$BODY$
+
+BEGIN
+    UPDATE standings s
+    SET
+        matches = (SELECT COUNT(*) FROM matches m WHERE m.tournament_id = $1 AND m.winner = s.player_id) +
+                  (SELECT COUNT(*) FROM matches m WHERE m.tournament_id = $1 AND m.loser = s.player_id),
+        wins = (SELECT COUNT(*) FROM matches m WHERE m.tournament_id = $1 AND m.winner = s.player_id AND m.is_tie = FALSE),
+        ties = (SELECT COUNT(*) FROM matches m WHERE m.tournament_id = $1 AND m.winner = s.player_id AND m.is_tie = TRUE) +
+               (SELECT COUNT(*) FROM matches m WHERE m.tournament_id = $1 AND m.loser = s.player_id AND m.is_tie = TRUE),
+        byes = (SELECT COUNT(*) FROM matches m WHERE m.tournament_id = $1 AND m.winner = s.player_id AND m.is_bye = TRUE)
+    WHERE s.tournament_id = $1 AND s.player_id = ANY (player_ids);
+
+    -- a change to a player's wins changes the omw of all of that player's former opponents
+    WITH affected AS (
+        SELECT unnest(player_ids) AS player_id
+        UNION
+        SELECT m.loser
+        FROM matches m
+        WHERE m.tournament_id = $1 AND m.winner = ANY (player_ids) AND m.loser IS NOT NULL AND m.is_tie = FALSE
+        UNION
+        SELECT m.winner FROM matches m WHERE m.tournament_id = $1 AND m.loser = ANY (player_ids) AND m.is_tie = FALSE
+    )
+    UPDATE standings s
+    SET omw = COALESCE((
+        SELECT SUM(o.wins)
+        FROM standings o
+        WHERE o.player_id IN (
+            SELECT m.loser FROM matches m WHERE m.tournament_id = $1 AND m.winner = s.player_id AND m.is_tie = FALSE
+            UNION
+            SELECT m.winner FROM matches m WHERE m.tournament_id = $1 AND m.loser = s.player_id AND m.is_tie = FALSE
+        )
+    ), 0)
+    FROM affected a
+    WHERE s.tournament_id = $1 AND s.player_id = a.player_id;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION update_standings() RETURNS TRIGGER
+AS
+-- update_standings() keeps the standings table in step with the matches table
+$BODY$
+
+BEGIN
+    -- importSnapshot() writes the standings as they were saved, instead of recalculating them for every match it loads
+    IF current_setting('tournament.skip_standings', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' OR TG_OP = 'UPDATE' THEN
+        PERFORM refresh_standings(NEW.tournament_id, ARRAY[NEW.winner, NEW.loser]);
+    END IF;
+    IF TG_OP = 'DELETE' OR TG_OP = 'UPDATE' THEN
+        PERFORM refresh_standings(OLD.tournament_id, ARRAY[OLD.winner, OLD.loser]);
+    END IF;
+    RETURN NULL;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION add_standings_row() RETURNS TRIGGER
+AS
+-- add_standings_row() gives every new player an empty row in the standings table
+$BODY$
+
+BEGIN
+    INSERT INTO standings (player_id, tournament_id) VALUES (NEW.id, NEW.tournament_id);
+    RETURN NULL;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION notify_standings_changed() RETURNS TRIGGER
+AS
+-- notify_standings_changed() sends the tournament's ID on the standings_changed channel (STANDINGS_CHANNEL in tournament.py) whenever its matches or players change
+$BODY$
+
+BEGIN
+    -- the same payload is only sent once per transaction, so a whole round reported at once is one notification
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('standings_changed', OLD.tournament_id::text);
+    ELSE
+        PERFORM pg_notify('standings_changed', NEW.tournament_id::text);
+    END IF;
+    RETURN NULL;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION create_tournament_partitions(tournament int) RETURNS void
+AS
+-- create_tournament_partitions() gives a tournament its own partitions of the players and matches tables
+--     o CREATE TABLE ... PARTITION OF would lock the whole table (ACCESS EXCLUSIVE), so even reads of other tournaments
+--       would wait; a table created on its own and then attached leaves reads running
+--     o attaching still adds the foreign keys that point at players, which locks the tables they come from (matches,
+--       standings, pairings) against writes in every tournament until the transaction ends; so createTournament() runs
+--       this in a short transaction of its own, before inserting the tournament, unless it is called inside a session
+--     o a new partition is empty, so attaching it has no rows to check
+$BODY$
+
+BEGIN
+    IF to_regclass('players_' || $1) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I (LIKE players INCLUDING DEFAULTS)', 'players_' || $1);
+        EXECUTE format('ALTER TABLE players ATTACH PARTITION %I FOR VALUES IN (%s)', 'players_' || $1, $1);
+    END IF;
+
+    IF to_regclass('matches_' || $1) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I (LIKE matches INCLUDING DEFAULTS)', 'matches_' || $1);
+        EXECUTE format('ALTER TABLE matches ATTACH PARTITION %I FOR VALUES IN (%s)', 'matches_' || $1, $1);
+    END IF;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION add_tournament_partitions() RETURNS TRIGGER
+AS
+-- add_tournament_partitions() gives every new tournament its partitions, so its players and matches always have somewhere to go
+-- (it does nothing for a tournament whose partitions createTournament() has already made)
+$BODY$
+
+BEGIN
+    PERFORM create_tournament_partitions(NEW.id);
+    RETURN NULL;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION clear_tournament_partitions(tournament int) RETURNS TABLE (parent text, partition text, detach_pending boolean)
+AS
+-- clear_tournament_partitions() gets a tournament's partitions ready to be detached, by deleting the rows of other tables that
+-- point at its players, and returns the (quoted) names of the partitions still attached, matches' first since it points at
+-- players'; deleteTournament() detaches them with DETACH PARTITION ... CONCURRENTLY, which can't run inside a transaction
+-- (and so can't run here). detach_pending is true for a partition whose concurrent detach was interrupted, which has to be
+-- finished with DETACH PARTITION ... FINALIZE
+$BODY$
+
+BEGIN
+    DELETE FROM standings WHERE tournament_id = $1;
+    DELETE FROM rounds WHERE tournament_id = $1;
+
+    RETURN QUERY
+        SELECT quote_ident(p.relname::text), quote_ident(c.relname::text), i.inhdetachpending
+        FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname IN ('matches', 'players') AND c.relname IN ('matches_' || $1, 'players_' || $1)
+        ORDER BY p.relname;
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION drop_tournament_partitions(tournament int) RETURNS void
+AS
+-- drop_tournament_partitions() removes a tournament's players and matches by dropping its partitions, instead of deleting
+-- (and firing triggers for) every row; each partition is detached first so no foreign key still points at it
+--     o this is for deleting a tournament inside a transaction: a plain DETACH PARTITION locks the whole table (ACCESS
+--       EXCLUSIVE) until the transaction ends, so deleteTournament() detaches concurrently instead when it can
 $BODY$
 DECLARE
     -- declare variables
-    i                           int;
-    j                        RECORD;
-    pairs                       int;
-    starting_players        numeric;
-    temp_1                      int;
-    temp_2                      int;
-    is_bye                     bool;
-    temp_remaining_rows         int;
-    matched_pairs               int;
+    p       record;
 
 BEGIN
-    -- set initial values for variables
-    SELECT COUNT(*) INTO starting_players FROM players WHERE tournament_id = $1;
-    pairs := ceil(starting_players / 2);
+    FOR p IN SELECT * FROM clear_tournament_partitions($1) LOOP
+        EXECUTE format('ALTER TABLE %s DETACH PARTITION %s', p.parent, p.partition);
+    END LOOP;
+
+    -- including any left detached by a deleteTournament() that was interrupted
+    EXECUTE format('DROP TABLE IF EXISTS %I, %I', 'matches_' || $1, 'players_' || $1);
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION report_round(tournament int, winners int[], losers int[], ties boolean[]) RETURNS void
+AS
+-- report_round() records every result of a round at once; the arrays are parallel, one element per match (a NULL loser is a bye)
+-- instead of letting the triggers check each row, the whole round is checked with one query and then inserted with one statement
+$BODY$
+DECLARE
+    -- declare variables
+    first_problem   text;
+    last_round      int;
 
-    is_bye := FALSE;
-    IF starting_players % 2 != 0 THEN
-        -- This tournament has an odd number of players; we'll need to assign a bye after pairings have been made
-        is_bye := TRUE;
+BEGIN
+    -- once a tournament has stored rounds, only the pairs of the latest one can be reported
+    SELECT MAX(r.round) INTO last_round FROM rounds r WHERE r.tournament_id = $1;
+
+    WITH round AS (
+        SELECT * FROM unnest(winners, losers, ties) WITH ORDINALITY AS r (winner, loser, is_tie, pos)
+    ), seat_counts AS (
+        -- how many times each player appears in this round
+        SELECT s.player_id, COUNT(*) AS seats
+        FROM (
+            SELECT winner AS player_id FROM round
+            UNION ALL
+            SELECT loser FROM round WHERE loser IS NOT NULL
+        ) AS s
+        GROUP BY s.player_id
+    ), problems AS (
+        SELECT
+            r.pos,
+            CASE
+                WHEN r.winner = r.loser THEN
+                    'Winner and loser cannot be the same player.'
+                WHEN w.seats > 1 OR l.seats > 1 THEN
+                    'A player cannot play more than one match in a round.'
+                WHEN pw.id IS NULL OR (r.loser IS NOT NULL AND pl.id IS NULL) THEN
+                    'Both players must be registered in this tournament.'
+                WHEN last_round IS NOT NULL AND NOT EXISTS (
+                    SELECT 1
+                    FROM pairings p
+                    WHERE
+                        p.tournament_id = $1 AND p.round = last_round AND
+                        LEAST(p.player_one, p.player_two) = LEAST(r.winner, r.loser) AND
+                        GREATEST(p.player_one, p.player_two) = GREATEST(r.winner, r.loser) AND
+                        (p.player_two IS NULL) = (r.loser IS NULL)
+                ) THEN
+                    'These two players were not paired in the current round.'
+                WHEN r.loser IS NULL AND EXISTS (
+                    SELECT 1 FROM matches m WHERE m.tournament_id = $1 AND m.winner = r.winner AND m.is_bye
+                ) THEN
+                    'No player can receive more than one bye in a tournament.'
+                WHEN r.loser IS NOT NULL AND EXISTS (
+                    SELECT 1
+                    FROM matches m
+                    WHERE
+                        m.tournament_id = $1 AND m.loser IS NOT NULL AND
+                        LEAST(m.winner, m.loser) = LEAST(r.winner, r.loser) AND
+                        GREATEST(m.winner, m.loser) = GREATEST(r.winner, r.loser)
+                ) THEN
+                    'These two players have faced each other in this tournament before.'
+            END AS problem
+        FROM round r
+            JOIN seat_counts w ON w.player_id = r.winner
+            LEFT JOIN seat_counts l ON l.player_id = r.loser
+            LEFT JOIN players pw ON pw.id = r.winner AND pw.tournament_id = $1
+            LEFT JOIN players pl ON pl.id = r.loser AND pl.tournament_id = $1
+    )
+    SELECT p.problem INTO first_problem FROM problems p WHERE p.problem IS NOT NULL ORDER BY p.pos LIMIT 1;
+
+    IF first_problem IS NOT NULL THEN
+        -- reject the whole round
+        RAISE EXCEPTION '%', first_problem;
     END IF;
 
-    -- establish temp results table; this will ultimately be returned at the end of the function
-    CREATE TEMPORARY TABLE temp_results (
-        player_one_id    int,
-        player_one_name text,
-        player_two_id    int,
-        player_two_name text
-    ) ON COMMIT DROP;
-
-    -- setup complete
-    -- generate a list of pairs of players that have not been matched together previously in this tournament
-    CREATE TEMPORARY TABLE unmatched_pairs_temp AS SELECT * FROM unmatched_pairs WHERE tournament_id = $1;
-
-    -- if there are an odd # of players, add rows to unmatched_pairs_temp for each player who has not yet had a bye
-    IF is_bye THEN
-        FOR j IN SELECT * FROM player_standings ps WHERE ps.tournament_id = $1 AND NOT ps.player_id IN (SELECT m.winner FROM matches m WHERE m.loser IS NULL AND m.is_bye = TRUE) LOOP
-            INSERT INTO unmatched_pairs_temp (tournament_id, player_one_id, player_one_name, player_two_id, player_two_name, player_one_wins, player_one_omw, player_two_wins) VALUES ($1, j.player_id, j.player_name, NULL, NULL, j.count_wins, j.omw, NULL);
-        END LOOP;
+    -- the round is valid, so don't make the triggers check every row again
+    PERFORM set_config('tournament.skip_match_checks', 'on', true);
+
+    INSERT INTO matches (winner, loser, tournament_id, is_tie, is_bye, round)
+    SELECT r.winner, r.loser, $1, r.is_tie AND r.loser IS NOT NULL, r.loser IS NULL, last_round
+    FROM unnest(winners, losers, ties) WITH ORDINALITY AS r (winner, loser, is_tie, pos)
+    ORDER BY r.pos;
+
+    PERFORM set_config('tournament.skip_match_checks', 'off', true);
+END
+$BODY$
+LANGUAGE plpgsql;
+
+CREATE FUNCTION report_match(tournament int, winner int, loser int, is_tie boolean) RETURNS void
+AS
+-- report_match() records one result (a NULL loser is a bye)
+--     o if the tournament has no stored rounds, the match is inserted and checked by the triggers
+--     o otherwise it must be one of the pairs of the latest stored round, which is looked up on the pairings_by_pair index;
+--       a stored pair has never met before, so the only rematch left to rule out is the same result reported twice, and
+--       the triggers' checks are skipped
+$BODY$
+DECLARE
+    -- declare variables
+    last_round      int;
+
+BEGIN
+    SELECT MAX(r.round) INTO last_round FROM rounds r WHERE r.tournament_id = $1;
+
+    IF last_round IS NULL THEN
+        INSERT INTO matches (winner, loser, tournament_id, is_tie, is_bye)
+        VALUES ($2, $3, $1, $4 AND $3 IS NOT NULL, $3 IS NULL);
+        RETURN;
     END IF;
 
-    matched_pairs := 0;
+    PERFORM 1
+    FROM pairings p
+    WHERE
+        p.tournament_id = $1 AND p.round = last_round AND
+        LEAST(p.player_one, p.player_two) = LEAST($2, $3) AND GREATEST(p.player_one, p.player_two) = GREATEST($2, $3) AND
+        (p.player_two IS NULL) = ($3 IS NULL);
 
-    -- outer loop iterates through the number of pairs in this tournament
-    -- this function must generate a complete set of pairs (e.g.: a match with 6 players should have 3 pairs)
-    FOR i IN 1..pairs LOOP
-        -- inner loop iterates through the remaining rows of unmatched pairs
-        FOR j IN SELECT * FROM unmatched_pairs_temp LOOP
-            temp_1 := j.player_one_id;
-            temp_2 := j.player_two_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'These two players were not paired in the current round.';
+    END IF;
 
-            -- Pick test
-            -- make sure that by pairing two players we aren't leaving other players stranded; i.e.: that all remaining unpaired players will have a partner
-            SELECT COUNT(*) INTO temp_remaining_rows FROM unmatched_pairs_temp upt WHERE upt.player_one_id != temp_1 AND upt.player_two_id != temp_1 AND upt.player_one_id != temp_2 AND upt.player_two_id != temp_2 OR ((upt.player_one_id != temp_1 AND upt.player_two_id IS NULL) AND (upt.player_one_id != temp_2 AND upt.player_two_id IS NULL));
+    IF $3 IS NOT NULL AND EXISTS (
+        SELECT 1
+        FROM matches m
+        WHERE
+            m.tournament_id = $1 AND m.loser IS NOT NULL AND
+            LEAST(m.winner, m.loser) = LEAST($2, $3) AND GREATEST(m.winner, m.loser) = GREATEST($2, $3)
+    ) THEN
+        RAISE EXCEPTION 'These two players have faced each other in this tournament before.';
+    END IF;
 
-            IF temp_remaining_rows > 0 OR matched_pairs = pairs - 1 THEN
-                -- take the players out of the temp table
-                DELETE FROM unmatched_pairs_temp upt WHERE upt.player_one_id = temp_1 OR upt.player_one_id = temp_2 OR upt.player_two_id = temp_1 OR upt.player_two_id = temp_2;
+    -- a second bye is still caught by the one_bye_per_tournament index
+    PERFORM set_config('tournament.skip_match_checks', 'on', true);
 
-                -- add the pair to the round
-                INSERT INTO temp_results (player_one_id, player_one_name, player_two_id, player_two_name) VALUES (temp_1, j.player_one_name, temp_2, j.player_two_name);
+    INSERT INTO matches (winner, loser, tournament_id, is_tie, is_bye, round)
+    VALUES ($2, $3, $1, $4 AND $3 IS NOT NULL, $3 IS NULL, last_round);
 
-                matched_pairs = matched_pairs + 1;
+    PERFORM set_config('tournament.skip_match_checks', 'off', true);
+END
+$BODY$
+LANGUAGE plpgsql;
 
-                -- move to next iteration of the outer loop (i)
-                EXIT;
-            END IF;
+CREATE FUNCTION pair_ranked(tournament int, ids int[], skip int) RETURNS int[]
+AS
+-- pair_ranked() pairs every player in ids (best record first) with an opponent they haven't faced in this tournament
+--     o each player is paired with the highest-ranked remaining player they haven't faced
+--     o if a choice leaves someone further down with no possible opponent, the search backs up and tries the next candidate
+--     o the player at position skip (if not 0) is left out, because they are getting the bye
+-- the result lists the positions in ids of each pair in turn ({1,2,3,5,...}), or is NULL if everyone can't be paired
+-- everything is kept in arrays, so the function never creates or writes to a table
+$BODY$
+DECLARE
+    -- declare variables
+    player_count    int;
+    used            boolean[];
+    chosen          int[]; -- the pairs chosen so far, two positions per pair
+    i               int;
+    j               int;
+
+BEGIN
+    -- set initial values for variables
+    player_count := COALESCE(array_length(ids, 1), 0);
+    used := array_fill(FALSE, ARRAY[player_count + 1]);
+    chosen := '{}';
+    i := 1;
+    j := 1;
+
+    IF skip > 0 THEN
+        used[skip] := TRUE;
+    END IF;
+
+    LOOP
+        -- skip to the best player who hasn't been paired yet
+        WHILE i <= player_count AND used[i] LOOP
+            i := i + 1;
+            j := i;
+        END LOOP;
+
+        IF i > player_count THEN
+            RETURN chosen;
+        END IF;
+
+        -- look for the best remaining opponent player i hasn't faced (a lookup on the one_match_per_pair index)
+        j := GREATEST(j, i) + 1;
+        WHILE j <= player_count AND (used[j] OR EXISTS (
+            SELECT 1
+            FROM matches m
+            WHERE
+                m.tournament_id = $1 AND m.loser IS NOT NULL AND
+                LEAST(m.winner, m.loser) = LEAST(ids[i], ids[j]) AND GREATEST(m.winner, m.loser) = GREATEST(ids[i], ids[j])
+        )) LOOP
+            j := j + 1;
         END LOOP;
+
+        IF j <= player_count THEN
+            used[i] := TRUE;
+            used[j] := TRUE;
+            chosen := chosen || ARRAY[i, j];
+            i := i + 1;
+            j := i;
+        ELSIF COALESCE(array_length(chosen, 1), 0) > 0 THEN
+            -- dead end; undo the last pair and try its next candidate
+            i := chosen[array_length(chosen, 1) - 1];
+            j := chosen[array_length(chosen, 1)];
+            chosen := chosen[1:array_length(chosen, 1) - 2];
+            used[i] := FALSE;
+            used[j] := FALSE;
+        ELSE
+            RETURN NULL;
+        END IF;
     END LOOP;
+END
+$BODY$
+LANGUAGE plpgsql STABLE;
+
+CREATE FUNCTION swiss_pairings(tournament int) RETURNS TABLE (player_one_id int, player_one_name text, player_two_id int, player_two_name text)
+AS
+-- swiss_pairings() generates the set of matched pairs based on:
+--     o which players have already faced each other
+--     o how many players are in a tournament
+--     o whether or not a bye needs to be assigned
+--     o player standings as of the time the function is called
+-- the standings are read once into arrays and paired by pair_ranked(); no temporary tables are used, so any number of
+-- tournaments can be paired at the same time
+$BODY$
+DECLARE
+    -- declare variables
+    ids             int[];
+    names           text[];
+    had_bye         boolean[];
+    player_count    int;
+    pairs           int[];
+    bye             int;
+    k               int;
+
+BEGIN
+    -- set initial values for variables
+    SELECT
+        array_agg(ps.player_id ORDER BY ps.count_wins DESC, ps.omw DESC, ps.player_id),
+        array_agg(ps.player_name ORDER BY ps.count_wins DESC, ps.omw DESC, ps.player_id),
+        array_agg(ps.count_byes > 0 ORDER BY ps.count_wins DESC, ps.omw DESC, ps.player_id)
+    INTO ids, names, had_bye
+    FROM player_standings ps
+    WHERE ps.tournament_id = $1;
 
-    RETURN QUERY SELECT * FROM temp_results;
+    player_count := COALESCE(array_length(ids, 1), 0);
 
-    DROP TABLE unmatched_pairs_temp;
+    IF player_count % 2 = 0 THEN
+        pairs := pair_ranked($1, ids, 0);
+    ELSE
+        -- This tournament has an odd number of players; the bye goes to the lowest-ranked player who hasn't had one, as long
+        -- as everyone else can still be paired
+        FOR k IN REVERSE player_count..1 LOOP
+            IF NOT had_bye[k] THEN
+                pairs := pair_ranked($1, ids, k);
+                IF pairs IS NOT NULL THEN
+                    bye := k;
+                    EXIT;
+                END IF;
+            END IF;
+        END LOOP;
+    END IF;
+
+    IF pairs IS NULL THEN
+        -- no complete round of pairings is possible
+        RETURN;
+    END IF;
+
+    FOR k IN 1..COALESCE(array_length(pairs, 1), 0) / 2 LOOP
+        player_one_id := ids[pairs[2 * k - 1]];
+        player_one_name := names[pairs[2 * k - 1]];
+        player_two_id := ids[pairs[2 * k]];
+        player_two_name := names[pairs[2 * k]];
+        RETURN NEXT;
+    END LOOP;
+
+    IF bye IS NOT NULL THEN
+        -- add the bye to the round
+        player_one_id := ids[bye];
+        player_one_name := names[bye];
+        player_two_id := NULL;
+        player_two_name := NULL;
+        RETURN NEXT;
+    END IF;
 END
 $BODY$
-LANGUAGE plpgsql;
+LANGUAGE plpgsql STABLE;
 
 -- Create Triggers
 CREATE TRIGGER check_for_rematches
@@ -280,3 +721,33 @@ CREATE TRIGGER check_for_winner_equals_loser
     ON matches
     FOR EACH ROW
     EXECUTE PROCEDURE winner_equals_loser();
+
+CREATE TRIGGER keep_standings_current
+    AFTER INSERT OR UPDATE OR DELETE
+    ON matches
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_standings();
+
+CREATE TRIGGER create_tournament_partitions
+    AFTER INSERT
+    ON tournaments
+    FOR EACH ROW
+    EXECUTE PROCEDURE add_tournament_partitions();
+
+CREATE TRIGGER create_standings_row
+    AFTER INSERT
+    ON players
+    FOR EACH ROW
+    EXECUTE PROCEDURE add_standings_row();
+
+CREATE TRIGGER notify_match_changes
+    AFTER INSERT OR UPDATE OR DELETE
+    ON matches
+    FOR EACH ROW
+    EXECUTE PROCEDURE notify_standings_changed();
+
+CREATE TRIGGER notify_player_changes
+    AFTER INSERT OR DELETE
+    ON players
+    FOR EACH ROW
+    EXECUTE PROCEDURE notify_standings_changed();
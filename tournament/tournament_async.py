@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio version of the tournament.py API
+#
+# Every function here mirrors the function of the same name in tournament.py
+# and takes the same arguments, but is a coroutine: one event loop can serve
+# many tournaments at once instead of tying up a thread per request.
+#
+# This module needs Python 3.7+ and the asyncpg driver, and keeps its own
+# connection pool. Input checks, pairing and the standings cache are shared
+# with tournament.py, so both APIs accept the same input, return the same
+# results and error messages, and keep the same cache up to date. Errors
+# raised by the database (e.g.: a rematch) come back as asyncpg exceptions
+# rather than psycopg2 ones. The SQL of the statements run most often is
+# tournament._STATEMENTS too, which asyncpg prepares on each connection.
+#
+# Only PostgreSQL is supported (tournament.useBackend() has no effect here),
+# and these parts of tournament.py have no coroutine version, so use them
+# from a thread if needed: the results journal (useJournal()), snapshots
+# (exportSnapshot() and importSnapshot()), listening for standings changes
+# (listenForStandingsChanges() and feed.py), and the metrics sinks, which
+# don't see the calls made here. iterStandings() and iterPairings() are
+# coroutines that return asynchronous iterators:
+#
+#   async for row in await iterStandings(tournament_id):
+#       ...
+#
+
+import asyncio
+import contextlib
+import contextvars
+
+import asyncpg
+
+# the sync module is imported under another name, since most functions here
+# take an argument called tournament
+import tournament as _sync
+from tournament import (
+    _batches, _cache_generation, _cache_get, _cache_put, _check_match,
+    _check_pairing_mode, _check_registrant, _check_registrants,
+    _check_tiebreaks, _check_tournament, _round_arrays, invalidateStandings,
+    pairPlayers, pairPlayersByMatching)
+from pairing_state import syncPairingState
+
+
+# connection settings; change these with configure()
+DSN = 'postgresql:///tournament'
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 10
+# connections idle in the pool for longer than this many seconds are closed
+# (and replaced when needed) rather than risk handing out a dead one
+MAX_IDLE_TIME = 300
+
+_pool = None
+# the session (if any) of the task that is running
+_session = contextvars.ContextVar('tournament_session', default=None)
+
+
+async def configure(dsn=None, min_connections=None, max_connections=None,
+                    max_idle_time=None):
+    """Change the database connection settings.
+
+    Any existing connection pool is closed; a new one is created with the
+    new settings the next time a connection is needed.
+
+    Args:
+      dsn: the connection URI (e.g. "postgresql://db/tournament")
+      min_connections: number of connections the pool keeps open
+      max_connections: most connections the pool will open at once
+      max_idle_time: seconds a connection may sit idle before it is closed
+    """
+    global DSN, MIN_CONNECTIONS, MAX_CONNECTIONS, MAX_IDLE_TIME
+
+    if (dsn is not None):
+        DSN = dsn
+    if (min_connections is not None):
+        MIN_CONNECTIONS = min_connections
+    if (max_connections is not None):
+        MAX_CONNECTIONS = max_connections
+    if (max_idle_time is not None):
+        MAX_IDLE_TIME = max_idle_time
+
+    await closePool()
+
+
+async def closePool():
+    """Close every connection in the pool (e.g.: when shutting down)."""
+    global _pool
+
+    if (_pool is not None):
+        pool = _pool
+        _pool = None
+        await pool.close()
+
+
+async def _get_pool():
+    """Returns the connection pool, creating it on first use."""
+    global _pool
+
+    if (_pool is None):
+        _pool = await asyncpg.create_pool(
+            DSN, min_size=MIN_CONNECTIONS, max_size=MAX_CONNECTIONS,
+            max_inactive_connection_lifetime=MAX_IDLE_TIME)
+    return _pool
+
+
+class Session(object):
+    """A unit of work: one pooled connection and one transaction.
+
+    The asyncio counterpart of tournament.Session; use it through
+    session():
+
+        async with session():
+            await registerPlayer("Chandra Nalaar", tournament_id)
+            await registerPlayer("Markov Chaney", tournament_id)
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.touched = set()  # tournaments changed in this transaction
+
+    def touch(self, tournament):
+        """Notes that a tournament's standings change in this transaction.
+
+        A tournament of 0 (or None) means every tournament.
+        """
+        self.touched.add(tournament or 0)
+
+    def touches(self, tournament):
+        """Returns True if this transaction changed a tournament."""
+        return 0 in self.touched or tournament in self.touched
+
+
+@contextlib.asynccontextmanager
+async def session():
+    """Run several tournament functions on one connection and transaction.
+
+    Sessions may be nested; the inner ones just join the outer session, so
+    only the outermost one commits.
+    """
+    current = _session.get()
+    if (current is not None):
+        yield current
+        return
+
+    pool = await _get_pool()
+    async with pool.acquire() as conn:
+        current = Session(conn)
+        token = _session.set(current)
+        try:
+            async with conn.transaction():
+                yield current
+                if (current.touched and _sync._notify_changes):
+                    # NOTIFY is only delivered when the transaction commits
+                    for changed in current.touched:
+                        await conn.execute(
+                            'SELECT pg_notify($1, $2)',
+                            _sync.STANDINGS_CHANNEL, str(changed))
+            # only drop cached standings once the change is visible to others
+            for changed in current.touched:
+                invalidateStandings(changed)
+        finally:
+            _session.reset(token)
+
+
+def _sql(name):
+    """Returns the SQL of one of the statements in tournament._STATEMENTS,
+    whose $n parameters asyncpg takes as they are."""
+    return _sync._STATEMENTS[name][1]
+
+
+async def _iterate(rows):
+    """Yields the rows of a list, as an asynchronous iterator."""
+    for row in rows:
+        yield row
+
+
+async def _stream_rows(sql, args, fetch_size=None):
+    """Yields the rows of a query, reading fetch_size (default FETCH_SIZE)
+    at a time.
+
+    Outside a session the rows are read on a pooled connection of their
+    own, rather than in a session, since the caller may do other work with
+    the iterator only part read.
+    """
+    prefetch = fetch_size or _sync.FETCH_SIZE
+
+    current = _session.get()
+    if (current is not None):
+        async for row in current.conn.cursor(sql, *args, prefetch=prefetch):
+            yield tuple(row)
+        return
+
+    pool = await _get_pool()
+    async with pool.acquire() as conn:
+        # a cursor only lives as long as its transaction
+        async with conn.transaction():
+            async for row in conn.cursor(sql, *args, prefetch=prefetch):
+                yield tuple(row)
+
+
+def _touch(changed):
+    """Marks a tournament's standings as changed by the current session.
+
+    Must be called inside a session() block.
+    """
+    _session.get().touch(changed)
+
+
+async def deleteMatches(tournament=0):
+    """Remove all the match records from the database.
+
+    Args:
+      tournament: the ID of the tournament for which to delete matches; if 0,
+                    delete all matches in all tournaments
+    """
+    sql = 'DELETE FROM matches'
+    # the rounds of pairings handed out for the deleted results go with them
+    rounds_sql = 'DELETE FROM rounds'
+    data = ()
+
+    if (type(tournament) is int and tournament != 0):
+        # only delete the matches in that tournament
+        sql += ' WHERE tournament_id = $1'
+        rounds_sql += ' WHERE tournament_id = $1'
+        data = (tournament,)
+    else:
+        tournament = 0
+
+    async with session() as current:
+        await current.conn.execute(sql, *data)
+        await current.conn.execute(rounds_sql, *data)
+        _touch(tournament)
+
+
+async def deletePlayers():
+    """Remove all the player records from the database."""
+    async with session() as current:
+        await current.conn.execute('DELETE FROM registrants')
+        _touch(0)
+
+
+async def createTournament(t_name):
+    """Adds a tournament (with its own partitions) to the database.
+
+    Returns:
+      The ID of the new tournament
+    """
+    if (_session.get() is None):
+        # the partitions are attached in a short transaction of their own;
+        # see tournament.createTournament
+        pool = await _get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                tournament_id = await conn.fetchval(
+                    "SELECT nextval('tournaments_id_seq')")
+                await conn.execute('SELECT create_tournament_partitions($1)',
+                                   tournament_id)
+        async with session() as current:
+            await current.conn.execute(
+                'INSERT INTO tournaments (id, name) VALUES ($1, $2)',
+                tournament_id, t_name)
+        return tournament_id
+
+    async with session() as current:
+        tournament_id = await current.conn.fetchval(
+            'INSERT INTO tournaments (name) VALUES ($1) RETURNING id', t_name)
+
+    return tournament_id
+
+
+async def deleteTournament(tournament=0):
+    """Remove one or all tournaments (and their matches) from the database;
+    see tournament.deleteTournament.
+
+    Args:
+      tournament: the ID of the tournament to be deleted; if 0, delete all
+    """
+    partitions_sql = 'SELECT drop_tournament_partitions(id) FROM tournaments'
+    clear_sql = 'SELECT c.* FROM tournaments t, '
+    clear_sql += 'clear_tournament_partitions(t.id) c'
+    sql = 'DELETE FROM tournaments'
+    data = ()
+
+    if (type(tournament) is int and tournament != 0):
+        partitions_sql += ' WHERE id = $1'
+        clear_sql += ' WHERE t.id = $1'
+        sql += ' WHERE id = $1'
+        data = (tournament,)
+    else:
+        tournament = 0
+
+    if (_session.get() is not None):
+        # a concurrent detach can't run inside the session's transaction
+        async with session() as current:
+            await current.conn.execute(partitions_sql, *data)
+            await current.conn.execute(sql, *data)
+            _touch(tournament)
+        return
+
+    async with session() as current:
+        partitions = await current.conn.fetch(clear_sql, *data)
+
+    if (partitions):
+        pool = await _get_pool()
+        # outside a transaction, so CONCURRENTLY is allowed
+        async with pool.acquire() as conn:
+            for (parent, partition, detach_pending) in partitions:
+                how = 'FINALIZE' if detach_pending else 'CONCURRENTLY'
+                # the names come from the database, already quoted
+                await conn.execute('ALTER TABLE %s DETACH PARTITION %s %s'
+                                   % (parent, partition, how))
+                await conn.execute('DROP TABLE %s' % partition)
+
+    async with session() as current:
+        await current.conn.execute(sql, *data)
+        _touch(tournament)
+
+
+async def countPlayers(tournament=None):
+    """Returns the number of players, in one tournament or in all of them."""
+    async with session() as current:
+        if (tournament is not None):
+            return await current.conn.fetchval(
+                _sql('tournament_count_players'), tournament)
+        return await current.conn.fetchval(
+            _sql('tournament_count_all_players'))
+
+
+async def registerPlayer(p_name, tournament=None):
+    """Adds a player to the database, and optionally to a tournament."""
+    async with session() as current:
+        new_player = await current.conn.fetchval(
+            'INSERT INTO registrants (name) VALUES ($1) RETURNING id', p_name)
+
+        if (tournament and type(tournament) is int):
+            await current.conn.execute(
+                'INSERT INTO players (tournament_id, registrant_id) '
+                'VALUES ($1, $2)', tournament, new_player)
+            _touch(tournament)
+
+
+async def registerPlayers(p_names, tournament=None):
+    """Adds many players at once, in one transaction.
+
+    Returns:
+      A list of the new IDs in the same order as the names: player IDs if a
+      tournament was given, otherwise registrant IDs
+    """
+    registrants_sql = '''
+        INSERT INTO registrants (name)
+        SELECT name FROM unnest($1::text[]) WITH ORDINALITY AS n (name, pos)
+        ORDER BY pos
+        RETURNING id
+    '''
+    players_sql = '''
+        WITH new_registrants AS (
+            INSERT INTO registrants (name)
+            SELECT name
+            FROM unnest($1::text[]) WITH ORDINALITY AS n (name, pos)
+            ORDER BY pos
+            RETURNING id
+        )
+        INSERT INTO players (tournament_id, registrant_id)
+        SELECT $2, id FROM new_registrants ORDER BY id
+        RETURNING id
+    '''
+    new_ids = []
+
+    async with session() as current:
+        for batch in _batches(p_names):
+            if (tournament and type(tournament) is int):
+                rows = await current.conn.fetch(players_sql, batch,
+                                                tournament)
+                _touch(tournament)
+            else:
+                rows = await current.conn.fetch(registrants_sql, batch)
+            new_ids.extend(sorted(row[0] for row in rows))
+
+    return new_ids
+
+
+async def assignPlayer(registrant, tournament):
+    """Assigns a registrant to a tournament."""
+    err_msg = _check_registrant(registrant, tournament)
+    if (err_msg):
+        return err_msg
+
+    async with session() as current:
+        await current.conn.execute(
+            'INSERT INTO players (tournament_id, registrant_id) '
+            'VALUES ($1, $2)', tournament, registrant)
+        _touch(tournament)
+
+
+async def assignPlayers(registrants, tournament):
+    """Assigns many existing registrants to a tournament at once.
+
+    Returns:
+      A list of the new player IDs in the same order as the registrants
+    """
+    registrants = list(registrants)
+    err_msg = _check_registrants(registrants, tournament)
+    if (err_msg):
+        return err_msg
+
+    sql = '''
+        INSERT INTO players (tournament_id, registrant_id)
+        SELECT $1, registrant_id
+        FROM unnest($2::int[]) WITH ORDINALITY AS r (registrant_id, pos)
+        ORDER BY pos
+        RETURNING id
+    '''
+    new_ids = []
+
+    async with session() as current:
+        for batch in _batches(registrants):
+            rows = await current.conn.fetch(sql, tournament, batch)
+            new_ids.extend(sorted(row[0] for row in rows))
+        _touch(tournament)
+
+    return new_ids
+
+
+async def unAssignPlayer(registrant, tournament):
+    """Removes a registrant from a tournament."""
+    err_msg = _check_registrant(registrant, tournament)
+    if (err_msg):
+        return err_msg
+
+    async with session() as current:
+        await current.conn.execute(
+            'DELETE FROM players WHERE tournament_id = $1 '
+            'AND registrant_id = $2', tournament, registrant)
+        _touch(tournament)
+
+
+async def playerStandings(tournament, tiebreaks=None, cached=True):
+    """Returns the standings as a list of (id, name, wins, matches, omw);
+    see tournament.playerStandings."""
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+
+    if (tiebreaks is None):
+        tiebreaks = _sync.TIEBREAK_ORDER
+    err_msg = _check_tiebreaks(tiebreaks)
+    if (err_msg):
+        return err_msg
+
+    if (tuple(tiebreaks) != ('omw',)):
+        return await _rank_by_tiebreaks(tournament, tiebreaks)
+
+    current = _session.get()
+    use_cache = cached and (current is None or
+                            not current.touches(tournament))
+
+    if (use_cache):
+        player_list = _cache_get(tournament)
+        if (player_list is not None):
+            return list(player_list)
+        generation = _cache_generation(tournament)
+
+    async with session() as current:
+        rows = await current.conn.fetch(_sql('tournament_standings'),
+                                        tournament)
+
+    player_list = [tuple(row) for row in rows]
+
+    if (use_cache):
+        _cache_put(tournament, list(player_list), generation)
+
+    return player_list
+
+
+async def iterStandings(tournament, fetch_size=None):
+    """Returns the standings like playerStandings(), as an asynchronous
+    iterator that reads them a few rows at a time; see
+    tournament.iterStandings."""
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+
+    # cached standings are already in memory
+    current = _session.get()
+    if (current is None or not current.touches(tournament)):
+        player_list = _cache_get(tournament)
+        if (player_list is not None):
+            return _iterate(list(player_list))
+
+    return _stream_rows(_sql('tournament_standings'), (tournament,),
+                        fetch_size)
+
+
+async def _rank_by_tiebreaks(tournament, tiebreaks):
+    """Returns playerStandings() re-sorted by the given tiebreaks."""
+    import tiebreak  # needs NumPy, so only imported when it is used
+
+    # read the standings and the matches from the same transaction
+    async with session() as current:
+        standings = await playerStandings(tournament, ('omw',))
+        rows = await current.conn.fetch(_sql('tournament_match_rows'),
+                                        tournament)
+
+    positions, scores = tiebreak.rankPlayers(
+        [row[0] for row in standings], [tuple(row) for row in rows],
+        tiebreaks)
+    return [standings[i] for i in positions]
+
+
+async def reportMatch(winner, loser, tournament, is_tie=False):
+    """Records the outcome of a single match; a loser of 0 is a bye."""
+    err_msg = _check_match(winner, loser, tournament, is_tie)
+    if (err_msg):
+        return err_msg
+
+    async with session() as current:
+        # checked against the stored round, if any; see tournament.reportMatch
+        await current.conn.execute(
+            _sql('tournament_report_match'), tournament, winner,
+            loser or None, is_tie)
+        _touch(tournament)
+
+
+async def reportRound(tournament, results):
+    """Records every result of a round at once; see tournament.reportRound.
+    """
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+    err_msg, winners, losers, ties = _round_arrays(tournament, results)
+    if (err_msg):
+        return err_msg
+
+    if (not winners):
+        return
+
+    async with session() as current:
+        await current.conn.execute(
+            'SELECT report_round($1, $2, $3::int[], $4)',
+            tournament, winners, losers, ties)
+        _touch(tournament)
+
+
+async def swissPairings(tournament, mode='backtrack'):
+    """Returns the next round's pairings; see tournament.swissPairings.
+
+    Pairing in Python runs in the event loop's default executor, so a large
+    field doesn't hold up other requests while it is being paired.
+    """
+    err_msg = _check_pairing_mode(tournament, mode)
+    if (err_msg):
+        return err_msg
+
+    if (mode == 'database'):
+        async with session() as current:
+            rows = await current.conn.fetch(
+                _sql('tournament_swiss_pairings'), tournament)
+        return [tuple(row) for row in rows]
+
+    standings, played, had_bye = await _load_pairing_state(tournament)
+
+    engine = pairPlayersByMatching if mode == 'matching' else pairPlayers
+    loop = asyncio.get_running_loop()
+    pair_list = await loop.run_in_executor(None, engine, standings, played,
+                                           had_bye)
+    if (pair_list is None):
+        return 'No complete round of pairings is possible.'
+    return pair_list
+
+
+async def iterPairings(tournament, mode='backtrack', fetch_size=None):
+    """Returns the pairings like swissPairings(), as an asynchronous
+    iterator; see tournament.iterPairings."""
+    err_msg = _check_pairing_mode(tournament, mode)
+    if (err_msg):
+        return err_msg
+
+    if (mode != 'database'):
+        pair_list = await swissPairings(tournament, mode)
+        if (type(pair_list) is not list):
+            return pair_list  # no complete round is possible
+        return _iterate(pair_list)
+
+    return _stream_rows(_sql('tournament_swiss_pairings'), (tournament,),
+                        fetch_size)
+
+
+async def pairAll(tournament_ids, mode='backtrack'):
+    """Pairs the next round of many tournaments at once, and stores the
+    pairings; see tournament.pairAll.
+
+    The tournaments are paired on tournament.py's pool of worker processes,
+    waited on from the event loop's default executor.
+    """
+    tournament_ids = list(tournament_ids)
+
+    for tournament in tournament_ids:
+        err_msg = _check_pairing_mode(tournament, mode)
+        if (err_msg):
+            return err_msg
+
+    loop = asyncio.get_running_loop()
+    if (len(tournament_ids) > 1 and _sync.PAIRING_PROCESSES != 1):
+        # started before a connection is taken; see tournament.pairAll
+        await loop.run_in_executor(None, _sync._get_worker_pool)
+
+    async with session() as current:
+        conn = current.conn
+        # rounds in progress are served from storage; everything else is
+        # paired now, while the tournaments are locked
+        await conn.execute(_sql('tournament_lock_tournaments'),
+                           tournament_ids)
+        pairings = _sync._open_rounds_from_rows(await conn.fetch(
+            _sql('tournament_open_rounds'), tournament_ids))
+        to_pair = [t for t in tournament_ids if t not in pairings]
+
+        states = {}
+        if (to_pair):
+            states = _sync._pairing_states_from_rows(
+                to_pair,
+                await conn.fetch(_sql('tournament_pairing_standings'),
+                                 to_pair),
+                await conn.fetch(_sql('tournament_played_pairs'), to_pair))
+        tasks = [states[tournament] + (mode,) for tournament in to_pair]
+
+        if (len(tasks) > 1 and _sync.PAIRING_PROCESSES != 1):
+            results = await loop.run_in_executor(
+                None, _sync._get_worker_pool().map, _sync._pair_state, tasks)
+        else:
+            results = [await loop.run_in_executor(None, _sync._pair_state,
+                                                  task) for task in tasks]
+
+        paired = {}
+        for (tournament, pair_list) in zip(to_pair, results):
+            if (pair_list is None):
+                pairings[tournament] = ('No complete round of pairings is '
+                                        'possible.')
+            else:
+                pairings[tournament] = pair_list
+                if (pair_list):
+                    paired[tournament] = pair_list
+
+        if (paired):
+            await conn.fetch(_sql('tournament_store_pairings'),
+                             *_sync._pairing_arrays(paired))
+
+    return pairings
+
+
+async def startRound(tournament, mode='backtrack'):
+    """Pairs the next round of a tournament, and stores it; see
+    tournament.startRound."""
+    err_msg = _check_pairing_mode(tournament, mode)
+    if (err_msg):
+        return err_msg
+
+    return (await pairAll([tournament], mode))[tournament]
+
+
+async def currentRound(tournament):
+    """Returns the number of the latest stored round of a tournament, from
+    1, or 0 if no round has been stored."""
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+
+    async with session() as current:
+        return await current.conn.fetchval(_sql('tournament_current_round'),
+                                           tournament)
+
+
+async def roundPairings(tournament, round_number=None):
+    """Returns the stored pairs of one round of a tournament (the latest if
+    round_number is None); see tournament.roundPairings."""
+    err_msg = _check_tournament(tournament)
+    if (err_msg):
+        return err_msg
+    if (round_number is not None and type(round_number) is not int):
+        return 'Round is invalid (must be a number).'
+
+    async with session() as current:
+        rows = await current.conn.fetch(_sql('tournament_round_pairings'),
+                                        tournament, round_number)
+    return [tuple(row) for row in rows]
+
+
+async def _load_pairing_state(tournament):
+    """Reads everything pairing needs for a tournament; the coroutine
+    version of tournament._load_pairing_state, keeping its PairingStates in
+    the same place.
+
+    Returns:
+      A tuple of (standings, played, had_bye)
+    """
+    state = _sync._take_pairing_state(tournament)
+
+    async with session() as current:
+        conn = current.conn
+        counts = await conn.fetchrow(_sql('tournament_pairing_counts'),
+                                     tournament)
+        steps = syncPairingState(state, tuple(counts))
+        step, value = next(steps)
+        while (step != 'done'):
+            if (step == 'players'):
+                found = await conn.fetch(_sql('tournament_pairing_players'),
+                                         tournament)
+            else:
+                found = await conn.fetch(_sql('tournament_pairing_matches'),
+                                         tournament, value)
+            step, value = steps.send(found)
+
+    state, matches = value
+    return _sync._keep_pairing_state(tournament, state,
+                                     [tuple(row) for row in matches])
@@ -2,7 +2,18 @@
 #
 # Test cases for tournament.py
 
+import os
+import sys
+import tempfile
+import time
+
 from tournament import *
+from feed import StandingsFeed, applyDiff
+import journal
+import metrics
+import pairing_state
+import snapshot
+import tournament
 
 
 def testDeleteMatches():
@@ -17,6 +28,57 @@ def testDelete():
     print "2. Player records can be deleted."
 
 
+def testPartitionLocks():
+    """
+    Outside a session, creating a tournament shouldn't leave other
+    tournaments waiting; inside one, their writes wait until it ends.
+    """
+    if '--memory' in sys.argv[1:]:
+        print "    2a. (Partition locks need PostgreSQL; skipped.)"
+        return
+    import psycopg2
+
+    busy = createTournament("Busy Tournament")
+    registrant = registerPlayers(["Waiting Player"])[0]
+    other = connect()  # a connection of its own, as another process has
+    try:
+        cursor = other.cursor()
+        cursor.execute("SET lock_timeout = '2s'")
+        other.commit()
+
+        def registerElsewhere():
+            """Returns False if registering a player in another tournament
+            had to wait for a lock."""
+            try:
+                cursor.execute("INSERT INTO players (tournament_id, "
+                               "registrant_id) VALUES (%s, %s)",
+                               (busy, registrant))
+                return True
+            except psycopg2.OperationalError:
+                return False
+            finally:
+                other.rollback()
+
+        createTournament("Quick Tournament")
+        if not registerElsewhere():
+            raise ValueError("Outside a session, createTournament() should "
+                             "not hold up other tournaments.")
+        with session():
+            createTournament("Slow Tournament")
+            waited = not registerElsewhere()
+        if not waited:
+            raise ValueError("Inside a session, other tournaments should "
+                             "wait for createTournament() to commit.")
+        if not registerElsewhere():
+            raise ValueError("Other tournaments should carry on once the "
+                             "session ends.")
+    finally:
+        other.close()
+    deleteTournament()
+    deletePlayers()
+    print "    2a. Creating a tournament only blocks others inside a session."
+
+
 def testCount():
     deleteMatches()
     deletePlayers()
@@ -30,6 +92,43 @@ def testCount():
     print "3. After deleting, countPlayers() returns zero."
 
 
+def testMetrics():
+    """
+    Calls should be timed once a metrics sink is added, and not after it
+    is removed.
+    """
+    sink = metrics.HistogramSink()
+    addMetricsSink(sink)
+    try:
+        countPlayers()
+    finally:
+        removeMetricsSink(sink)
+    countPlayers()
+    histograms, counters = sink.snapshot()
+    if sum(histograms.get('countPlayers', [[0]])[0]) != 1:
+        raise ValueError("A metrics sink should time each call once.")
+    print "    3a. Calls can be timed with a metrics sink."
+
+    # the Prometheus file is written by the sink's thread, not by the calls
+    path = os.path.join(tempfile.mkdtemp(), 'tournament.prom')
+    sink = metrics.PrometheusFileSink(path, interval=0.5)
+    addMetricsSink(sink)
+    try:
+        countPlayers()
+        if os.path.exists(path):
+            raise ValueError("A call should not write the metrics file.")
+        deadline = time.time() + 5
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        removeMetricsSink(sink)
+        sink.close()
+    with open(path) as f:
+        if 'name="countPlayers"' not in f.read():
+            raise ValueError("The metrics file should hold every timing.")
+    print "    3b. The Prometheus file is written in the background."
+
+
 def testRegister():
     deleteMatches()
     deletePlayers()
@@ -43,6 +142,48 @@ def testRegister():
     print "4. After registering a player, countPlayers() returns 1."
 
 
+def testSessionRollback():
+    """
+    Everything done inside a session should be undone if it fails.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament("Breakfast of Champions")
+    try:
+        with session():
+            registerPlayer("Chandra Nalaar", tournament_id)
+            registerPlayer("Markov Chaney", tournament_id)
+            registerPlayer("Joe Malik", tournament_id + 1)
+    except psycopg2.IntegrityError:
+        pass
+    c = countPlayers()
+    if c != 0:
+        raise ValueError(
+            "A failed session should not leave any players registered.")
+    with session():
+        registerPlayer("Chandra Nalaar", tournament_id)
+        registerPlayer("Markov Chaney", tournament_id)
+    c = countPlayers(tournament_id)
+    if c != 2:
+        raise ValueError(
+            "After a session registers two players, countPlayers() "
+            "should be 2.")
+    standings = playerStandings(tournament_id)
+    [id1, id2] = [row[0] for row in standings]
+    try:
+        with session():
+            reportMatch(id1, id2, tournament_id)
+            registerPlayer("Joe Malik", tournament_id)
+            reportMatch(id2, id1, tournament_id)
+    except psycopg2.InternalError:
+        pass
+    if playerStandings(tournament_id) != standings:
+        raise ValueError(
+            "A failed session should not leave any matches recorded.")
+    print "    4a. Sessions commit or roll back as a single unit."
+
+
 def testRegisterCountDelete():
     deleteMatches()
     deletePlayers()
@@ -63,6 +204,41 @@ def testRegisterCountDelete():
     print "5. Players can be registered and deleted."
 
 
+def testBulkRegister():
+    """
+    registerPlayers() and assignPlayers() should return new IDs in order.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('Ship of Fools')
+    names = ["Markov Chaney", "Joe Malik", "Mao Tsu-hsi", "Atlanta Hope"]
+    player_ids = registerPlayers(names, tournament_id)
+    if len(player_ids) != 4 or countPlayers(tournament_id) != 4:
+        raise ValueError(
+            "After registering four players in bulk, countPlayers should "
+            "be 4.")
+    standings = playerStandings(tournament_id)
+    standings = dict((row[0], row[1]) for row in standings)
+    if [standings[i] for i in player_ids] != names:
+        raise ValueError(
+            "registerPlayers() should return player IDs in input order.")
+    registrant_ids = registerPlayers(["Bruno Walton", "Boots O'Neal"])
+    second_id = createTournament('Ship of Fools II')
+    new_ids = assignPlayers(registrant_ids, second_id)
+    if len(new_ids) != 2 or countPlayers(second_id) != 2:
+        raise ValueError(
+            "assignPlayers() should add every registrant to the tournament.")
+    [hagbard] = registerPlayers(["Hagbard Celine"])
+    err_msg = assignPlayers([hagbard, 'Hagbard'], second_id)
+    if err_msg != 'Every registrant must be a number.' or \
+            countPlayers(second_id) != 2:
+        raise ValueError(
+            "assignPlayers() should turn down a batch with an invalid "
+            "registrant without assigning any of it.")
+    print "    5a. Players can be registered and assigned in bulk."
+
+
 def testStandingsBeforeMatches():
     """
     Test modified to include Opponent Match Wins in standings list
@@ -188,6 +364,370 @@ def testReportMatchesNoRematch():
     print "    7b. System prevents rematches."
 
 
+def testReportRound():
+    """
+    A whole round can be reported at once, and an invalid result rejects
+    the entire round.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Redux.2')
+    registerPlayer("Bruno Walton", tournament_id)
+    registerPlayer("Boots O'Neal", tournament_id)
+    registerPlayer("Cathy Burton", tournament_id)
+    registerPlayer("Diane Grant", tournament_id)
+    registerPlayer("Purple Dinosaur", tournament_id)
+    standings = playerStandings(tournament_id)
+    [id1, id2, id3, id4, id5] = [row[0] for row in standings]
+    reportRound(tournament_id, [(id1, id2), (id3, id4, True), (id5, 0)])
+    standings = playerStandings(tournament_id)
+    for (i, n, w, m, o) in standings:
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id5) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+    err = ''
+    try:
+        reportRound(tournament_id, [(id3, id5), (id2, id1)])
+    except psycopg2.InternalError as e:
+        err = e
+    if 'faced each other' not in str(err):
+        raise ValueError("System did not prevent a rematch in a round.")
+    standings = playerStandings(tournament_id)
+    if [row for row in standings if row[3] != 1]:
+        raise ValueError("A rejected round should not record any matches.")
+    print "    7c. A whole round can be reported at once."
+
+
+def testStandingsCache():
+    """
+    Cached standings should never hide a result that has been reported.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Again')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant"], tournament_id)
+    standings = playerStandings(tournament_id)
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    if playerStandings(tournament_id) != standings:
+        raise ValueError("Reading the standings twice should give the same "
+                         "result.")
+    reportMatch(id1, id2, tournament_id)
+    standings = playerStandings(tournament_id)
+    if [row[3] for row in standings if row[0] == id1] != [1]:
+        raise ValueError(
+            "Standings should include a match reported after they were "
+            "last read.")
+    try:
+        with session():
+            reportMatch(id3, id4, tournament_id)
+            standings = playerStandings(tournament_id)
+            if [row[3] for row in standings if row[0] == id3] != [1]:
+                raise ValueError(
+                    "Standings read in a session should include the "
+                    "session's own results.")
+            raise RuntimeError("Undo the session.")
+    except RuntimeError:
+        pass
+    standings = playerStandings(tournament_id)
+    if [row[3] for row in standings if row[0] == id3] != [0]:
+        raise ValueError(
+            "Standings should not include results that were rolled back.")
+    print "    7d. Cached standings stay current as results are reported."
+
+
+def testTiebreaks():
+    """
+    Standings can break ties with other scores than omw.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Tiebreak')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant"], tournament_id)
+    standings = playerStandings(tournament_id)
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportRound(tournament_id, [(id1, id2), (id3, id4, True)])
+    standings = playerStandings(tournament_id)
+    if [row[0] for row in standings] != [id1, id2, id3, id4]:
+        raise ValueError(
+            "By default, players with the same wins should be ranked by "
+            "omw.")
+    standings = playerStandings(tournament_id, ['score', 'omw'])
+    if [row[0] for row in standings] != [id1, id3, id4, id2]:
+        raise ValueError(
+            "Ranked by score, a tie should count for more than a loss.")
+
+    # a tie is still a tie once the player it was against has left
+    registrants = registerPlayers(["Ellen Ames", "Felix Moore",
+                                   "Gina Lowe", "Hank Ruiz"])
+    tournament_id = createTournament('High Noon Walkout')
+    [id1, id2, id3, id4] = assignPlayers(registrants, tournament_id)
+    reportRound(tournament_id, [(id1, id2, True), (id3, id4)])
+    unAssignPlayer(registrants[1], tournament_id)
+    standings = playerStandings(tournament_id, ['score'])
+    if [row[0] for row in standings] != [id3, id1, id4]:
+        raise ValueError(
+            "A tie against a player who has left should not count as a "
+            "win.")
+    print "    7e. Standings can use other tiebreaks."
+
+
+def testStreaming():
+    """
+    The streaming functions should give the same rows as the list ones.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Live')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant", "Purple Dinosaur"], tournament_id)
+    standings = playerStandings(tournament_id)
+    [id1, id2, id3, id4, id5] = [row[0] for row in standings]
+    reportRound(tournament_id, [(id1, id2), (id3, id4), (id5, 0)])
+    invalidateStandings(tournament_id)
+    if list(iterStandings(tournament_id, fetch_size=2)) != \
+            playerStandings(tournament_id):
+        raise ValueError(
+            "iterStandings() should give the same rows as playerStandings().")
+    pairings = list(iterPairings(tournament_id, 'database', fetch_size=2))
+    if pairings != swissPairings(tournament_id, 'database'):
+        raise ValueError(
+            "iterPairings() should give the same pairs as swissPairings().")
+    print "    7f. Standings and pairings can be streamed."
+
+
+def testPairAll():
+    """
+    pairAll() should pair every tournament as swissPairings() would.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_ids = [createTournament('Heat %s' % i) for i in range(3)]
+    for tournament_id in tournament_ids:
+        registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                         "Diane Grant"], tournament_id)
+        [id1, id2, id3, id4] = [row[0] for row in
+                                playerStandings(tournament_id)]
+        reportRound(tournament_id, [(id1, id2), (id3, id4)])
+    expected = dict((tournament_id, swissPairings(tournament_id))
+                    for tournament_id in tournament_ids)
+    if pairAll(tournament_ids) != expected:
+        raise ValueError(
+            "pairAll() should give the same pairs as swissPairings().")
+    if pairAll(['1']) != 'Tournament is invalid (must be a number).':
+        raise ValueError("pairAll() should reject an invalid tournament.")
+    print "    7g. Many tournaments can be paired at once."
+
+
+def testStoredRounds():
+    """
+    A round is paired once and stored, and only its pairs can be reported.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Rounds')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant", "Purple Dinosaur"], tournament_id)
+    if currentRound(tournament_id) != 0 or roundPairings(tournament_id):
+        raise ValueError("A new tournament should have no stored rounds.")
+    pairings = startRound(tournament_id)
+    if len(pairings) != 3 or currentRound(tournament_id) != 1:
+        raise ValueError("startRound() should store the first round.")
+    if startRound(tournament_id, 'matching') != pairings or \
+            roundPairings(tournament_id) != pairings:
+        raise ValueError("A round in progress should come from storage.")
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4),
+     (pid5, pname5, pid6, pname6)] = pairings
+    err = ''
+    try:
+        reportMatch(pid1, pid3, tournament_id)
+    except psycopg2.InternalError as e:
+        err = e
+    if 'not paired' not in str(err):
+        raise ValueError("Only the stored pairs should be reportable.")
+    reportMatch(pid2, pid1, tournament_id)
+    reportRound(tournament_id, [(pid3, pid4, True), (pid5, 0)])
+    second = startRound(tournament_id)
+    if currentRound(tournament_id) != 2 or second == pairings:
+        raise ValueError("Once every result is in, a new round is paired.")
+    if roundPairings(tournament_id, 1) != pairings:
+        raise ValueError("Earlier rounds should stay stored.")
+    print "    7h. Rounds are paired once, stored and checked."
+
+
+def testSnapshot():
+    """
+    A tournament saved to a snapshot should load back exactly as it was.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Archive')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant", "Purple Dinosaur"], tournament_id)
+    pairings = startRound(tournament_id)
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4),
+     (pid5, pname5, pid6, pname6)] = pairings
+    reportRound(tournament_id, [(pid1, pid2), (pid3, pid4, True)])
+    standings = playerStandings(tournament_id)
+    fd, path = tempfile.mkstemp(suffix='.snap')
+    os.close(fd)
+    try:
+        exportSnapshot(tournament_id, path)
+        deleteTournament(tournament_id)
+        if importSnapshot(path) != tournament_id:
+            raise ValueError("importSnapshot() should keep the tournament ID.")
+    finally:
+        os.remove(path)
+    if playerStandings(tournament_id) != standings:
+        raise ValueError("A loaded snapshot should have the same standings.")
+    if startRound(tournament_id) != pairings:
+        raise ValueError("A loaded snapshot should keep its stored rounds.")
+    reportMatch(pid5, 0, tournament_id)
+    print "    7i. Tournaments can be saved to and loaded from snapshots."
+
+
+def testJournal():
+    """
+    Journaled results should reach the database once each, even if they
+    were still waiting when the program stopped.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Journal')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant"], tournament_id)
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings(tournament_id)]
+    fd, path = tempfile.mkstemp(suffix='.journal')
+    os.close(fd)
+
+    def database_down(results):
+        raise psycopg2.OperationalError('could not connect to server')
+
+    try:
+        # results taken while the database is down stay in the file
+        journal.logger.disabled = True  # the failures are expected
+        offline = journal.ResultJournal(path, database_down,
+                                        retry_interval=0.01)
+        offline.append(tournament_id, id1, id2, False)
+        if offline.close(timeout=0.1):
+            raise ValueError("Results should wait while the database is down.")
+        journal.logger.disabled = False
+        # and are recorded when the journal is next used
+        results = useJournal(path, interval=0)
+        reportMatch(id3, id4, tournament_id)
+        reportMatch(id4, id3, tournament_id)
+        reportMatch(id1, id3, tournament_id)
+        if not flushJournal(timeout=5):
+            raise ValueError("Journaled results should be recorded.")
+        reportMatch(id1, id2, tournament_id)
+        flushJournal(timeout=5)
+        if len(results.rejected) != 0:
+            raise ValueError("A repeated result should be skipped, not "
+                             "rejected.")
+        # a result the database can't take doesn't hold up the next one
+        journal.logger.disabled = True
+        reportMatch(2 ** 40, id2, tournament_id)
+        reportMatch(id2, id4, tournament_id)
+        if not flushJournal(timeout=5):
+            raise ValueError("A rejected result should not block the rest.")
+        journal.logger.disabled = False
+        rejected = results.rejected
+    finally:
+        journal.logger.disabled = False
+        useJournal(None)
+        os.remove(path)
+    matches = dict((row[0], row[3]) for row in playerStandings(tournament_id))
+    if matches != {id1: 2, id2: 2, id3: 2, id4: 2}:
+        raise ValueError("Each journaled result should be recorded once.")
+    if [result for (result, error) in rejected] != [(tournament_id, 2 ** 40,
+                                                     id2, False)]:
+        raise ValueError("An out of range ID should be rejected.")
+
+    # a result that keeps failing for any other reason is set aside too
+    def record(results):
+        if (tournament_id, 0, 0, False) in results:
+            raise TypeError('bad result')
+        return [None] * len(results)
+
+    fd, path = tempfile.mkstemp(suffix='.journal')
+    os.close(fd)
+    try:
+        journal.logger.disabled = True
+        stuck = journal.ResultJournal(path, record, interval=0,
+                                      retry_interval=0.01, max_attempts=2)
+        stuck.append(tournament_id, 0, 0, False)
+        stuck.append(tournament_id, id1, id4, False)
+        if not stuck.close(timeout=5):
+            raise ValueError("A failing result should not block the rest.")
+        if stuck.rejected != [((tournament_id, 0, 0, False), 'bad result')]:
+            raise ValueError("A failing result should be rejected.")
+    finally:
+        journal.logger.disabled = False
+        os.remove(path)
+    print "    7j. Results can be journaled before they reach the database."
+
+
+def testStandingsFeed():
+    """
+    Subscribers to a tournament's standings should be sent each change as a
+    diff that leads to the new standings.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Live')
+    registerPlayers(["Bruno Walton", "Boots O'Neal", "Cathy Burton",
+                     "Diane Grant"], tournament_id)
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings(tournament_id)]
+    # without a database there are no notifications to LISTEN for
+    in_memory = '--memory' in sys.argv[1:]
+    feed = StandingsFeed(listen=not in_memory, interval=0)
+    try:
+        pushed = []
+        feed.subscribe(tournament_id, callback=pushed.append)
+        subscription = feed.subscribe(tournament_id)
+        standings = applyDiff([], subscription.get(timeout=5))
+        if standings != playerStandings(tournament_id):
+            raise ValueError("The first diff should hold the whole standings.")
+        if not in_memory:
+            time.sleep(0.2)  # until the feed is LISTENing
+        reportRound(tournament_id, [(id1, id2), (id3, id4)])
+        if in_memory:
+            feed.changed(tournament_id)
+        diff = subscription.get(timeout=5)
+        if diff is None or diff['tournament'] != tournament_id:
+            raise ValueError("A change should be pushed to subscribers.")
+        standings = applyDiff(standings, diff)
+        if standings != playerStandings(tournament_id):
+            raise ValueError("A diff should lead to the new standings.")
+        if len(pushed) != 2 or pushed[1] != diff:
+            raise ValueError("Callbacks should be sent the same diffs.")
+        try:
+            feed.subscribe('High Noon Live')
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Only a tournament ID can be subscribed to.")
+    finally:
+        started = time.time()
+        feed.close()
+    if time.time() - started > 1:
+        raise ValueError("Closing the feed should not wait for a poll.")
+    if subscription.get(timeout=5) is not None:
+        raise ValueError("Closing the feed should end its subscriptions.")
+    print "    7k. Standings changes are pushed to subscribers."
+
+
 def testPairings():
     deleteMatches()
     deletePlayers()
@@ -214,6 +754,62 @@ def testPairings():
     print "8. After one match, players with one win are paired."
 
 
+def testPairingsBacktrack():
+    """
+    The pairing engine should back up rather than leave players unpaired.
+    """
+    standings = [(1, "Twilight Sparkle"), (2, "Fluttershy"),
+                 (3, "Applejack"), (4, "Pinkie Pie")]
+    played = set([frozenset([3, 4])])
+    pairings = pairPlayers(standings, played)
+    actual_pairs = set([frozenset([p[0], p[2]]) for p in pairings])
+    if actual_pairs != set([frozenset([1, 3]), frozenset([2, 4])]):
+        raise ValueError(
+            "Pairing should avoid a rematch further down the standings.")
+    played.add(frozenset([1, 3]))
+    played.add(frozenset([1, 4]))
+    played.add(frozenset([1, 2]))
+    if pairPlayers(standings, played) is not None:
+        raise ValueError(
+            "Pairing should report when no complete round is possible.")
+    print "    8b. Pairing backs up to avoid rematches."
+
+
+def testPairingsMatching():
+    """
+    Matching mode should pair by record and find a complete round whenever
+    one exists.
+    """
+    standings = [(1, "Twilight Sparkle", 1), (2, "Fluttershy", 1),
+                 (3, "Applejack", 0), (4, "Pinkie Pie", 0),
+                 (5, "Purple Dinosaur", 0)]
+    played = set([frozenset([1, 3]), frozenset([2, 4])])
+    pairings = pairPlayersByMatching(standings, played, set([5]))
+    actual_pairs = set([frozenset([p[0], p[2]]) for p in pairings])
+    correct_pairs = set([
+        frozenset([1, 2]), frozenset([3, 5]), frozenset([4, None])])
+    if actual_pairs != correct_pairs:
+        raise ValueError(
+            "Matching should pair players with equal records and give the "
+            "bye to the lowest-ranked player without one.")
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('Race of the Century Part Trois')
+    registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack",
+                     "Pinkie Pie"], tournament_id)
+    standings = playerStandings(tournament_id)
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatch(id1, id2, tournament_id)
+    reportMatch(id3, id4, tournament_id)
+    pairings = swissPairings(tournament_id, mode='matching')
+    actual_pairs = set([frozenset([p[0], p[2]]) for p in pairings])
+    if actual_pairs != set([frozenset([id1, id3]), frozenset([id2, id4])]):
+        raise ValueError(
+            "After one match, players with one win should be paired.")
+    print "    8c. Matching mode pairs a complete round."
+
+
 def testOddPairings():
     """
     With an odd number of players, system should correctly assign byes.
@@ -258,16 +854,139 @@ def testOddPairings():
            "and bye is assigned.")
 
 
+def testPairingState():
+    """
+    The pairing state swissPairings() keeps up to date one round at a time
+    should always be the same as one built from scratch, and should be built
+    from scratch again whenever a player or a match goes missing.
+    """
+    deleteMatches()
+    deletePlayers()
+    deleteTournament()
+    tournament_id = createTournament('High Noon Ladder')
+    registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack",
+                     "Pinkie Pie", "Purple Dinosaur"], tournament_id)
+    fd, path = tempfile.mkstemp(suffix='.snap')
+    os.close(fd)
+
+    def rows():
+        """The tournament's players and matches, read from a snapshot."""
+        exportSnapshot(tournament_id, path)
+        saved = snapshot.readSnapshot(path)
+        return saved.players(), [row[:5] for row in saved.matchRows()]
+
+    def compared(standings, played, had_bye):
+        ids = [row[0] for row in standings]
+        pairs = set(frozenset([one, two]) for one in ids for two in ids
+                    if one < two and frozenset([one, two]) in played)
+        return standings, pairs, set(had_bye)
+
+    def check(incremental, message):
+        """Brings the kept state up to date, compares it with one built
+        from scratch, and checks whether it was kept or started again."""
+        before = tournament._pairing_states.get(tournament_id)
+        kept = compared(*tournament._load_pairing_state(tournament_id))
+        after = tournament._pairing_states.get(tournament_id)
+        players, matches = rows()
+        fresh = pairing_state.PairingState()
+        for row in players:
+            fresh.addPlayer(row[0], row[2])
+        for row in matches:
+            fresh.applyMatch(*row)
+        if kept != compared(fresh.standings(), fresh.played(),
+                            fresh.had_bye):
+            raise ValueError(message)
+        if (after is before) != incremental:
+            raise ValueError(message + " (%s)" % ("it should have been kept"
+                                                  if incremental else
+                                                  "it should start again"))
+
+    try:
+        pairings = swissPairings(tournament_id)
+        reportRound(tournament_id, [(pairing[0], pairing[2] or 0)
+                                    for pairing in pairings])
+        check(True, "A round's results should be applied to the state.")
+        [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4),
+         (pid5, pname5, pid6, pname6)] = swissPairings(tournament_id)
+        reportMatch(pid1, pid2, tournament_id, True)
+        reportMatch(pid3, pid4, tournament_id)
+        reportMatch(pid5, 0, tournament_id)
+        check(True, "Ties and byes should be applied to the state.")
+
+        registerPlayer("Rainbow Dash", tournament_id)
+        check(False, "A new player should be in the state.")
+        players, matches = rows()
+        unAssignPlayer(players[0][1], tournament_id)
+        check(False, "A player who has left should not be in the state.")
+        deleteMatches(tournament_id)
+        [id1, id2, id3, id4, id5] = [row[0] for row in
+                                     playerStandings(tournament_id)]
+        reportMatch(id1, id2, tournament_id)
+        check(False, "Deleted matches should not be in the state.")
+
+        # a match given a lower ID than one already read, but committed
+        # after it, is only noticed by its count
+        reportMatch(id3, id4, tournament_id)
+        players, matches = rows()
+
+        class Rows(object):
+            visible = matches[1:]
+
+            def pairingCounts(self, tournament):
+                return (len(players), max(row[0] for row in players),
+                        len(self.visible))
+
+            def pairingPlayers(self, tournament):
+                return [(row[0], row[2]) for row in players]
+
+            def pairingMatches(self, tournament, after):
+                return [row for row in self.visible if row[0] > after]
+
+        late = Rows()
+        state, new = tournament._sync_pairing_state(None, late,
+                                                    tournament_id)
+        for row in new:
+            state.applyMatch(*row)
+        late.visible = matches
+        synced, new = tournament._sync_pairing_state(state, late,
+                                                     tournament_id)
+        if synced is state or len(new) != 2:
+            raise ValueError("A match committed late should make the state "
+                             "start again.")
+    finally:
+        os.remove(path)
+    print "    8d. Pairing state is kept up to date one round at a time."
+
+
 if __name__ == '__main__':
+    if '--memory' in sys.argv[1:]:
+        # run every test against the in-memory backend, without a database
+        useBackend('memory')
     testDeleteMatches()
     testDelete()
+    testPartitionLocks()
     testCount()
+    testMetrics()
     testRegister()
+    testSessionRollback()
     testRegisterCountDelete()
+    testBulkRegister()
     testStandingsBeforeMatches()
     testReportMatches()
     testReportMatchesWithTies()
     testReportMatchesNoRematch()
+    testReportRound()
+    testStandingsCache()
+    testTiebreaks()
+    testStreaming()
+    testPairAll()
+    testStoredRounds()
+    testSnapshot()
+    testJournal()
+    testStandingsFeed()
     testPairings()
+    testPairingsBacktrack()
+    testPairingsMatching()
     testOddPairings()
+    testPairingState()
     print "Success!  All tests pass!"